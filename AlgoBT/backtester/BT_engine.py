@@ -1,12 +1,24 @@
 import polars as pl
 from typing import Optional
 import numpy as np
-from BT_utils import Equity, Indicator, onrow, Duration
-from orders import OrderSim, Order, OrderBook
+from BT_utils import Equity, Indicator, Timeline, onrow, Duration, toEpoch, OHLCV
+from orders import OrderSim, Order, OrderBook, FillModel, LiveFillModel
+from ledger import Ledger
+from resample import Resampler, IncrementalResampler
+from profiler import Profiler, profiled
+from checkpoint import Checkpointer, loadState
 from contextlib import contextmanager
-from functools import wraps
+import logging
+from functools import wraps, partial
+from types import SimpleNamespace
 from abc import ABC, abstractmethod
 
+logger = logging.getLogger("AlgoBT.BTest")  # Event log. Fills are logged at INFO level.
+
+TIMELINE_CHUNK = 65_536  # Ticks converted to Python objects at a time in BTest.run.
+AVG_VOLUME_BARS = 100  # Bars in the average volume used by the fill model.
+RESULT_KEYS = ("cash", "equity", "n_fills", "total_return", "sharpe")  # Keys of BTest.results().
+
 
 class BTest(ABC):
     """Parent class for backtesting engine.
@@ -23,6 +35,8 @@ class BTest(ABC):
 
         def wrapped_init(self, *args, **kwargs):
             self.equities = []
+            self._data = SimpleNamespace()  # Equities by name. Passed to @onrow handlers.
+            self.ledger = Ledger()
             original_init(self, *args, **kwargs)
             self.__postinit__()
 
@@ -32,9 +46,10 @@ class BTest(ABC):
         self.orderSim = OrderSim()
         self.orderBook = OrderBook([])
         self._handlers = {}
+        self.profiler = None  # Profiler of the current run, if any.
         self.__registerHandlers()
 
-        if not hasattr(self, "cash"):
+        if self.ledger.cash is None:
             print("Cash balance not set. Defaulting to 100k.")
             self.cash = 100000
 
@@ -42,36 +57,258 @@ class BTest(ABC):
             print("Comision percent not set. Defaulting to 0.05%")
             self.commision_per = 0.0005
     
-    def __createTimeline(self) -> list:
-        timeline = []
-        for eq in self.equities:
-            timeline.extend(list(zip(eq.df["timestamp"], [eq.timeframe] * len(eq.df))))
-        timeline = sorted(set(timeline), key=lambda x: x[0])  # Convert to set and sort by first value.
-        return timeline
+    def __createTimeline(self) -> Timeline:
+        return Timeline(self.equities)
 
     @abstractmethod
     def onRow(self, data_alias, timeframe: Duration):
         pass
 
-    def run(self):
-        timeline = self.__createTimeline()
-        for timestamp, timeframe in timeline:
-            self.current_timestamp = timestamp
-            for eq in self.equities:
-                eq.updateIndicators(self.current_timestamp)
-            self.__triggerHandler(timeframe=timeframe)
+    def run(self, profiler: Optional[Profiler] = None, checkpoint: Optional[Checkpointer] = None,
+            resume=None, overrides: Optional[dict] = None):
+        """Runs the strategy over the equities' bars.
+
+        :param profiler: optional Profiler, to time each phase of the run. Read it afterwards with
+                         profiler.summary(), or print(profiler).
+        :param checkpoint: optional Checkpointer, to snapshot the run every few ticks.
+        :param resume: snapshot to continue from instead of the first bar: a path, a Checkpointer directory (its
+                       latest snapshot) or bytes from checkpoint.snapshot(). The strategy must be built with the
+                       same data as the run that wrote it. The results are the same as an uninterrupted run's.
+        :param overrides: attributes to set after restoring the snapshot, to fork the run with other parameters.
+        """
+        first_tick = 0
+        if resume is not None:
+            first_tick = loadState(self, resume)
+        for name, value in (overrides or {}).items():
+            setattr(self, name, value)
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.start(self.timeframes())
+        self.timeline = timeline = self.__createTimeline()
+        equities = self.equities
+        followers = [eq for eq in equities if eq._unaligned]  # Equities with indicators on their own timestamps.
+        handlers = self.__compileHandlers(timeline.timeframes)
+        ledger = self.ledger
+        if resume is None:
+            ledger.start(equities, len(timeline))
+        else:
+            ledger.resume(len(timeline))
+        if checkpoint is not None:
+            checkpoint.begin(self, first_tick)
+        resting = self.orderBook.resting
+        ptr = timeline.ptr
+        n_ticks = len(timeline)
+        # Snapshots are taken on multiples of checkpoint.every, between chunks, so chunks also stop there.
+        next_save = n_ticks if checkpoint is None else (first_tick // checkpoint.every + 1) * checkpoint.every
+        start = first_tick
+        while start < n_ticks:
+            if start == next_save:
+                checkpoint.save(self, start)
+                next_save += checkpoint.every
+            stop = min(start + TIMELINE_CHUNK, next_save, n_ticks)
+            # Convert one chunk at a time so the loop reads plain ints without holding the whole timeline as objects.
+            timestamps = timeline.timestamps[start:stop].tolist()
+            codes = timeline.codes[start:stop].tolist()
+            bounds = ptr[start:stop + 1].tolist()
+            eq_ids = timeline.eq_ids[bounds[0]:bounds[-1]].tolist()
+            rows = timeline.rows[bounds[0]:bounds[-1]].tolist()
+            base = bounds[0]
+            for i in range(stop - start):
+                self.current_timestamp = timestamps[i]
+                if profiler is not None:
+                    self.__profiledTick(profiler, start + i, bounds[i] - base, bounds[i + 1] - base, eq_ids, rows,
+                                        codes[i], handlers, followers)
+                    continue
+                for j in range(bounds[i] - base, bounds[i + 1] - base):
+                    eq = equities[eq_ids[j]]
+                    eq.setRow(rows[j])
+                    if eq.eq_id in resting:
+                        self.__matchOrders(eq)
+                for eq in followers:
+                    eq.followTimestamp(self.current_timestamp)
+                handlers[codes[i]]()
+                ledger.mark(self.current_timestamp)
+            start = stop
+        self.fills = ledger.fillsFrame()
+        self.equity_curve = ledger.curveFrame()
+        if profiler is not None:
+            profiler.stop(self)
+
+    def __profiledTick(self, profiler, tick, first, last, eq_ids, rows, code, handlers, followers):
+        """One tick of run(), the same as its loop body, timing each phase."""
+        clock = profiler.clock
+        equities, resting = self.equities, self.orderBook.resting
+        matching = 0.0
+        t0 = clock()
+        for j in range(first, last):
+            eq = equities[eq_ids[j]]
+            eq.setRow(rows[j])
+            if eq.eq_id in resting:
+                m0 = clock()
+                self.__matchOrders(eq)
+                matching += clock() - m0
+        t1 = clock()
+        for eq in followers:
+            eq.followTimestamp(self.current_timestamp)
+        t2 = clock()
+        handlers[code]()
+        t3 = clock()
+        self.ledger.mark(self.current_timestamp)
+        t4 = clock()
+        profiler.recordTick(tick, self.current_timestamp, code, last - first, t1 - t0 - matching, matching,
+                            t2 - t1, t3 - t2, t4 - t3)
+
+    def timeframes(self) -> list:
+        """Timeframes of the equities, in order of first appearance. Their index is the timeline's code."""
+        timeframes = []
+        for eq in self.equities:
+            if eq.timeframe not in timeframes:
+                timeframes.append(eq.timeframe)
+        return timeframes
+
+    def runStream(self, feed, lookback: int = 1000, fill_limit: int = 100_000) -> None:
+        """Runs the strategy on bars as they arrive from an iterator, instead of on the equities' DataFrames.
+
+        Memory stays constant however long the feed runs: OHLCV and streaming indicators only keep their
+        lookback, the equity curve only keeps the latest mark, self.fills the latest fill_limit fills, and the
+        order book only its open orders, not orderBook.all_orders. The same handlers as in run() are called,
+        so a strategy runs unchanged in both modes. Equities added with addTimeframe() are resampled as the
+        base bars arrive. An equity's row counts its bars pushed so far, as it indexes its bars in run().
+        :param feed: iterable of feeds.Bar, or of lists of Bars sharing a timestamp, which form one tick.
+                     See feeds.py for replays of frames or a BarStore.
+        :param lookback: bars of OHLCV history kept per equity.
+        :param fill_limit: latest fills kept in self.fills. ledger.n_fills still counts every fill.
+        """
+        on_bars = self.__startStream(lookback, fill_limit)
+        for bars in feed:
+            on_bars(bars)
+        self.__endStream()
+
+    async def runStreamAsync(self, feed, lookback: int = 1000, fill_limit: int = 100_000) -> None:
+        """Async version of runStream, for async generators of bars such as feeds.socketFeed."""
+        on_bars = self.__startStream(lookback, fill_limit)
+        async for bars in feed:
+            on_bars(bars)
+        self.__endStream()
+
+    def __startStream(self, lookback: int, fill_limit: int):
+        equities = self.equities
+        timeframes = self.timeframes()
+        handlers = self.__compileHandlers(timeframes)
+        eq_codes = [timeframes.index(eq.timeframe) for eq in equities]
+        by_name = {eq.name: eq for eq in equities if eq.base is None}
+        children = {}  # eq_id of a base equity -> [(resampled equity, IncrementalResampler)]
+        for eq in equities:
+            eq.startStream(lookback)
+            eq.fill_model = LiveFillModel(AVG_VOLUME_BARS)
+            if eq.base is not None:
+                resampler = IncrementalResampler(eq.timeframe, eq.base.timeframe, eq.resampler.available)
+                children.setdefault(eq.base.eq_id, []).append((eq, resampler))
+        followers = [eq for eq in equities if eq._unaligned]
+        ledger = self.ledger
+        ledger.start(equities, 0, history=False, fill_limit=fill_limit)
+        self.orderBook.history = False
+        resting = self.orderBook.resting
+        fired = [False] * len(handlers)
 
-    def initEquity(self, ticker: str, data: pl.DataFrame, timeframe: str, name:str) -> Equity:
+        def onBars(bars):
+            if not isinstance(bars, list):
+                bars = [bars]
+            self.current_timestamp = timestamp = toEpoch(bars[0].timestamp)
+            for bar in bars:
+                eq = by_name.get(bar.name)
+                if eq is None:
+                    raise ValueError(f"Bar for unknown equity {bar.name}. Use initEquity() first.")
+                values = (bar.open, bar.high, bar.low, bar.close, bar.volume)
+                eq.pushBar(*values)
+                if eq.eq_id in resting:
+                    self.__matchOrders(eq)
+                fired[eq_codes[eq.eq_id]] = True
+                for child, resampler in children.get(eq.eq_id, ()):
+                    for completed in resampler.update(timestamp, *values):
+                        child.pushBar(*completed[2:])
+                        fired[eq_codes[child.eq_id]] = True
+            for eq in followers:
+                eq.followTimestamp(timestamp)
+            for code, handler in enumerate(handlers):
+                if fired[code]:
+                    fired[code] = False
+                    handler()
+            ledger.mark(timestamp)
+
+        return onBars
+
+    def __endStream(self) -> None:
+        self.fills = self.ledger.fillsFrame()
+        self.equity_curve = self.ledger.curveFrame()
+
+    def results(self) -> dict:
+        """Summary of a finished run, with the keys of RESULT_KEYS. Gathered per run by ParallelRunner.
+
+        sharpe is the mean over the standard deviation of the per tick returns of the equity curve, not
+        annualized, as in ResearchStrat.sweep(). It is None after runStream(), which only keeps the latest mark.
+        """
+        ledger = self.ledger
+        equity = ledger.lastMark()
+        sharpe = None
+        if ledger.history and ledger.n_marks > 2:
+            curve = ledger.curve_cash[:ledger.n_marks] + ledger.curve_value[:ledger.n_marks]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                returns = np.diff(curve) / curve[:-1]
+                std = returns.std(ddof=1)
+                if std > 0:
+                    sharpe = float(returns.mean() / std)
+        return {"cash": ledger.cash, "equity": equity, "n_fills": ledger.n_fills,
+                "total_return": equity / ledger.starting_cash - 1 if ledger.starting_cash else None,
+                "sharpe": sharpe}
+
+    def stats(self, periods_per_year: float = 252) -> tuple:
+        """Trade table and performance metrics of a finished run, from the fills ledger and equity curve.
+
+        MAE/MFE are added when the equities' bars are available, i.e. after run() but not runStream().
+        See analytics.ledgerMetrics().
+        :param periods_per_year: ticks per year, used to annualize sharpe and sortino.
+        :return: (trades, metrics) DataFrames.
+        """
+        from analytics import ledgerMetrics  # Part of the research package, only needed here.
+        bars = {eq.name: eq.df for eq in self.equities if eq.base is None and len(eq.df)}
+        return ledgerMetrics(self.fills, self.equity_curve, bars or None, periods_per_year)
+
+    def initEquity(self, ticker: str, data: pl.DataFrame, timeframe: str, name:str, dtype=np.float64) -> Equity:
         """Creates an Equity class and stores data
 
+        The numeric columns of data are copied once into the equity's block, see Equity, and its other columns are
+        kept in equity.df as they are. data isn't kept, so it can be released after this call.
         :param ticker: Ticker of equtiy
         :param data: DataFrame of OHLC(V) data
         :param timeframe: timeframe of data. Lowest timeframe of all timeframes to be added per this equity.
         :param name: name of equtiy class instance.
+        :param dtype: np.float32 or np.float64. Type of the stored bars and column indicators. float32 halves
+                      their memory, and prices are then read at single precision.
         """
-        eq = Equity(df=data, ticker=ticker, bt_object=self, timeframe=timeframe, name=name)
-        self.__addDefaultIndicators(data, eq)  # Add OHLCV as indicators.
+        eq = Equity(df=data, ticker=ticker, bt_object=self, timeframe=timeframe, name=name, dtype=dtype)
+        self.__addDefaultIndicators(eq)  # Add OHLCV as indicators.
+        eq.eq_id = len(self.equities)
+        eq.fill_model = FillModel(eq.df, AVG_VOLUME_BARS)
         self.equities.append(eq)
+        setattr(self._data, name, eq)
+        return eq
+
+    def addTimeframe(self, equity: Equity, timeframe: str, name: str, available: str = "end") -> Equity:
+        """Adds a higher timeframe of an equity, resampled from its bars, e.g. 1h bars of a 1m equity.
+
+        The resampled bars enter the timeline when they complete, so @onrow(timeframe=timeframe) handlers see
+        them without look-ahead. Orders placed on the returned equity are routed to the base equity.
+        :param equity: Equity() instance to resample.
+        :param timeframe: timeframe to build. Must be a multiple of equity's timeframe.
+        :param name: name of the new equity class instance.
+        :param available: "end" or "last". When a bar becomes known, see Resampler.
+        """
+        base = equity.base if equity.base is not None else equity
+        resampler = Resampler(timeframe, base.timeframe, available)
+        eq = self.initEquity(base.ticker, resampler.resample(base.df), timeframe=timeframe, name=name,
+                             dtype=base.dtype)
+        eq.base, eq.resampler = base, resampler
         return eq
 
     def addIndicator(self, df, equity_object: Equity, name, col_name, calc_function=None):
@@ -87,31 +324,127 @@ class BTest(ABC):
             df = calc_function(equity_object.df)
         equity_object.addIndicator(df, col_name, name)
 
-    def __addDefaultIndicators(self, df, equity_object: Equity):
-        self.addIndicator(df, equity_object, "open", "open")
-        self.addIndicator(df, equity_object, "high", "high")
-        self.addIndicator(df, equity_object, "low", "low")
-        self.addIndicator(df, equity_object, "close", "close")
-        self.addIndicator(df, equity_object, "volume", "volume")
+    def addStreamingIndicator(self, equity_object: Equity, name, indicator):
+        """Adds a built in streaming indicator, updated in O(1) per bar, to an existing equity object.
 
+        :param equity_object: Existing Equtiy() instance to add indicator.
+        :param name: Name of indicator to be added. Will become Equity() atrribuite.
+        :param indicator: StreamingIndicator instance from indicators.py, such as SMA(20) or RSI(14).
+        """
+        equity_object.addStreamingIndicator(indicator, name)
+
+    def __addDefaultIndicators(self, equity_object: Equity):
+        for col in OHLCV:
+            equity_object.addColumnIndicator(col, col)
+
+    @profiled("market orders")
+    def marketOrders(self, equity, qtys, order_sides):
+        """Batch version of marketOrder. Fills several market orders on the equity's current bar in one call.
+
+        :param equity: Equity() instance to trade.
+        :param qtys: array of order quantities.
+        :param order_sides: sequence of order sides, one per quantity.
+        :return: array of order IDs.
+        """
+        if equity.base is not None:
+            equity = equity.base
+        if equity.row < 0:
+            raise ValueError(f"Equity {equity.name} has no bars yet at {self.current_timestamp}.")
+        prices = np.full(len(qtys), equity.close[0])
+        oids, prices_filled, costs = self.orderSim.fillMarketOrders(prices, qtys, order_sides, equity.fill_model,
+                                                                    equity.fill_row)
+        self.ledger.recordBatch(oids, equity.eq_id, self.current_timestamp, order_sides, qtys, prices_filled,
+                                costs * self.commision_per)
+        if logger.isEnabledFor(logging.INFO):
+            for side, qty, price_filled, cost in zip(order_sides, qtys, prices_filled, costs):
+                logger.info(f"{side} {qty} {equity.ticker} at {price_filled} for {cost}")
+        return oids
+
+    @property
+    def cash(self) -> float:
+        return self.ledger.cash
+
+    @cash.setter
+    def cash(self, value: float) -> None:
+        self.ledger.cash = value
+
+    @profiled("market orders")
     def marketOrder(self, equity, qty: float, order_side: str):
-        order, cost = self.orderSim.createMarketOrder(price=open, qty=qty, time=self.current_timestamp,
-                                                    side=order_side, open=self.open, high=self.high, low=self.low,
-                                                    close=self.close, volume=self.volume, avg_volume=self.avg_volume)
+        """Fills a market order at the close of the equity's current bar, with simulated slippage.
+
+        :param equity: Equity() instance to trade.
+        :param qty: Amount of shares to use in order.
+        :param order_side: One of the following: "BUY", "SELL", "SHORT", "COVER"
+        :return: the order ID.
+        """
+        if equity.base is not None:
+            equity = equity.base
+        if equity.row < 0:
+            raise ValueError(f"Equity {equity.name} has no bars yet at {self.current_timestamp}.")
+        oid, price_filled, cost = self.orderSim.fillMarketOrder(equity.close[0], qty, order_side, equity.fill_model,
+                                                                equity.fill_row)
+        self.ledger.record(oid, equity.eq_id, self.current_timestamp, order_side, qty, price_filled,
+                           cost * self.commision_per)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"{order_side} {qty} {equity.ticker} at {price_filled} for {cost}")
+        return oid
+
+    def limitOrder(self, equity, qty: float, order_side: str, price: float):
+        """Places a resting limit order. It fills on a later bar that trades through price.
+
+        :param equity: Equity() instance to trade.
+        :param qty: Amount of shares to use in order.
+        :param order_side: One of the following: "BUY", "SELL", "SHORT", "COVER"
+        :param price: limit price.
+        :return: the order ID.
+        """
+        return self.__placeRestingOrder("LIMIT", equity, qty, order_side, price)
+
+    def stopOrder(self, equity, qty: float, order_side: str, price: float):
+        """Places a resting stop order. It becomes a market order on a later bar that trades through price.
+
+        :param equity: Equity() instance to trade.
+        :param qty: Amount of shares to use in order.
+        :param order_side: One of the following: "BUY", "SELL", "SHORT", "COVER"
+        :param price: stop price.
+        :return: the order ID.
+        """
+        return self.__placeRestingOrder("STOP", equity, qty, order_side, price)
+
+    def cancelOrder(self, oid: int) -> bool:
+        """Cancels an open limit or stop order.
+
+        :return: True if the order was open and is now canceled.
+        """
+        order = self.orderBook.open_orders.get(oid)
+        if order is None:
+            return False
+        self.orderBook.removeOpenOrder(order)
+        order.status = "CANCELED"
+        return True
+
+    @profiled("resting order placement")
+    def __placeRestingOrder(self, type_, equity, qty, order_side, price):
+        if order_side not in ("BUY", "SELL", "SHORT", "COVER"):
+            raise ValueError(f"Invalid order side {order_side}. Use BUY, SELL, SHORT or COVER.")
+        if equity.base is not None:
+            equity = equity.base
+        order = self.orderSim.createRestingOrder(type_, price, qty, self.current_timestamp, order_side, equity.eq_id)
         self.orderBook.addOrder(order)
-        if order_side in ("BUY", "COVER"):
-            self.cash -= cost
-            self.cash -= cost * self.commision_per
-        elif order_side in ("SELL", "SHORT"):
-            self.cash += cost
-            self.cash -= cost * self.commision_per
-        print(f"{order_side} {qty} {equity.ticker} at {order.price_filled} for {cost}")
-
-    def limitOrder():
-        return
-
-    def stopOrder():
-        pass
+        return order.oid
+
+    def __matchOrders(self, equity: Equity) -> None:
+        """Fills the resting orders of equity triggered by its current bar."""
+        triggered = self.orderBook.matchBar(equity.eq_id, equity.high[0], equity.low[0])
+        if not triggered:
+            return
+        for order in triggered:
+            price_filled, cost = self.orderSim.fillRestingOrder(order, equity.fill_model, equity.fill_row)
+            order.status, order.price_filled, order.time_filled = "FILLED", price_filled, self.current_timestamp
+            self.ledger.record(order.oid, equity.eq_id, self.current_timestamp, order.side, order.qty,
+                               price_filled, cost * self.commision_per)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f"{order.type_} {order.side} {order.qty} {equity.ticker} at {price_filled} for {cost}")
 
     def __registerHandlers(self):
         # Automatically register methods decorated with @onrow
@@ -122,9 +455,16 @@ class BTest(ABC):
                 timeframe = params.get("timeframe", "default")
                 self._handlers[timeframe] = method
 
-    def __triggerHandler(self, timeframe="default", data=None):
-        handler = self._handlers.get(timeframe)
-        if handler:
-            handler(data)
-        else:
-            raise ValueError(f"No handler for timeframe {timeframe}")
+    def __compileHandlers(self, timeframes: list) -> list:
+        """Resolves the handler of each timeframe code ahead of the run.
+
+        Handlers registered without a timeframe are used for timeframes with no handler of their own.
+        Each entry is the undecorated handler bound to self and the equity namespace, so a tick is one call.
+        """
+        table = []
+        for timeframe in timeframes:
+            handler = self._handlers.get(timeframe, self._handlers.get("default"))
+            if handler is None:
+                raise ValueError(f"No handler for timeframe {timeframe}")
+            table.append(partial(getattr(handler, "__wrapped__", handler), self, self._data))
+        return table
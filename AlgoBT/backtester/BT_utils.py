@@ -1,61 +1,321 @@
 from dataclasses import dataclass
 from typing import Optional, Literal
-from imports import *
+import datetime
+from datetime import datetime as dt
+import numpy as np
+import polars as pl
 from functools import wraps
-from types import SimpleNamespace
+import re
+from indicators import RingBuffer
+
+OHLCV = ("open", "high", "low", "close", "volume")
+BLOCK_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
 
 
 class Equity:
-    __slots__ = ("indicators", "bt_object", "ticker", "timeframe", "name", "df")
+    # __dict__ holds the indicators, so Equity.close resolves as a plain attribute.
+    __slots__ = ("indicators", "bt_object", "ticker", "timeframe", "name", "df", "timestamps", "row", "block",
+                 "columns", "dtype", "eq_id", "_aligned", "_unaligned", "_streaming", "_fed", "fill_model", "base",
+                 "resampler", "_live", "__dict__")
 
-    def __init__(self, df: pl.DataFrame, ticker: str, bt_object: object, timeframe, name):
-        self.df = df
+    def __init__(self, df: pl.DataFrame, ticker: str, bt_object: object, timeframe, name, dtype=np.float64):
+        """:param dtype: np.float32 or np.float64. The bars and column indicators are stored as this type.
+                      float32 halves their memory, at single precision.
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in BLOCK_DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}. Use np.float32 or np.float64.")
+        if missing := [col for col in OHLCV if col not in df.columns]:
+            raise ValueError(f"Columns {missing} are missing from the data of equity {name}.")
+        timestamps = df["timestamp"].dt.epoch("us").to_numpy()
+        if len(timestamps) > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+            df = df.sort("timestamp")
+            timestamps = df["timestamp"].dt.epoch("us").to_numpy()
+        self.timestamps = timestamps  # Epoch microseconds, sorted ascending.
+        self.dtype = dtype
         self.name = name
         self.timeframe = timeframe
         self.ticker = ticker
         self.bt_object = bt_object
+        self.row = -1  # Row index of the current bar. -1 until the first bar is reached.
+        self.eq_id = None  # Position of this equity in BTest.equities. Set by BTest.initEquity.
+        self.fill_model = None  # Precomputed slippage inputs. Set by BTest.initEquity.
+        self.base = None  # Equity this one is resampled from. Orders are routed to it. Set by BTest.addTimeframe.
+        self.resampler = None  # Resampler that built this equity from base. Set by BTest.addTimeframe.
+        self._live = None  # OHLCV ring buffers, once switched to streaming by startStream().
         self.indicators = {}  # Dict of indicators. Includes OHLCV.
+        self._aligned = []  # ColumnViews of the block. They follow self.row.
+        self._unaligned = []  # Indicators with their own timestamps. They follow the timeline timestamp.
+        self._streaming = []  # (StreamingIndicator, input arrays) pairs, fed one bar at a time.
+        self._fed = -1  # Last row fed to the streaming indicators.
+
+        # Every numeric column is a row of the block, which the bars, the column indicators, the fill model and
+        # self.df all view. Other columns, such as a symbol, are kept in self.df as they are.
+        names = [*OHLCV, *[col for col, type_ in df.schema.items()
+                           if type_.is_numeric() and col not in OHLCV and col != "timestamp"]]
+        self.columns = {col: j for j, col in enumerate(names)}  # Column name -> row of the block.
+        self.block = self._blockRows(df, names)
+        time_zone = df.schema["timestamp"].time_zone
+        self.df = pl.DataFrame([pl.Series("timestamp", timestamps).cast(pl.Datetime("us", time_zone))
+                                if col == "timestamp" else df[col] for col in df.columns])
+        self._bindBlock()
+
+    def _blockRows(self, df: pl.DataFrame, names: list) -> list:
+        """One array per column. Columns Polars can hand out as self.dtype without a copy, such as the frames
+        attached from SharedFrames, are used in place, so parallel runs share them instead of copying them per run.
+        The others are copied into one contiguous array, one row per column.
+        """
+        rows = {}
+        for col in names:
+            try:
+                values = df[col].to_numpy(allow_copy=False)
+            except RuntimeError:  # Nulls or several chunks.
+                continue
+            if values.dtype == self.dtype:
+                rows[col] = values
+        copied = [col for col in names if col not in rows]
+        storage = np.empty((len(copied), len(self.timestamps)), dtype=self.dtype)
+        for k, col in enumerate(copied):
+            storage[k] = df[col].to_numpy()
+            rows[col] = storage[k]
+        return [rows[col] for col in names]
+
+    def _bindBlock(self) -> None:
+        """Points self.df, the column indicators, the fill model and the streaming inputs at the current block."""
+        block, columns = self.block, self.columns
+        series = {s.name: s for s in self.df.get_columns() if s.name not in columns}  # Timestamps and non-numeric.
+        series.update((col, pl.Series(col, block[j])) for col, j in columns.items())
+        order = [*self.df.columns, *[col for col in columns if col not in self.df.columns]]
+        self.df = pl.DataFrame([series[col] for col in order])
+        for ind in self._aligned:
+            ind.values = block[columns[ind.column]]
+        if self.fill_model is not None:
+            for col in ("open", "close", "volume"):
+                setattr(self.fill_model, col, block[columns[col]])
+        self._streaming = [(ind, [block[columns[col]] for col in ind.inputs]) for ind, _ in self._streaming]
+
+    def _addColumn(self, name: str, values: np.ndarray) -> None:
+        """Appends a copy of values to the block."""
+        if name in self.columns:
+            raise ValueError(f"Equity {self.name} already has a column {name} with other values. "
+                             "Please use another name.")
+        self.columns[name] = len(self.block)
+        self.block.append(np.array(values, dtype=self.dtype))
+        self._bindBlock()
+
+    def updateIndicators(self, cur_timestamp) -> None:
+        """Moves every indicator to cur_timestamp. Used outside of the precomputed timeline."""
+        cur_timestamp = toEpoch(cur_timestamp)
+        self.setRow(int(np.searchsorted(self.timestamps, cur_timestamp, side="right")) - 1)
+        self.followTimestamp(cur_timestamp)
 
-    def updateIndicators(self, cur_timestamp: pl.Datetime) -> None:
-        for _, ind in self.indicators.items():
+    def setRow(self, row: int) -> None:
+        """Moves the equity, and the column indicators that read its row, to row."""
+        self.row = row
+        if row > self._fed and self._streaming:
+            self._feedStreaming(row)
+
+    def _feedStreaming(self, row: int) -> None:
+        for r in range(self._fed + 1, row + 1):
+            for ind, inputs in self._streaming:
+                ind.update(*[values[r] for values in inputs])
+        self._fed = row
+
+    def followTimestamp(self, cur_timestamp: int) -> None:
+        """Advances the indicators that have their own timestamps to cur_timestamp (epoch microseconds)."""
+        for ind in self._unaligned:
             ind.getKnownData(cur_timestamp)
 
+    def startStream(self, lookback: int) -> None:
+        """Switches the equity to bars pushed one at a time by pushBar(), for BTest.runStream.
+
+        OHLCV become ring buffers of the last lookback bars, read the same way as before, e.g. equity.close[0].
+        The DataFrame and the block are released. Other column indicators get their own copy of their column and
+        follow the stream's timestamps, and streaming indicators are fed from the pushed bars, so they may only
+        read OHLCV.
+        :param lookback: bars of OHLCV history kept.
+        """
+        for ind, _ in self._streaming:
+            if missing := [col for col in ind.inputs if col not in OHLCV]:
+                raise ValueError(f"Indicator {ind.name} reads {missing}, which aren't available when streaming.")
+        self._streaming = [(ind, [OHLCV.index(col) for col in ind.inputs]) for ind, _ in self._streaming]
+        for view in self._aligned:
+            if view.name not in OHLCV:
+                indicator = Indicator(self.timestamps, view.values.copy(), self.timeframe, view.name)
+                self._unaligned.append(indicator)
+                self._bindIndicator(indicator, view.name)
+        for ind in self._unaligned:
+            ind.cursor = -1
+        self._aligned = []
+        self._live = [RingBuffer(lookback) for _ in OHLCV]
+        for name, buffer in zip(OHLCV, self._live):
+            setattr(self, name, buffer)
+            self.indicators[name] = buffer
+        # Empty, not sliced, so nothing still points into the released data.
+        self.df = pl.DataFrame(schema=self.df.schema)
+        self.block = [np.empty(0, dtype=self.dtype) for _ in self.block]
+        self.timestamps = np.empty(0, dtype=self.timestamps.dtype)
+        self.row = -1
+
+    def pushBar(self, open, high, low, close, volume) -> None:
+        """Appends the next bar in streaming mode. It becomes the current bar, and row counts it as in run()."""
+        values = (open, high, low, close, volume)
+        for buffer, value in zip(self._live, values):
+            buffer.append(value)
+        for ind, inputs in self._streaming:
+            ind.update(*[values[i] for i in inputs])
+        self.fill_model.update(*values)
+        self.row += 1
+
+    @property
+    def fill_row(self) -> int:
+        """Row of the current bar in fill_model. When streaming, it only holds the current bar, at row 0."""
+        return self.row if self._live is None else 0
+
     def addIndicator(self, df, col_name, name):
         """Usage:\n
         Equity.name[index]\n
         Ex: SPY.close[1]\n
 
+        An indicator with this equity's timestamps is a view of a column of the block. If the column is already
+        in the block with the same values, e.g. it was in the equity's frame, it isn't copied again.
         :param df: dataframe containing timestamp and indicator columns.
         :param col_name: name of the indicator column indide the column.
         :param name: name of indicator for refrence.
         """
-        indicator = Indicator(df.select("timestamp", col_name), self.timeframe, name)
+        timestamps = df["timestamp"].dt.epoch("us").to_numpy()
+        values = df[col_name].to_numpy().astype(self.dtype, copy=False)
+        if not np.array_equal(timestamps, self.timestamps):
+            indicator = Indicator(timestamps, values, self.timeframe, name)
+            self._unaligned.append(indicator)
+            self._bindIndicator(indicator, name)
+            return
+        column = self.columns.get(col_name)
+        if column is None or not np.array_equal(self.block[column], values, equal_nan=True):
+            self._addColumn(name, values)
+            col_name = name
+        self.addColumnIndicator(col_name, name)
+
+    def addColumnIndicator(self, col_name, name):
+        """Adds an indicator viewing a column already in the block, such as one of the equity's frame columns.
+
+        :param col_name: name of the column, see Equity.columns.
+        :param name: name of indicator for refrence.
+        """
+        if col_name not in self.columns:
+            raise ValueError(f"Column {col_name} is not in equity {self.name}.")
+        view = ColumnView(self, col_name, self.timeframe, name)
+        self._aligned.append(view)
+        self._bindIndicator(view, name)
+
+    def addStreamingIndicator(self, indicator, name):
+        """Adds an indicator that updates incrementally as bars arrive. Accessed the same way as addIndicator().
+
+        :param indicator: StreamingIndicator instance, such as SMA(20) or ATR(14).
+        :param name: name of indicator for refrence.
+        """
+        missing = [col for col in indicator.inputs if col not in self.columns]
+        if missing:
+            raise ValueError(f"Columns {missing} required by indicator {name} are not in equity {self.name}.")
+        if self._fed >= 0:
+            raise ValueError("Streaming indicators must be added before the backtest starts.")
+        indicator.name = name
+        self._streaming.append((indicator, [self.block[self.columns[col]] for col in indicator.inputs]))
+        self._bindIndicator(indicator, name)
+
+    def _bindIndicator(self, indicator, name):
+        """Binds an indicator as an attribute, for dot notation access: equity.close"""
+        if name in self.__slots__ or hasattr(type(self), name):
+            raise ValueError(f"Indicator name '{name}' is reserved by Equity. Please use another name.")
+        setattr(self, name, indicator)
         self.indicators[name] = indicator
 
-    def __getattribute__(self, name: str):
-        """Dot notation access: equity.close"""
-        indicators = super().__getattribute__("indicators")
-        if name in indicators.keys():
-            return indicators[name]
-        return super().__getattribute__(name)
+class ColumnView:
+    """Look-ahead safe view over one column of an equity's block.
+
+    It shares the equity's timestamps, so it has no cursor of its own: offsets are read relative to the equity's
+    current row. Nothing is copied, and nothing is updated per bar.
+    """
+    __slots__ = ("equity", "column", "values", "timeframe", "name")
+
+    def __init__(self, equity: Equity, column: str, timeframe, name: str):
+        self.equity = equity
+        self.column = column
+        self.values = equity.block[equity.columns[column]]  # Rebound by the equity when it adds a column.
+        self.timeframe = timeframe
+        self.name = name
+
+    @property
+    def cursor(self) -> int:
+        return self.equity.row
+
+    @property
+    def known_data(self) -> np.ndarray:
+        """Known values, newest first. Returned as a view, not a copy."""
+        return self.values[:self.equity.row + 1][::-1]
+
+    def __len__(self) -> int:
+        return self.equity.row + 1
+
+    def __getitem__(self, offset: int) -> float:
+        row = self.equity.row
+        if row < 0:
+            raise ValueError("No data available. The equity has no known bar yet.")
+        if offset < 0 or offset > row:
+            raise IndexError(f"Offset {offset} is out of range for indicator {self.name} with {row + 1} known bars.")
+        return self.values[row - offset]
+
 
 class Indicator:
-    __slots__ = ("df", "timeframe", "name", "known_data", "name")
+    """Look-ahead safe view over an indicator with its own timestamps.
+
+    A cursor points at the newest row whose timestamp is less than or equal to the current timeline
+    timestamp, and offsets are read relative to it.
+    """
+    __slots__ = ("timestamps", "values", "timeframe", "name", "cursor")
 
-    def __init__(self, df: pl.DataFrame, timeframe: pl.Datetime, name: str):
-        self.df = df
+    def __init__(self, timestamps: np.ndarray, values: np.ndarray, timeframe: pl.Datetime, name: str):
+        """:param timestamps: epoch microseconds, sorted ascending.
+        :param values: one value per timestamp.
+        """
+        self.timestamps = timestamps
+        self.values = values
         self.timeframe = timeframe
         self.name = name
+        self.cursor = -1  # Index of the newest known row. -1 until the first bar is reached.
 
     def getKnownData(self, timestamp) -> None:
-        curr_and_past_data = self.df.filter(pl.col("timestamp") <= timestamp)
-        self.known_data = curr_and_past_data.select(self.name).to_numpy()
-        self.known_data = np.flip(self.known_data)
+        """Advances the cursor to the newest row at or before timestamp.
+
+        :param timestamp: current timeline timestamp, as a datetime or epoch microseconds.
+        """
+        timestamp = toEpoch(timestamp)
+        timestamps = self.timestamps
+        cursor = self.cursor
+        last = len(timestamps) - 1
+        while cursor < last and timestamps[cursor + 1] <= timestamp:
+            cursor += 1
+        self.cursor = cursor
+
+    def seek(self, timestamp) -> None:
+        """Moves the cursor to timestamp in either direction using bisection."""
+        self.cursor = int(np.searchsorted(self.timestamps, toEpoch(timestamp), side="right")) - 1
+
+    @property
+    def known_data(self) -> np.ndarray:
+        """Known values, newest first. Returned as a view, not a copy."""
+        return self.values[:self.cursor + 1][::-1]
+
+    def __len__(self) -> int:
+        return self.cursor + 1
 
     def __getitem__(self, offset: int) -> float:
-        if self.known_data is None:
+        if self.cursor < 0:
             raise ValueError("No data available. Call `getKnownData` first.")
-        return self.known_data[offset]
+        if offset < 0 or offset > self.cursor:
+            raise IndexError(f"Offset {offset} is out of range for indicator {self.name} "
+                             f"with {self.cursor + 1} known bars.")
+        return self.values[self.cursor - offset]
 
 def onrow(*decorator_args, **decorator_kwargs):
     def decorator(func):
@@ -63,9 +323,7 @@ def onrow(*decorator_args, **decorator_kwargs):
 
         @wraps(func)
         def wrapper(self, *args, **kwargs):
-            equities = {eq.name: eq for eq in self.equities}
-            namespace = SimpleNamespace(**equities)
-            return func(self, namespace, **kwargs)
+            return func(self, self._data, **kwargs)
 
         return wrapper
 
@@ -76,7 +334,81 @@ def onrow(*decorator_args, **decorator_kwargs):
         return decorator
 
 
+class Timeline:
+    """Columnar, merged timeline of every equity's bars.
+
+    Each tick is one (timestamp, timeframe) pair, ordered by timestamp and then by timeframe code.
+    For each tick, the bars that become known at it are stored in CSR form: the entries
+    ptr[i]:ptr[i + 1] of eq_ids and rows give the equities to advance and the row to advance them to.
+    """
+    __slots__ = ("timestamps", "codes", "timeframes", "ptr", "eq_ids", "rows")
+
+    def __init__(self, equities: list):
+        self.timeframes = []  # Timeframe of each code, in order of first appearance.
+        for eq in equities:
+            if eq.timeframe not in self.timeframes:
+                self.timeframes.append(eq.timeframe)
+
+        # Concatenate the already sorted timestamp columns, grouped by timeframe code, so that a stable
+        # sort orders ties by code. NumPy's stable sort is a timsort, which merges the sorted runs.
+        ts_parts, code_parts, eq_parts, row_parts = [], [], [], []
+        for code, timeframe in enumerate(self.timeframes):
+            for eq_id, eq in enumerate(equities):
+                if eq.timeframe != timeframe:
+                    continue
+                n = len(eq.timestamps)
+                ts_parts.append(eq.timestamps)
+                code_parts.append(np.full(n, code, dtype=np.int16))
+                eq_parts.append(np.full(n, eq_id, dtype=np.int32))
+                row_parts.append(np.arange(n, dtype=np.int64))
+        if not ts_parts:
+            raise ValueError("No equities to build a timeline from. Use initEquity() first.")
+        ts = np.concatenate(ts_parts)
+        order = np.argsort(ts, kind="stable")
+        ts = ts[order]
+        codes = np.concatenate(code_parts)[order]
+
+        # One tick per distinct (timestamp, code) pair.
+        is_new = np.empty(len(ts), dtype=bool)
+        is_new[0] = True
+        np.not_equal(ts[1:], ts[:-1], out=is_new[1:])
+        is_new[1:] |= codes[1:] != codes[:-1]
+        self.timestamps = ts[is_new]
+        self.codes = codes[is_new]
+
+        # A bar becomes known at the first tick with its timestamp, whatever that tick's timeframe.
+        entry_tick = np.searchsorted(self.timestamps, ts, side="left")
+        self.eq_ids = np.concatenate(eq_parts)[order]
+        self.rows = np.concatenate(row_parts)[order]
+        self.ptr = np.searchsorted(entry_tick, np.arange(len(self.timestamps) + 1), side="left")
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
+_EPOCH = dt(1970, 1, 1)
+_EPOCH_UTC = dt(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def toEpoch(timestamp) -> int:
+    """Converts a datetime to epoch microseconds. Integers are assumed to already be epoch microseconds."""
+    if isinstance(timestamp, (int, np.integer)):
+        return int(timestamp)
+    if isinstance(timestamp, np.datetime64):
+        return int(timestamp.astype("datetime64[us]").astype(np.int64))
+    epoch = _EPOCH if timestamp.tzinfo is None else _EPOCH_UTC
+    return (timestamp - epoch) // _MICROSECOND
+
+
 class Duration:
+    """A bar timeframe such as '5m', with its Polars duration and its length in microseconds.
+
+    String formats are a number followed by a unit: s (seconds), m (minutes), h (hours) or d (days).
+    """
+    UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+    _PATTERN = re.compile(r"(\d+)([smhd])")
+
     def __init__(self, str_format=None, polars_format=None):
         if str_format is not None:
             self.str_format = str_format
@@ -88,30 +420,32 @@ class Duration:
                 self.str_format = self.polarsToString(self.polars_format)
         if str_format is None and polars_format is None:
             raise ValueError("At least one string or polars format must be passed.")
+        amount, unit = self._parse(self.str_format)
+        self.microseconds = int(datetime.timedelta(**{self.UNITS[unit]: amount}) // _MICROSECOND)
 
-    def stringToPolars(self, str_):
+    def _parse(self, str_) -> tuple:
+        match = self._PATTERN.fullmatch(str_)
+        if match is None:
+            raise ValueError(f"Error: Invalid string format {str_}. Use a number followed by s, m, h or d, e.g. '5m'.")
+        return int(match.group(1)), match.group(2)
+
+    def stringToPolars(self, str_) -> pl.Expr:
         # s, m, h, d
-        str_ = list(str_)
-        time_unit = [s for s in str_ if isinstance(s, str)]
-        unit_amount = [s for s in str_ if isinstance(s, int)]
-        match time_unit:
-            case "s":
-                return pl.duration(seconds=unit_amount)
-            case "m":
-                return pl.duration(minutes=unit_amount)
-            case "h":
-                return pl.duration(hours=unit_amount)
-            case "d":
-                return pl.duration(days=unit_amount)
-        raise ValueError("Error: Invalid string format.")
-    
-    def polarsToString(self, dur):
-        dur = list(dur)
-        ints = [str(i) for i in dur if isinstance(i, int)]
-        unit_amount = ''.join(ints)
-        time_unit = [x for x in dur if isinstance(x, str)][0]
-        _str = unit_amount + time_unit
-        return _str
+        amount, unit = self._parse(str_)
+        return pl.duration(**{self.UNITS[unit]: amount})
+
+    def polarsToString(self, dur) -> str:
+        """Converts a datetime.timedelta, e.g. a value of a Polars Duration column, to a string format."""
+        if not isinstance(dur, datetime.timedelta):
+            raise ValueError("polars_format must be a datetime.timedelta to be converted to a string format.")
+        microseconds = dur // _MICROSECOND
+        for unit, size in (("d", 86_400_000_000), ("h", 3_600_000_000), ("m", 60_000_000), ("s", 1_000_000)):
+            if microseconds > 0 and microseconds % size == 0:
+                return f"{microseconds // size}{unit}"
+        raise ValueError(f"Duration {dur} is not a whole number of seconds.")
+
+    def __str__(self) -> str:
+        return self.str_format
 
 
 @dataclass(slots=True)
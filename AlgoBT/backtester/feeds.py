@@ -0,0 +1,102 @@
+import json
+import heapq
+import asyncio
+from typing import NamedTuple
+import polars as pl
+
+
+class Bar(NamedTuple):
+    """One bar of a feed for BTest.runStream. name is the name the equity was initialized with."""
+    name: str
+    timestamp: int  # Epoch microseconds.
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float = 0.0
+
+
+def frameFeed(frames: dict, batch_size: int = 100_000):
+    """Replays DataFrames or LazyFrames as ticks: lists of the bars sharing a timestamp, in time order.
+
+    :param frames: dict of equity name to OHLCV frame, each sorted by timestamp.
+    :param batch_size: rows read from each frame at a time.
+    """
+    return mergeTicks([_frameBars(name, df.lazy(), batch_size) for name, df in frames.items()])
+
+
+def storeReplayFeed(store, symbols: dict, timeframe: str, start=None, end=None, batch_size: int = 100_000):
+    """Replays bars from a BarStore as ticks, reading each symbol's parts in batches.
+
+    :param store: BarStore to read from.
+    :param symbols: dict of equity name to store symbol, e.g. {"BTC": "BTC/USD"}.
+    :param timeframe: timeframe of the stored bars.
+    :param start: first timestamp to replay, inclusive.
+    :param end: last timestamp to replay, inclusive.
+    """
+    return mergeTicks([_frameBars(name, store.scan(symbol, timeframe, start, end), batch_size)
+                       for name, symbol in symbols.items()])
+
+
+def mergeTicks(streams: list):
+    """Merges iterators of Bars, each sorted by timestamp, into ticks. Holds one bar per iterator at a time."""
+    tick = []
+    for bar in heapq.merge(*streams, key=lambda bar: bar.timestamp):
+        if tick and bar.timestamp != tick[0].timestamp:
+            yield tick
+            tick = []
+        tick.append(bar)
+    if tick:
+        yield tick
+
+
+def _frameBars(name: str, lf: pl.LazyFrame, batch_size: int):
+    volume = pl.col("volume") if "volume" in lf.collect_schema() else pl.lit(0.0)
+    lf = lf.select(pl.col("timestamp").dt.epoch("us"), "open", "high", "low", "close", volume.alias("volume"))
+    for batch in lf.collect_batches(chunk_size=batch_size):
+        for row in batch.iter_rows():
+            yield Bar(name, *row)
+
+
+async def socketFeed(host: str, port: int):
+    """Async generator of bars read from a TCP socket, for BTest.runStreamAsync.
+
+    Messages are newline delimited JSON. Each line is a bar, or a list of bars forming one tick:
+        {"name": "SPY", "timestamp": 1704067200000000, "open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0,
+         "volume": 10}
+    The feed ends when the server closes the connection.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while line := await reader.readline():
+            message = json.loads(line)
+            if isinstance(message, list):
+                yield [Bar(**bar) for bar in message]
+            else:
+                yield Bar(**message)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def serveFeed(feed, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0) -> asyncio.Server:
+    """Serves a feed over TCP in socketFeed's format. A local stand-in for a live data feed.
+
+    Every client is sent the whole feed, then disconnected.
+    :param feed: iterable of Bars or lists of Bars, e.g. from frameFeed(). Called once per client if callable.
+    :param port: port to listen on. 0 picks a free one, read it from server.sockets[0].getsockname()[1].
+    :param delay: seconds to wait between ticks, to mimic bars arriving live.
+    """
+    async def send(reader, writer):
+        try:
+            for bars in (feed() if callable(feed) else feed):
+                message = [bar._asdict() for bar in bars] if isinstance(bars, list) else bars._asdict()
+                writer.write(json.dumps(message).encode() + b"\n")
+                await writer.drain()
+                if delay:
+                    await asyncio.sleep(delay)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    return await asyncio.start_server(send, host, port)
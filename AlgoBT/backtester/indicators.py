@@ -0,0 +1,209 @@
+import math
+import numpy as np
+
+
+class RingBuffer:
+    """Fixed size buffer of floats. Index 0 is the newest value, 1 the one before, and so on."""
+    __slots__ = ("buffer", "size", "head", "count")
+
+    def __init__(self, size: int, dtype=np.float64):
+        if size < 1:
+            raise ValueError("RingBuffer size must be at least 1.")
+        self.buffer = np.full(size, np.nan, dtype=dtype)
+        self.size = size
+        self.head = -1  # Slot of the newest value.
+        self.count = 0
+
+    def append(self, value: float) -> None:
+        head = self.head + 1
+        if head == self.size:
+            head = 0
+        self.buffer[head] = value
+        self.head = head
+        if self.count < self.size:
+            self.count += 1
+
+    def oldest(self) -> float:
+        """Value that the next append will overwrite once the buffer is full."""
+        return self.buffer[(self.head + 1) % self.size] if self.count == self.size else self.buffer[0]
+
+    def toArray(self) -> np.ndarray:
+        """Copy of the stored values, oldest first."""
+        if self.count < self.size:
+            return self.buffer[:self.count].copy()
+        return np.roll(self.buffer, -(self.head + 1))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, offset: int) -> float:
+        if offset < 0 or offset >= self.count:
+            raise IndexError(f"Offset {offset} is out of range for a buffer holding {self.count} values.")
+        return self.buffer[self.head - offset]  # Negative indexes wrap around the end of the buffer.
+
+
+class StreamingIndicator:
+    """Base class for indicators updated one bar at a time in O(1).
+
+    Subclasses set `inputs` to the equity columns they read and implement compute(), which receives one value
+    per input and returns the indicator value for that bar (NaN until warmed up). Only the last `history` values
+    are kept, so memory is bounded by the lookback window rather than by the length of the data.
+    """
+    inputs = ("close",)
+
+    def __init__(self, period: int, history: int = None):
+        """:param period: lookback window of the indicator.
+        :param history: number of past values kept for Equity.name[offset] access. Defaults to period.
+        """
+        if period < 1:
+            raise ValueError("period must be at least 1.")
+        self.period = period
+        self.name = None
+        self.history = RingBuffer(history or period)
+
+    def compute(self, *values) -> float:
+        raise NotImplementedError("compute() must be overriden in child class")
+
+    def update(self, *values) -> float:
+        value = self.compute(*values)
+        self.history.append(value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self.history)
+
+    def __getitem__(self, offset: int) -> float:
+        if len(self.history) == 0:
+            raise ValueError(f"No data available for indicator {self.name}. No bars have been fed yet.")
+        return self.history[offset]
+
+
+class SMA(StreamingIndicator):
+    """Simple moving average, kept as a running sum over a ring buffer of the window."""
+
+    def __init__(self, period: int, source: str = "close", history: int = None):
+        super().__init__(period, history)
+        self.inputs = (source,)
+        self.window = RingBuffer(period)
+        self.total = 0.0
+
+    def compute(self, value) -> float:
+        window = self.window
+        if window.count == self.period:
+            self.total -= window.oldest()
+        window.append(value)
+        if window.head == self.period - 1:
+            self.total = float(window.buffer.sum())  # Resync once per wrap so rounding error can't build up.
+        else:
+            self.total += value
+        return self.total / self.period if window.count == self.period else math.nan
+
+
+class EMA(StreamingIndicator):
+    """Exponential moving average with alpha = 2 / (period + 1), seeded with the SMA of the first period values."""
+
+    def __init__(self, period: int, source: str = "close", history: int = None):
+        super().__init__(period, history)
+        self.inputs = (source,)
+        self.alpha = 2 / (period + 1)
+        self.seen = 0
+        self.value = 0.0
+
+    def compute(self, value) -> float:
+        self.seen += 1
+        if self.seen < self.period:
+            self.value += value
+            return math.nan
+        if self.seen == self.period:
+            self.value = (self.value + value) / self.period
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class RollingStd(StreamingIndicator):
+    """Rolling standard deviation using Welford's algorithm, updated for values entering and leaving the window."""
+
+    def __init__(self, period: int, source: str = "close", ddof: int = 1, history: int = None):
+        if period <= ddof:
+            raise ValueError("period must be greater than ddof.")
+        super().__init__(period, history)
+        self.inputs = (source,)
+        self.ddof = ddof
+        self.window = RingBuffer(period)
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def compute(self, value) -> float:
+        window = self.window
+        if window.count < self.period:
+            n = window.count + 1
+            delta = value - self.mean
+            self.mean += delta / n
+            self.m2 += delta * (value - self.mean)
+        else:
+            old = window.oldest()
+            old_mean = self.mean
+            self.mean += (value - old) / self.period
+            self.m2 += (value - old) * (value - self.mean + old - old_mean)
+        window.append(value)
+        if window.count < self.period:
+            return math.nan
+        return math.sqrt(max(self.m2, 0.0) / (self.period - self.ddof))
+
+
+class RSI(StreamingIndicator):
+    """Relative strength index with Wilder smoothing."""
+
+    def __init__(self, period: int = 14, source: str = "close", history: int = None):
+        super().__init__(period, history)
+        self.inputs = (source,)
+        self.prev = None
+        self.seen = 0  # Number of price changes seen.
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+
+    def compute(self, value) -> float:
+        if self.prev is None:
+            self.prev = value
+            return math.nan
+        change = value - self.prev
+        self.prev = value
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+        self.seen += 1
+        if self.seen <= self.period:
+            self.avg_gain += gain / self.period
+            self.avg_loss += loss / self.period
+            if self.seen < self.period:
+                return math.nan
+        else:
+            self.avg_gain += (gain - self.avg_gain) / self.period
+            self.avg_loss += (loss - self.avg_loss) / self.period
+        if self.avg_loss == 0:
+            return 100.0 if self.avg_gain > 0 else 50.0
+        return 100 - 100 / (1 + self.avg_gain / self.avg_loss)
+
+
+class ATR(StreamingIndicator):
+    """Average true range with Wilder smoothing."""
+    inputs = ("high", "low", "close")
+
+    def __init__(self, period: int = 14, history: int = None):
+        super().__init__(period, history)
+        self.prev_close = None
+        self.seen = 0
+        self.value = 0.0
+
+    def compute(self, high, low, close) -> float:
+        if self.prev_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        self.seen += 1
+        if self.seen <= self.period:
+            self.value += true_range / self.period
+            return self.value if self.seen == self.period else math.nan
+        self.value += (true_range - self.value) / self.period
+        return self.value
@@ -0,0 +1,242 @@
+import copy
+import numpy as np
+import polars as pl
+
+SIDES = ("BUY", "SELL", "SHORT", "COVER")
+SIDE_CODES = {side: code for code, side in enumerate(SIDES)}
+SIDE_SIGNS = (1, -1, -1, 1)  # Effect of each side on the position.
+
+FILL_COLUMNS = {
+    "oid": np.int64,
+    "eq_id": np.int32,
+    "time": np.int64,  # Epoch microseconds.
+    "side": np.int8,  # Index into SIDES.
+    "qty": np.float64,
+    "price": np.float64,
+    "commission": np.float64,
+}
+
+
+class Ledger:
+    """Columnar record of fills, positions, cash and the mark-to-market equity curve of a BTest run.
+
+    Fills are appended in place to preallocated NumPy buffers that double in size when full. The equity curve
+    has one slot per timeline tick, allocated when the run starts. Both are exported to Polars without copying
+    the numeric columns. When streaming, the curve keeps only the latest mark and only the latest fill_limit fills
+    are kept, so memory doesn't grow. n_fills still counts every fill.
+    """
+
+    def __init__(self, cash=None, capacity: int = 1024):
+        self.cash = cash
+        self.starting_cash = cash
+        self.capacity = capacity
+        self.equities = []
+        self.positions = np.zeros(0)
+        self.n_fills = 0
+        self.fills = {}
+        self.fill_limit = None  # Fills kept. None keeps every fill.
+        self.fills_dropped = 0  # Oldest fills dropped to stay within fill_limit.
+        self.curve_time = self.curve_cash = self.curve_value = np.zeros(0)
+        self.n_marks = 0
+        self.history = True  # Keep every mark. False when streaming.
+        self.time_dtype = pl.Datetime("us")
+        self._held = set()  # eq_ids with a non zero position.
+
+    def start(self, equities: list, n_ticks: int, history: bool = True, fill_limit: int = None) -> None:
+        """Allocates the buffers for a run over equities with n_ticks timeline ticks.
+
+        :param history: keep every mark of the equity curve. If False, only the latest one is kept.
+        :param fill_limit: number of latest fills kept. None keeps every fill.
+        """
+        self.history = history
+        self.fill_limit = fill_limit
+        if not history:
+            n_ticks = 1
+        self.starting_cash = self.cash
+        self.equities = equities
+        if equities:
+            self.time_dtype = pl.Datetime("us", equities[0].df.schema["timestamp"].time_zone)
+        self.positions = np.zeros(len(equities))
+        self.n_fills = 0
+        self.fills_dropped = 0
+        self.fills = {col: np.empty(self.capacity, dtype=dtype) for col, dtype in FILL_COLUMNS.items()}
+        self.curve_time = np.empty(n_ticks, dtype=np.int64)
+        self.curve_cash = np.empty(n_ticks)
+        self.curve_value = np.empty(n_ticks)
+        self.n_marks = 0
+        self._held = set()
+
+    def __getstate__(self) -> dict:
+        """Keeps only the used part of the buffers, so checkpoints store what was recorded and no more."""
+        state = self.__dict__.copy()
+        n = self.n_marks if self.history else min(self.n_marks, 1)
+        state["fills"] = {col: values[:self.kept_fills] for col, values in self.fills.items()}
+        state["curve_time"], state["curve_cash"], state["curve_value"] = \
+            self.curve_time[:n], self.curve_cash[:n], self.curve_value[:n]
+        return state
+
+    def resume(self, n_ticks: int) -> None:
+        """Regrows the buffers of a ledger restored from a checkpoint, to continue a run with n_ticks ticks."""
+        kept = self.kept_fills
+        capacity = max(self.capacity, kept)
+        for col, values in self.fills.items():
+            self.fills[col] = np.empty(capacity, dtype=values.dtype)
+            self.fills[col][:kept] = values
+        size = n_ticks if self.history else 1
+        for name in ("curve_time", "curve_cash", "curve_value"):
+            values = getattr(self, name)
+            buffer = np.empty(size, dtype=values.dtype)
+            buffer[:len(values)] = values
+            setattr(self, name, buffer)
+
+    def rows(self, fills_from: int = 0, marks_from: int = 0) -> dict:
+        """Fills and equity curve marks recorded from the given counts on, as arrays. Used by checkpoints."""
+        rows = {f"fill_{col}": values[fills_from:self.n_fills] for col, values in self.fills.items()}
+        for name in ("curve_time", "curve_cash", "curve_value"):
+            rows[name] = getattr(self, name)[marks_from:self.n_marks]
+        return rows
+
+    def withoutRows(self) -> "Ledger":
+        """Shallow copy holding the counts, cash and positions, but none of the recorded rows."""
+        light = copy.copy(self)
+        light.fills = {col: values[:0] for col, values in self.fills.items()}
+        light.curve_time, light.curve_cash, light.curve_value = \
+            self.curve_time[:0], self.curve_cash[:0], self.curve_value[:0]
+        return light
+
+    def restoreRows(self, parts: list) -> None:
+        """Sets the recorded rows from consecutive rows() dicts, on a ledger restored by withoutRows()."""
+        self.fills = {col: np.concatenate([part[f"fill_{col}"] for part in parts] or [values])
+                      for col, values in self.fills.items()}
+        for name in ("curve_time", "curve_cash", "curve_value"):
+            setattr(self, name, np.concatenate([part[name] for part in parts] or [getattr(self, name)]))
+        if len(self.fills["oid"]) != self.n_fills or len(self.curve_time) != self.n_marks:
+            raise ValueError("The ledger rows don't match the snapshot. Some ledger segments are missing.")
+
+    @property
+    def kept_fills(self) -> int:
+        """Number of fills in the buffers."""
+        return self.n_fills - self.fills_dropped
+
+    def _reserve(self, n: int) -> None:
+        """Makes room for n more fills. The buffers double when full, up to twice fill_limit, after which the
+        oldest fills are dropped down to fill_limit, so dropping is amortized like growing.
+        """
+        kept = self.kept_fills
+        size = len(self.fills["oid"])
+        if kept + n <= size:
+            return
+        limit = self.fill_limit
+        if limit is not None and kept + n > 2 * limit:
+            keep = min(kept, limit)
+            for values in self.fills.values():
+                values[:keep] = values[kept - keep:kept]
+            self.fills_dropped += kept - keep
+            kept = keep
+        while kept + n > size:
+            size *= 2
+        if limit is not None:
+            size = max(kept + n, min(size, 2 * limit))
+        if size > len(self.fills["oid"]):
+            self.fills = {col: np.resize(values, size) for col, values in self.fills.items()}
+
+    def record(self, oid: int, eq_id: int, time: int, side: str, qty: float, price: float,
+               commission: float) -> None:
+        """Records a fill and applies it to cash and positions."""
+        if self.n_fills - self.fills_dropped == len(self.fills["oid"]):
+            self._reserve(1)
+        code = SIDE_CODES[side]
+        i = self.n_fills - self.fills_dropped
+        fills = self.fills
+        fills["oid"][i] = oid
+        fills["eq_id"][i] = eq_id
+        fills["time"][i] = time
+        fills["side"][i] = code
+        fills["qty"][i] = qty
+        fills["price"][i] = price
+        fills["commission"][i] = commission
+        self.n_fills += 1
+
+        sign = SIDE_SIGNS[code]
+        self.cash -= sign * qty * price + commission
+        self.positions[eq_id] += sign * qty
+        if self.positions[eq_id] == 0:
+            self._held.discard(eq_id)
+        else:
+            self._held.add(eq_id)
+
+    def recordBatch(self, oids, eq_id: int, time: int, sides, qtys, prices, commissions) -> None:
+        """Records several fills of one equity at once. Same effect as calling record() for each."""
+        n = len(oids)
+        self._reserve(n)
+        codes = np.array([SIDE_CODES[side] for side in sides], dtype=np.int8)
+        qtys = np.asarray(qtys, dtype=np.float64)
+        signs = np.asarray(SIDE_SIGNS)[codes]
+        window = slice(self.kept_fills, self.kept_fills + n)
+        fills = self.fills
+        fills["oid"][window] = oids
+        fills["eq_id"][window] = eq_id
+        fills["time"][window] = time
+        fills["side"][window] = codes
+        fills["qty"][window] = qtys
+        fills["price"][window] = prices
+        fills["commission"][window] = commissions
+        self.n_fills += n
+
+        self.cash -= float(np.sum(signs * qtys * prices) + np.sum(commissions))
+        self.positions[eq_id] += np.sum(signs * qtys)
+        if self.positions[eq_id] == 0:
+            self._held.discard(eq_id)
+        else:
+            self._held.add(eq_id)
+
+    def marketValue(self) -> float:
+        """Value of all open positions at the close of each equity's current bar."""
+        value = 0.0
+        for eq_id in self._held:
+            value += self.positions[eq_id] * self.equities[eq_id].close[0]
+        return value
+
+    def mark(self, time: int) -> None:
+        """Appends the current cash and market value to the equity curve. Called once per tick."""
+        i = self.n_marks if self.history else 0
+        self.curve_time[i] = time
+        self.curve_cash[i] = self.cash
+        self.curve_value[i] = self.marketValue() if self._held else 0.0
+        self.n_marks += 1
+
+    @property
+    def equity(self) -> float:
+        return self.cash + self.marketValue()
+
+    def lastMark(self) -> float:
+        """Equity at the latest mark, or the cash if nothing has been marked yet."""
+        if self.n_marks == 0:
+            return self.cash
+        i = self.n_marks - 1 if self.history else 0
+        return self.curve_cash[i] + self.curve_value[i]
+
+    def fillsFrame(self) -> pl.DataFrame:
+        """Fills as a DataFrame, at most the latest fill_limit. Numeric columns are views of the ledger buffers."""
+        kept = self.kept_fills
+        first = 0 if self.fill_limit is None else max(0, kept - self.fill_limit)
+        fills = {col: values[first:kept] for col, values in self.fills.items()}
+        names = np.array([eq.name for eq in self.equities] or [""])
+        return pl.DataFrame({
+            "oid": fills["oid"],
+            "time": pl.Series(fills["time"]).cast(self.time_dtype),
+            "equity": names[fills["eq_id"]],
+            "side": np.array(SIDES)[fills["side"]],
+            "qty": fills["qty"],
+            "price": fills["price"],
+            "commission": fills["commission"],
+        })
+
+    def curveFrame(self) -> pl.DataFrame:
+        """Mark-to-market equity curve, one row per tick."""
+        n = min(self.n_marks, len(self.curve_time))
+        return pl.DataFrame({
+            "time": pl.Series(self.curve_time[:n]).cast(self.time_dtype),
+            "cash": self.curve_cash[:n],
+            "market_value": self.curve_value[:n],
+        }).with_columns((pl.col("cash") + pl.col("market_value")).alias("equity"))
@@ -1,7 +1,9 @@
+import copy
+import bisect
 import polars as pl
+import numpy as np
 from dataclasses import dataclass
 from typing import Literal, Optional
-from sortedcontainers import SortedList
 
 
 class OrderSim():
@@ -23,44 +25,180 @@ class OrderSim():
         :param avg_volume: average volume of past 100 bars
         :return: returns the order odject, and the cost of filling the order.
         """
-        price_filled = self.simOrderFill(price, open, high, low, close, volume, avg_volume, side)
-        order = Order(oid=self.genOrderID, type_="MARKET", side=side, time_placed=time,
-                     time_filled=time, price_filled=price_filled)
+        price_filled = self.simOrderFill(price, open, high, low, close, volume, avg_volume, side, qty)
         cost = qty * price_filled
+        order = Order(oid=self.genOrderID(), qty=qty, type_="MARKET", side=side, time_placed=time, price_placed=price,
+                      status="FILLED", price_filled=price_filled, time_filled=time)
         return order, cost
 
+    def fillMarketOrder(self, price, qty, side, model, row):
+        """Simulates filling a market order from an equity's precomputed FillModel, without creating an Order.
+
+        :param price: price to attempt to fill order at.
+        :param qty: Amount of shares to use in order
+        :param side: order side. One of the following: "BUY", "SELL", "SHORT", "COVER"
+        :param model: FillModel of the equity.
+        :param row: row of the current bar.
+        :return: the order ID, the fill price and the cost of filling the order.
+        """
+        price_filled = applySlippage(price, model.slippage[row], model.open[row], model.close[row],
+                                     model.volume[row], side, qty)
+        return self.genOrderID(), price_filled, qty * price_filled
+
+    def fillMarketOrders(self, prices, qtys, sides, model, row):
+        """Batch version of fillMarketOrder. Fills an array of orders on the same bar in one call.
+
+        :param prices: array of prices to attempt to fill orders at.
+        :param qtys: array of order quantities.
+        :param sides: sequence of order sides.
+        :return: arrays of order IDs, fill prices and costs.
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        qtys = np.asarray(qtys, dtype=np.float64)
+        buying = np.isin(np.asarray(sides), ("BUY", "COVER"))
+        mid = (model.open[row] + model.close[row]) / 2
+        prices = np.where(qtys > model.volume[row] * 0.2, mid, prices)
+        slippage = model.slippage[row]
+        prices_filled = prices * np.where(buying, 1 + slippage, 1 - slippage)
+        oids = np.arange(self.lastOID + 1, self.lastOID + 1 + len(prices), dtype=np.int64)
+        self.lastOID += len(prices)
+        return oids, prices_filled, qtys * prices_filled
+
     def simOrderFill(self, price_to_fill, open, high, low, close, volume, avg_volume, order_side, qty):
         upper_ratio, lower_ratio = calculateWickRatios(open, high, low, close)
         slippage = self.calculateSlippage(upper_ratio, lower_ratio, volume, avg_volume)
-        if qty > volume * 0.2:
-            price_to_fill = (open + close) / 2  # Use mid price if order is learge relative to volume.
+        return applySlippage(price_to_fill, slippage, open, close, volume, order_side, qty)
 
-        if order_side in ("BUY", "COVER"):
-            price_filled = price_to_fill * (1 + slippage)
+    def calculateSlippage(self, upper_ratio, lower_ratio, volume, avg_volume):
+        return slippageRate(upper_ratio, lower_ratio, volume, avg_volume)
+
+    def fillRestingOrder(self, order, model, row):
+        """Simulates filling a triggered limit or stop order on the bar that triggered it.
+
+        Limits fill at their price, or at the open if the bar gapped through it. They add liquidity, so no
+        slippage is applied. Stops become market orders at their price, or at the open on a gap, and slip.
+        :param order: the triggered Order.
+        :param model: FillModel of the order's equity.
+        :param row: row of the bar that triggered the order.
+        :return: the fill price and the cost of filling the order.
+        """
+        buying = order.side in ("BUY", "COVER")
+        open = model.open[row]
+        if order.type_ == "LIMIT":
+            price_filled = min(order.price_placed, open) if buying else max(order.price_placed, open)
         else:
-            price_filled = price_to_fill * (1 - slippage)
-        return price_filled
-
-
-    def calculateSlippage(upper_ratio, lower_ratio, volume, avg_volume):
-        # Base slippage (bps)
-        base_slip = 2.0
-        # Adjust for wicks (toxic flow)
-        if upper_ratio > 1.5 or lower_ratio > 1.5:
-            base_slip *= 2.0  # Double slippage for large wicks
-        # Adjust for volume
-        volume_ratio = volume / avg_volume
-        if volume_ratio < 0.5:
-            base_slip *= 1.5  # Wider spreads in low volume
-        elif volume_ratio > 2.0:
-            base_slip *= 1.2  # More competition in high volume
-        
-        return base_slip / 10_000  # Convert to decimal
+            trigger = max(order.price_placed, open) if buying else min(order.price_placed, open)
+            price_filled = applySlippage(trigger, model.slippage[row], open, model.close[row], model.volume[row],
+                                         order.side, order.qty)
+        return price_filled, order.qty * price_filled
+
+    def createRestingOrder(self, type_, price, qty, time, side, eq_id):
+        """Creates an open limit or stop order."""
+        return Order(oid=self.genOrderID(), qty=qty, type_=type_, side=side, time_placed=time, price_placed=price,
+                     status="OPEN", price_filled=None, time_filled=None, eq_id=eq_id)
 
     def genOrderID(self):
         self.lastOID += 1
         return self.lastOID
 
+def slippageRate(upper_ratio, lower_ratio, volume, avg_volume):
+    # Base slippage (bps)
+    base_slip = 2.0
+    # Adjust for wicks (toxic flow)
+    if upper_ratio > 1.5 or lower_ratio > 1.5:
+        base_slip *= 2.0  # Double slippage for large wicks
+    # Adjust for volume
+    volume_ratio = volume / avg_volume if avg_volume > 0 else 1.0
+    if volume_ratio < 0.5:
+        base_slip *= 1.5  # Wider spreads in low volume
+    elif volume_ratio > 2.0:
+        base_slip *= 1.2  # More competition in high volume
+
+    return base_slip / 10_000  # Convert to decimal
+
+
+def applySlippage(price_to_fill, slippage, open, close, volume, order_side, qty):
+    if qty > volume * 0.2:
+        price_to_fill = (open + close) / 2  # Use mid price if order is learge relative to volume.
+
+    if order_side in ("BUY", "COVER"):
+        return price_to_fill * (1 + slippage)
+    return price_to_fill * (1 - slippage)
+
+
+class FillModel():
+    """Per bar inputs of the fill model for one equity, computed once as vectorized columns.
+
+    Mirrors calculateWickRatios and OrderSim.calculateSlippage, so a fill only needs indexed lookups. Only the
+    slippage is stored: float open, close and volume columns are views of df, e.g. of an Equity's block.
+    """
+    __slots__ = ("open", "close", "volume", "slippage")
+
+    def __init__(self, df: pl.DataFrame, avg_volume_bars: int = 100):
+        """:param df: OHLCV DataFrame of the equity.
+        :param avg_volume_bars: bars in the rolling average volume, including the current bar.
+        """
+        *_, slippage = fillModelColumns(avg_volume_bars)
+        columns = df.select(
+            *[pl.col(name) if df.schema[name].is_float() else pl.col(name).cast(pl.Float64)
+              for name in ("open", "close", "volume")],
+            slippage,
+        )
+        for name in self.__slots__:
+            setattr(self, name, columns[name].to_numpy())
+
+
+class LiveFillModel():
+    """FillModel for bars pushed one at a time, in BTest.runStream.
+
+    Holds the inputs of the current bar at row 0, and keeps only the volumes of the average volume window.
+    """
+    __slots__ = FillModel.__slots__ + ("avg_volume", "upper_ratio", "lower_ratio", "_volumes", "_volume_sum", "_next")
+
+    def __init__(self, avg_volume_bars: int = 100):
+        for name in FillModel.__slots__ + ("avg_volume", "upper_ratio", "lower_ratio"):
+            setattr(self, name, np.zeros(1))
+        self._volumes = np.full(avg_volume_bars, np.nan)
+        self._volume_sum = 0.0
+        self._next = 0  # Slot of _volumes the next bar is written to.
+
+    def update(self, open, high, low, close, volume) -> None:
+        volumes = self._volumes
+        i = self._next % len(volumes)
+        if self._next >= len(volumes):
+            self._volume_sum -= volumes[i]
+        volumes[i] = volume
+        self._volume_sum += volume
+        self._next += 1
+        avg_volume = self._volume_sum / min(self._next, len(volumes))
+        upper_ratio, lower_ratio = calculateWickRatios(open, high, low, close)
+        self.open[0], self.close[0], self.volume[0] = open, close, volume
+        self.avg_volume[0], self.upper_ratio[0], self.lower_ratio[0] = avg_volume, upper_ratio, lower_ratio
+        self.slippage[0] = slippageRate(upper_ratio, lower_ratio, volume, avg_volume)
+
+
+def fillModelColumns(avg_volume_bars: int = 100) -> list:
+    """Polars expressions for the wick ratios, rolling average volume and slippage of every bar."""
+    open, high, low, close = pl.col("open"), pl.col("high"), pl.col("low"), pl.col("close")
+    volume = pl.col("volume").cast(pl.Float64)
+    body_size = (close - open).abs()
+    upper_ratio = pl.when(body_size > 0).then((high - pl.max_horizontal(open, close)) / body_size).otherwise(0.0)
+    lower_ratio = pl.when(body_size > 0).then((pl.min_horizontal(open, close) - low) / body_size).otherwise(0.0)
+    avg_volume = volume.rolling_mean(avg_volume_bars, min_samples=1)
+    volume_ratio = pl.when(avg_volume > 0).then(volume / avg_volume).otherwise(1.0)
+    base_slip = (
+        2.0
+        * pl.when((upper_ratio > 1.5) | (lower_ratio > 1.5)).then(2.0).otherwise(1.0)
+        * pl.when(volume_ratio < 0.5).then(1.5).when(volume_ratio > 2.0).then(1.2).otherwise(1.0)
+    )
+    return [
+        upper_ratio.alias("upper_ratio"),
+        lower_ratio.alias("lower_ratio"),
+        avg_volume.alias("avg_volume"),
+        (base_slip / 10_000).alias("slippage"),
+    ]
+
+
 def calculateWickRatios(open, high, low, close):
     upper_wick = high - max(open, close)
     lower_wick = min(open, close) - low
@@ -82,25 +220,75 @@ class Order():
     status: Literal["OPEN", "FILLED", "CANCELED"]
     price_filled: Optional[float]
     time_filled: Optional[pl.Datetime]
+    eq_id: Optional[int] = None
 
     def __lt__(self, other):
         return self.price_placed < other.price_placed
 
+    @property
+    def book(self) -> str:
+        """Price book the order rests in while open."""
+        direction = "BUY" if self.side in ("BUY", "COVER") else "SELL"
+        return f"{direction}_{self.type_}"
+
 
 @dataclass
 class OrderBook():
+    """Resting limit and stop orders, kept in per equity, per book price-sorted lists.
+
+    There are four books per equity: BUY_LIMIT and SELL_STOP orders trigger when a bar trades down to their
+    price, SELL_LIMIT and BUY_STOP orders when a bar trades up to it. Each book is a list of (price, oid) kept
+    sorted with bisect, so the orders triggered by a bar are a contiguous slice found by bisection.
+    """
     all_orders: list
+    history: bool = True  # Keep every order in all_orders. False when streaming, which only keeps the open ones.
 
     def __post_init__(self):
-        self.open_orders = SortedList()
+        self.open_orders = {}  # Open orders by oid.
+        self.books = {}  # (eq_id, book) -> sorted list of (price, oid).
+        self.resting = {}  # eq_id -> number of open orders. Equities without open orders are skipped.
 
     def addOrder(self, order):
         if order.status == "OPEN":
-            self.open_orders.add(order)
-        self.all_orders.append(order)
+            bisect.insort(self.books.setdefault((order.eq_id, order.book), []), (order.price_placed, order.oid))
+            self.open_orders[order.oid] = order
+            self.resting[order.eq_id] = self.resting.get(order.eq_id, 0) + 1
+        if self.history:
+            self.all_orders.append(order)
+
+    def withoutHistory(self) -> "OrderBook":
+        """Shallow copy with the open orders and books, but without all_orders. Used by checkpoints."""
+        light = copy.copy(self)
+        light.all_orders = []
+        return light
 
     def removeOpenOrder(self, order):
-        if order in self.open_orders:
-            self.open_orders.remove(order)
+        if self.open_orders.pop(order.oid, None) is not None:
+            prices = self.books[(order.eq_id, order.book)]
+            del prices[bisect.bisect_left(prices, (order.price_placed, order.oid))]
+            self._decrementResting(order.eq_id, 1)
 
+    def matchBar(self, eq_id: int, high: float, low: float) -> list:
+        """Removes and returns the open orders of an equity triggered by a bar's high/low range, oldest first."""
+        triggered = []
+        for book, trades_down in (("BUY_LIMIT", True), ("SELL_STOP", True),
+                                  ("SELL_LIMIT", False), ("BUY_STOP", False)):
+            prices = self.books.get((eq_id, book))
+            if not prices:
+                continue
+            if trades_down:  # Triggered when price >= low.
+                start, stop = bisect.bisect_left(prices, (low, -1)), len(prices)
+            else:  # Triggered when price <= high.
+                start, stop = 0, bisect.bisect_right(prices, (high, float("inf")))
+            if start < stop:
+                triggered.extend(self.open_orders.pop(oid) for _, oid in prices[start:stop])
+                del prices[start:stop]
+        if triggered:
+            self._decrementResting(eq_id, len(triggered))
+            triggered.sort(key=lambda order: order.oid)
+        return triggered
 
+    def _decrementResting(self, eq_id, n):
+        self.resting[eq_id] -= n
+        if self.resting[eq_id] == 0:
+            del self.resting[eq_id]
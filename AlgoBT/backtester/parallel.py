@@ -0,0 +1,159 @@
+import os
+import multiprocessing
+import polars as pl
+import numpy as np
+from dataclasses import dataclass
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+_worker_frames = {}  # Frames attached by a worker process, by name.
+_worker_blocks = []  # Shared memory handles backing _worker_frames. Kept alive for the life of the worker.
+
+
+@dataclass(slots=True)
+class SharedColumn:
+    name: str
+    shm_name: str
+    dtype: str
+    length: int
+    time_unit: Optional[str] = None  # Set for Datetime columns, which are stored as integers.
+    time_zone: Optional[str] = None
+
+
+class SharedFrames:
+    """Publishes DataFrames column by column into shared memory, so other processes can attach to them without
+    pickling or copying the data. Supports numeric, boolean and Datetime columns.
+
+    Use as a context manager, or call close() to free the shared memory once every process is done with it.
+    """
+
+    def __init__(self, frames: dict):
+        """:param frames: dict of name to pl.DataFrame, e.g. {"SPY": spy_df}."""
+        self.spec = {}  # Picklable description of every column. Passed to attachFrames() in other processes.
+        self._blocks = []
+        try:
+            for frame_name, df in frames.items():
+                self.spec[frame_name] = [self._publish(df[col]) for col in df.columns]
+        except Exception:
+            self.close()
+            raise
+
+    def _publish(self, series: pl.Series) -> SharedColumn:
+        time_unit = time_zone = None
+        if series.dtype == pl.Datetime:
+            time_unit, time_zone = series.dtype.time_unit, series.dtype.time_zone
+            series = series.dt.epoch(time_unit)
+        elif not (series.dtype.is_numeric() or series.dtype == pl.Boolean):
+            raise TypeError(f"Column {series.name} of type {series.dtype} can't be shared. "
+                            "Only numeric, boolean and Datetime columns are supported.")
+        values = series.to_numpy()
+        block = SharedMemory(create=True, size=max(values.nbytes, 1))
+        self._blocks.append(block)
+        np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+        return SharedColumn(series.name, block.name, values.dtype.str, len(values), time_unit, time_zone)
+
+    def close(self) -> None:
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attachFrames(spec: dict) -> tuple:
+    """Rebuilds the DataFrames published by SharedFrames from its spec, backed by the shared memory.
+
+    :return: (dict of name to pl.DataFrame, list of SharedMemory handles). Keep the handles alive as long as the
+             frames are in use.
+    """
+    frames = {}
+    blocks = []
+    for frame_name, columns in spec.items():
+        series = []
+        for col in columns:
+            block = SharedMemory(name=col.shm_name)
+            blocks.append(block)
+            values = np.ndarray((col.length,), dtype=np.dtype(col.dtype), buffer=block.buf)
+            s = pl.Series(col.name, values)
+            if col.time_unit is not None:
+                s = s.cast(pl.Datetime(col.time_unit, col.time_zone))
+            series.append(s)
+        frames[frame_name] = pl.DataFrame(series)
+    return frames, blocks
+
+
+def windowFrames(frames: dict, start=None, end=None) -> dict:
+    """Slices every frame to the rows with start <= timestamp < end, without copying.
+
+    :param frames: dict of name to pl.DataFrame, each sorted by timestamp.
+    :param start: first timestamp, as a datetime. None for the first row.
+    :param end: timestamp after the last row, as a datetime. None for the last row.
+    """
+    window = {}
+    for name, df in frames.items():
+        timestamps = df["timestamp"]
+        first = 0 if start is None else timestamps.search_sorted(start, side="left")
+        last = len(df) if end is None else timestamps.search_sorted(end, side="left")
+        window[name] = df.slice(first, last - first)
+    return window
+
+
+def workerFrames() -> dict:
+    """Frames attached by the current worker process of a pool started with _attachWorker."""
+    return _worker_frames
+
+
+def _attachWorker(spec: dict) -> None:
+    global _worker_frames, _worker_blocks
+    _worker_frames, _worker_blocks = attachFrames(spec)
+
+
+def _runOne(strategy_cls, params: dict, window: Optional[tuple] = None) -> dict:
+    frames = _worker_frames if window is None else windowFrames(_worker_frames, *window)
+    bt = strategy_cls(data=frames, **params)
+    bt.run()
+    return bt.results()
+
+
+class ParallelRunner:
+    """Runs many independent BTest instances over the same market data on a process pool.
+
+    The data is published once into shared memory and every worker attaches to it when it starts. The strategy
+    class must accept the frames as a `data` keyword, plus its parameters:
+
+        class MyStrat(BTest):
+            def __init__(self, data, fast=7):
+                self.spy = self.initEquity("SPY", data["SPY"], timeframe="1m", name="SPY")
+
+    Workers are spawned, so scripts that call run() need an `if __name__ == "__main__":` guard.
+    """
+
+    def __init__(self, strategy_cls, frames: dict, processes: Optional[int] = None):
+        """:param strategy_cls: BTest subclass to run. Must be importable by the worker processes.
+        :param frames: dict of name to pl.DataFrame, passed to the strategy as `data`.
+        :param processes: number of worker processes. Defaults to the number of cores.
+        """
+        self.strategy_cls = strategy_cls
+        self.frames = frames
+        self.processes = processes or os.cpu_count()
+
+    def run(self, param_list: list, window: Optional[tuple] = None) -> pl.DataFrame:
+        """Runs the strategy once per parameter dict and gathers the results.
+
+        :param param_list: list of keyword argument dicts, e.g. [{"fast": 5}, {"fast": 7}].
+        :param window: optional (start, end) timestamps. Each run only sees the rows with start <= timestamp < end.
+        :return: one row per run, with its parameters and the values returned by BTest.results().
+        """
+        with SharedFrames(self.frames) as shared:
+            # Spawn rather than fork: forking a process that has started Polars' thread pool can deadlock.
+            with ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_attachWorker, initargs=(shared.spec,)) as pool:
+                results = list(pool.map(_runOne, [self.strategy_cls] * len(param_list), param_list,
+                                         [window] * len(param_list)))
+        return pl.DataFrame([{**params, **result} for params, result in zip(param_list, results)])
@@ -0,0 +1,138 @@
+import time
+import polars as pl
+from functools import wraps
+
+TRACE_COLUMNS = ("tick", "timestamp", "timeframe", "bars", "indicators_us", "order_matching_us",
+                 "unaligned_indicators_us", "handler_us", "equity_mark_us")
+
+
+class Profiler():
+    """Per phase timings and counters of a BTest run. Pass one to BTest.run(profiler=...).
+
+    Phases of each tick:
+        indicators:            moving the equities of the tick to their new bar, which feeds their streaming
+                               indicators. Column indicators read the equity's row, so they cost nothing here.
+        order matching:        filling the resting limit and stop orders the new bars trigger.
+        unaligned indicators:  moving indicators with their own timestamps to the tick's timestamp.
+        handler <timeframe>:   the @onrow handler of the tick's timeframe, including the orders it sends.
+        equity mark:           marking the ledger's equity curve.
+    Orders sent by handlers are also timed on their own, as market orders and resting order placement, so
+    summary() can split the handlers' time between the strategy's code and the order path.
+
+    Without a profiler, a run only pays one check per tick and one per order.
+    """
+
+    def __init__(self, sample_every: int = 0, clock=time.perf_counter):
+        """:param sample_every: keep a trace of every sample_every-th tick, with its per phase times. 0 to disable.
+        :param clock: function returning seconds, e.g. time.perf_counter or time.process_time.
+        """
+        self.sample_every = sample_every
+        self.clock = clock
+        self.seconds = {}  # Phase -> total seconds.
+        self.calls = {}  # Phase -> number of times it ran.
+        self.counters = {}
+        self.trace = {col: [] for col in TRACE_COLUMNS}
+        self.run_seconds = 0.0
+        self._timeframes = []
+        self._started = None
+
+    def start(self, timeframes: list) -> None:
+        """Resets the profiler at the start of a run. Called by BTest.run."""
+        self.__init__(self.sample_every, self.clock)
+        self._timeframes = [str(timeframe) for timeframe in timeframes]
+        self.counters = {"ticks": 0, "bars": 0}
+        self._started = self.clock()
+
+    def stop(self, bt) -> None:
+        """Records the run time and the order counters at the end of a run. Called by BTest.run."""
+        self.run_seconds = self.clock() - self._started
+        self.counters["orders"] = bt.orderSim.lastOID
+        self.counters["fills"] = bt.ledger.n_fills
+        self.counters["open_orders"] = len(bt.orderBook.open_orders)
+
+    def add(self, phase: str, seconds: float, calls: int = 1) -> None:
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def recordTick(self, tick: int, timestamp: int, code: int, bars: int, indicators: float, matching: float,
+                   unaligned: float, handler: float, mark: float) -> None:
+        """Adds the phase times of one tick, in seconds. Called by BTest.run."""
+        counters = self.counters
+        counters["ticks"] += 1
+        counters["bars"] += bars
+        self.add("indicators", indicators, bars)
+        if matching:
+            self.add("order matching", matching)
+        self.add("unaligned indicators", unaligned)
+        self.add(f"handler {self._timeframes[code]}", handler)
+        self.add("equity mark", mark)
+        if self.sample_every and tick % self.sample_every == 0:
+            for col, value in zip(TRACE_COLUMNS, (tick, timestamp, self._timeframes[code], bars, indicators * 1e6,
+                                                  matching * 1e6, unaligned * 1e6, handler * 1e6, mark * 1e6)):
+                self.trace[col].append(value)
+
+    def summary(self) -> pl.DataFrame:
+        """One row per phase: total seconds, share of the run time, calls and microseconds per call.
+
+        'strategy code' is the handlers' time net of the orders they sent, and 'other' the run time not spent in
+        any tick phase, e.g. building the timeline and the ledger frames. See rates() for the counters.
+        """
+        handlers = sum(s for phase, s in self.seconds.items() if phase.startswith("handler "))
+        orders = self.seconds.get("market orders", 0.0) + self.seconds.get("resting order placement", 0.0)
+        tick_phases = sum(s for phase, s in self.seconds.items()
+                          if phase not in ("market orders", "resting order placement"))
+        order = ["indicators", "order matching", "unaligned indicators",
+                 *[f"handler {timeframe}" for timeframe in self._timeframes], "equity mark", "market orders",
+                 "resting order placement"]
+        rows = [(phase, self.seconds[phase], self.calls[phase]) for phase in order if phase in self.seconds]
+        rows.append(("strategy code", handlers - orders, None))
+        rows.append(("other", self.run_seconds - tick_phases, None))
+        total = self.run_seconds or 1.0
+        return pl.DataFrame(rows, schema={"phase": pl.String, "seconds": pl.Float64, "calls": pl.Int64},
+                            orient="row").with_columns(
+            (pl.col("seconds") / total).alias("share"),
+            (pl.col("seconds") / pl.col("calls") * 1e6).alias("us_per_call"),
+        )
+
+    def rates(self) -> dict:
+        """Counters of the run, with ticks and bars per second."""
+        seconds = self.run_seconds or float("nan")
+        return {**self.counters, "seconds": self.run_seconds, "ticks_per_second": self.counters["ticks"] / seconds,
+                "bars_per_second": self.counters["bars"] / seconds}
+
+    def traceFrame(self) -> pl.DataFrame:
+        """The sampled ticks, with each phase's time in microseconds."""
+        return pl.DataFrame(self.trace).with_columns(pl.col("timestamp").cast(pl.Datetime("us")))
+
+    def exportTrace(self, path: str) -> None:
+        """Writes the sampled ticks to a .parquet, .arrow/.ipc or .csv file."""
+        df = self.traceFrame()
+        if path.endswith(".parquet"):
+            df.write_parquet(path)
+        elif path.endswith((".arrow", ".ipc", ".feather")):
+            df.write_ipc(path)
+        elif path.endswith(".csv"):
+            df.write_csv(path)
+        else:
+            raise ValueError(f"Unsupported trace file {path}. Use .parquet, .arrow, .ipc or .csv.")
+
+    def __str__(self) -> str:
+        with pl.Config(tbl_rows=-1, float_precision=4):
+            return f"{self.summary()}\n{self.rates()}"
+
+
+def profiled(phase: str):
+    """Times a BTest method as phase when the run has a profiler. Without one it only adds a check."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            start = profiler.clock()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                profiler.add(phase, profiler.clock() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,139 @@
+import polars as pl
+from typing import Literal, Optional
+from BT_utils import Duration
+
+
+class Resampler():
+    """Builds higher timeframe OHLCV bars, e.g. 1h from 1m, with vectorized aggregation.
+
+    Buckets are aligned to the epoch, start at their label and include their start. A resampled bar is stamped
+    with the time it becomes known, so it can be merged into a backtest timeline without look-ahead:
+
+        available="end":  at the last base bar slot of the bucket, e.g. 10:59 for the 10:00 1h bar of 1m bars.
+                          The bar is only known once its period is over, even if its last base bars are missing.
+        available="last": at the last base bar actually in the bucket. Use when buckets are routinely cut short
+                          and complete, e.g. daily bars of a 9:30-16:00 session.
+
+    The bucket start is kept in the 'bucket' column. Columns other than OHLCV are dropped.
+    """
+
+    def __init__(self, timeframe: str, base_timeframe: str, available: Literal["end", "last"] = "end"):
+        """:param timeframe: timeframe to build, e.g. '1h'.
+        :param base_timeframe: timeframe of the bars being resampled, e.g. '1m'. Must divide timeframe.
+        :param available: when a resampled bar becomes known. See the class docstring.
+        """
+        self.timeframe = Duration(timeframe)
+        self.base_timeframe = Duration(base_timeframe)
+        if self.timeframe.microseconds <= self.base_timeframe.microseconds or \
+                self.timeframe.microseconds % self.base_timeframe.microseconds:
+            raise ValueError(f"Timeframe {timeframe} must be a multiple of, and longer than, {base_timeframe}.")
+        if available not in ("end", "last"):
+            raise ValueError(f"Invalid available {available}. Use 'end' or 'last'.")
+        self.available = available
+
+    def resample(self, df):
+        """Resamples base bars. Accepts a DataFrame or a LazyFrame and returns the same type.
+
+        :param df: bars with timestamp, open, high, low and close columns, and optionally volume.
+        """
+        schema = df.collect_schema() if isinstance(df, pl.LazyFrame) else df.schema
+        aggs = [pl.col("open").first(), pl.col("high").max(), pl.col("low").min(), pl.col("close").last()]
+        if "volume" in schema:
+            aggs.append(pl.col("volume").sum())
+        out = (
+            df.sort("timestamp")
+            .group_by_dynamic("timestamp", every=self.timeframe.str_format, closed="left", label="left")
+            .agg(*aggs, pl.col("timestamp").last().alias("_last"))
+            .rename({"timestamp": "bucket"})
+        )
+        if self.available == "end":
+            lag = self.timeframe.microseconds - self.base_timeframe.microseconds
+            available = pl.col("bucket") + pl.duration(microseconds=lag)
+        else:
+            available = pl.col("_last")
+        return out.with_columns(available.alias("timestamp")).select("timestamp", pl.exclude("timestamp", "_last"))
+
+    def update(self, resampled: pl.DataFrame, new_bars: pl.DataFrame) -> pl.DataFrame:
+        """Appends new base bars to already resampled bars, without re-aggregating the history.
+
+        Only the new bars are aggregated. If they continue the last, possibly partial, bucket, it is merged with
+        them, since OHLCV bars combine: first open, max high, min low, last close, summed volume.
+        :param resampled: output of resample() or update().
+        :param new_bars: base bars that come after every bar already resampled.
+        """
+        new = self.resample(new_bars)
+        if resampled.is_empty() or new.is_empty():
+            return pl.concat([resampled, new])
+        last_bucket, first_bucket = resampled["bucket"][-1], new["bucket"][0]
+        if first_bucket < last_bucket:
+            raise ValueError("New bars must come after the bars already resampled.")
+        if first_bucket > last_bucket:
+            return pl.concat([resampled, new])
+        aggs = [pl.col("timestamp").last(), pl.col("bucket").first(), pl.col("open").first(),
+                pl.col("high").max(), pl.col("low").min(), pl.col("close").last()]
+        if "volume" in new.columns:
+            aggs.append(pl.col("volume").sum())
+        merged = pl.concat([resampled.tail(1), new.head(1)]).select(aggs)
+        return pl.concat([resampled.head(-1), merged, new.slice(1)])
+
+
+class IncrementalResampler():
+    """Bar by bar version of Resampler, for bars that arrive one at a time, e.g. from a live feed.
+
+    Produces the same bars and availability timestamps as Resampler, as epoch microsecond tuples of
+    (timestamp, bucket, open, high, low, close, volume).
+    """
+    __slots__ = ("every", "lag", "available", "bucket", "bar")
+
+    def __init__(self, timeframe: str, base_timeframe: str, available: Literal["end", "last"] = "end"):
+        resampler = Resampler(timeframe, base_timeframe, available)  # Validates the arguments.
+        self.every = resampler.timeframe.microseconds
+        self.lag = self.every - resampler.base_timeframe.microseconds
+        self.available = available
+        self.bucket = None  # Start of the forming bucket.
+        self.bar = None  # [last timestamp, open, high, low, close, volume] of the forming bucket.
+
+    def update(self, timestamp: int, open: float, high: float, low: float, close: float,
+               volume: float = 0.0) -> list:
+        """Adds a base bar and returns the bars it completes, oldest first. Usually empty.
+
+        :param timestamp: timestamp of the base bar in epoch microseconds. Must not go backwards.
+        """
+        completed = []
+        bucket = timestamp - timestamp % self.every
+        bar = self.bar
+        if bar is not None and bucket != self.bucket:
+            completed.append(self._close())  # A new bucket started, so the forming one is over.
+            bar = None
+        if bar is None:
+            self.bucket = bucket
+            self.bar = [timestamp, open, high, low, close, volume]
+        else:
+            bar[0] = timestamp
+            if high > bar[2]:
+                bar[2] = high
+            if low < bar[3]:
+                bar[3] = low
+            bar[4] = close
+            bar[5] += volume
+        if timestamp >= bucket + self.lag:  # Last base bar slot of the bucket.
+            completed.append(self._close())
+        return completed
+
+    @property
+    def forming(self) -> Optional[tuple]:
+        """The incomplete bar of the current bucket, or None. Using it in a strategy is look-ahead free, but it
+        will still change."""
+        if self.bar is None:
+            return None
+        return (self.bar[0], self.bucket, *self.bar[1:])
+
+    def flush(self) -> Optional[tuple]:
+        """Closes and returns the forming bar, e.g. at the end of the data."""
+        return self._close() if self.bar is not None else None
+
+    def _close(self) -> tuple:
+        bar = self.bar
+        timestamp = self.bucket + self.lag if self.available == "end" else bar[0]
+        self.bar = None
+        return (timestamp, self.bucket, *bar[1:])
@@ -0,0 +1,141 @@
+"""Benchmarks of the backtester and research hot paths, on synthetic data. Runs offline.
+
+    python bench.py --scale small --out results.json
+    python bench.py --scale small --baseline baseline.json      # Exits with 1 if a case regressed.
+    python bench.py --scale medium --cases btest_run order_fills --save-baseline baseline.json
+
+Each case runs in a fresh process, so its memory peak isn't inflated by the cases before it. Times are the best
+of --repeat runs. peak_traced_mb is the largest memory traced by tracemalloc during one more run, which covers
+Python objects and NumPy arrays but not Polars' own allocations. peak_rss_mb is the growth of the process's
+maximum resident set size over the memory held after building the data, and covers everything, so it's the one
+compared to the baseline.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("", "backtester", "research", "utilities", "benchmarks"):
+    path = os.path.join(ROOT, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import numpy as np
+import polars as pl
+from cases import CASES, SCALES
+
+TIME_TOLERANCE = 0.25  # Fractional slowdown before a case counts as a regression.
+MEMORY_TOLERANCE = 0.10
+MEMORY_SLACK_MB = 2.0  # Growth in MB below which a memory peak never counts as a regression, as RSS is page noisy.
+
+
+def _maxRss() -> float:
+    """Maximum resident set size of this process so far, in MB. ru_maxrss is in KB on Linux."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(case: str, params: dict, repeat: int = 3) -> dict:
+    """Builds a case's data, then times it and measures its memory peaks. Runs in the calling process."""
+    fn = CASES[case](**params)
+    setup_rss = _maxRss()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"case": case, "params": params, "seconds": min(times), "median_seconds": float(np.median(times)),
+            "repeat": repeat, "peak_traced_mb": peak / 2**20, "peak_rss_mb": _maxRss() - setup_rss}
+
+
+def runSuite(cases: list, scale: str, repeat: int = 3) -> dict:
+    """Measures each case in its own process, one at a time, so they don't compete for cores."""
+    results = []
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results.append(pool.submit(measure, case, SCALES[scale], repeat).result())
+    return {"meta": environment(scale), "results": results}
+
+
+def environment(scale: str) -> dict:
+    return {"scale": scale, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "polars": pl.__version__, "numpy": np.__version__, "platform": platform.platform(),
+            "cpus": os.cpu_count()}
+
+
+def compare(results: dict, baseline: dict, time_tolerance: float = TIME_TOLERANCE,
+            memory_tolerance: float = MEMORY_TOLERANCE) -> list:
+    """Cases that are slower, or use more memory, than in the baseline by more than the tolerances.
+
+    Memory is compared on peak_rss_mb, which unlike peak_traced_mb includes Polars' native allocations.
+    Cases are matched by name and params, so results from another scale are never compared.
+    :return: list of dicts with the case, the metric, the baseline and current values and their ratio.
+    """
+    saved = {(r["case"], json.dumps(r["params"], sort_keys=True)): r for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        base = saved.get((result["case"], json.dumps(result["params"], sort_keys=True)))
+        if base is None:
+            continue
+        checks = (("seconds", time_tolerance, 0), ("peak_rss_mb", memory_tolerance, MEMORY_SLACK_MB))
+        for metric, tolerance, slack in checks:
+            if base[metric] > 0 and result[metric] > max(base[metric] * (1 + tolerance), base[metric] + slack):
+                regressions.append({"case": result["case"], "metric": metric, "baseline": base[metric],
+                                    "current": result[metric], "ratio": result[metric] / base[metric]})
+    return regressions
+
+
+def table(results: dict, baseline: dict = None) -> pl.DataFrame:
+    """Results as a DataFrame, with the ratio to the baseline when there is one."""
+    df = pl.DataFrame([{key: value for key, value in r.items() if key != "params"} for r in results["results"]])
+    if baseline is not None:
+        saved = pl.DataFrame([{"case": r["case"], "baseline_seconds": r["seconds"]} for r in baseline["results"]])
+        df = df.join(saved, on="case", how="left", maintain_order="left") \
+            .with_columns((pl.col("seconds") / pl.col("baseline_seconds")).alias("vs_baseline"))
+    return df
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the backtester and research hot paths.")
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", help="Path to write the results to, as JSON.")
+    parser.add_argument("--baseline", help="Results JSON to compare against. Regressions exit with code 1.")
+    parser.add_argument("--save-baseline", help="Path to save the results to as the new baseline.")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = runSuite(args.cases, args.scale, args.repeat)
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    with pl.Config(tbl_cols=-1, tbl_rows=-1, float_precision=3):
+        print(table(results, baseline))
+    if baseline is None:
+        return 0
+    regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+    for r in regressions:
+        print(f"REGRESSION {r['case']} {r['metric']}: {r['baseline']:.4g} -> {r['current']:.4g} "
+              f"({r['ratio']:.2f}x)")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import polars as pl
+from synthetic import syntheticBars, syntheticUniverse
+from BT_engine import BTest
+from BT_utils import onrow
+from indicators import SMA
+from orders import OrderSim, OrderBook, FillModel
+from research import ResearchStrat
+from dataCleaner import DataCleaner
+
+HIGHER_TIMEFRAMES = ["5m", "15m", "1h", "4h"]  # Added on top of the 1m base bars, in order.
+
+
+class BenchStrat(BTest):
+    """Reads OHLCV and a streaming SMA on every bar of every symbol and sends orders_per_bar market orders."""
+
+    def __init__(self, data: dict, timeframes: int = 1, orders_per_bar: int = 1):
+        self.cash = 1_000_000
+        self.commision_per = 0.0005
+        self.orders_per_bar = orders_per_bar
+        self.symbols = []
+        for name, df in data.items():
+            eq = self.initEquity(name, df, timeframe="1m", name=name)
+            self.addStreamingIndicator(eq, "sma", SMA(20))
+            for timeframe in HIGHER_TIMEFRAMES[:timeframes - 1]:
+                self.addTimeframe(eq, timeframe, name=f"{name}_{timeframe}")
+            self.symbols.append(eq)
+        self.side = "BUY"
+
+    def onRow(self, d, timeframe):
+        pass
+
+    @onrow(timeframe="1m")
+    def onMinute(self, d):
+        for eq in self.symbols:
+            if eq.row < 0 or eq.close[0] < eq.sma[0]:
+                continue
+            for _ in range(self.orders_per_bar):
+                self.marketOrder(eq, 1, self.side)
+                self.side = "SELL" if self.side == "BUY" else "BUY"
+
+    @onrow
+    def onHigher(self, d):
+        for eq in self.symbols:
+            eq.close[0]
+
+
+class BenchResearch(ResearchStrat):
+    """SMA crossover, long when the fast average is above the slow one."""
+
+    def initColumns(self):
+        for symbol, df in list(self.dfs.items()):
+            self.dfs[symbol] = df.with_columns(pl.col("close").rolling_mean(10).alias("fast"),
+                                               pl.col("close").rolling_mean(50).alias("slow")).drop_nulls()
+
+    def setSignals(self):
+        for symbol, df in list(self.dfs.items()):
+            self.dfs[symbol] = df.with_columns(
+                (pl.col("fast") > pl.col("slow")).cast(pl.Int8).alias("long_entry"),
+                (pl.col("fast") < pl.col("slow")).cast(pl.Int8).alias("long_exit"),
+                pl.lit(0, pl.Int8).alias("short_entry"),
+                pl.lit(0, pl.Int8).alias("short_exit"),
+            )
+
+
+# Each case builds its data and returns the function to measure, so data generation is never timed.
+
+def btestRun(bars: int, symbols: int, timeframes: int, orders_per_bar: int, **_):
+    """BTest.run of BenchStrat, including building the strategy and its equities."""
+    data = syntheticUniverse(symbols, bars)
+
+    def run():
+        bt = BenchStrat(data, timeframes=timeframes, orders_per_bar=orders_per_bar)
+        bt.run()
+        return bt
+    return run
+
+
+def researchBacktest(bars: int, symbols: int, **_):
+    """ResearchStrat.runBacktest of BenchResearch, with its columns and signals."""
+    data = syntheticUniverse(symbols, bars)
+
+    def run():
+        strat = BenchResearch.fromFrames(data, starting_cash=100_000)
+        strat.initColumns()
+        strat.setSignals()
+        strat.runBacktest()
+        return strat
+    return run
+
+
+def dataCleaner(bars: int, **_):
+    """DataCleaner.cleanHighLows then aggregate to 5m, on one symbol's bars with 0.1% bad prints."""
+    df = syntheticBars(bars, outlier_rate=0.001)
+
+    def run():
+        cleaner = DataCleaner("5m", "1m", polars_df=df.lazy())
+        cleaner.cleanHighLows()
+        cleaner.aggregate()
+        return cleaner.collect()
+    return run
+
+
+def orderFills(bars: int, orders_per_bar: int, **_):
+    """The order path without a strategy: market fills from the FillModel, plus a resting limit and stop order
+    placed on every bar and matched against the following bars."""
+    df = syntheticBars(bars)
+    high, low, close = (df[col].to_list() for col in ("high", "low", "close"))
+
+    def run():
+        sim, book, model = OrderSim(), OrderBook([]), FillModel(df)
+        for row in range(bars):
+            for order in book.matchBar(0, high[row], low[row]):
+                sim.fillRestingOrder(order, model, row)
+            for k in range(orders_per_bar):
+                sim.fillMarketOrder(close[row], 1, "BUY" if k % 2 == 0 else "SELL", model, row)
+            book.addOrder(sim.createRestingOrder("LIMIT", close[row] * 0.999, 1, row, "BUY", 0))
+            book.addOrder(sim.createRestingOrder("STOP", close[row] * 1.001, 1, row, "BUY", 0))
+        return sim
+    return run
+
+
+CASES = {
+    "btest_run": btestRun,
+    "research_backtest": researchBacktest,
+    "data_cleaner": dataCleaner,
+    "order_fills": orderFills,
+}
+
+SCALES = {
+    "small": {"bars": 20_000, "symbols": 2, "timeframes": 2, "orders_per_bar": 1},
+    "medium": {"bars": 200_000, "symbols": 5, "timeframes": 3, "orders_per_bar": 2},
+    "large": {"bars": 1_000_000, "symbols": 10, "timeframes": 4, "orders_per_bar": 4},
+}
@@ -0,0 +1,87 @@
+"""Checks that the package's modules import fast, and without their heavy optional dependencies.
+
+    python importTime.py                # Exits with 1 if a module is over budget or imports a heavy dependency.
+    python importTime.py --budget 0.5
+
+Each module is imported in a fresh interpreter, as a worker process would, and timed there. numpy and polars are
+imported first and not counted, since every module needs them. Any other third-party package the import loads is
+reported too, as the engine and research modules only need numpy and polars.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = [os.path.join(ROOT, directory) for directory in ("", "backtester", "research", "utilities")]
+
+MODULES = ["BT_engine", "BT_utils", "indicators", "orders", "parallel", "feeds", "research", "analytics",
+           "walkforward", "dataCleaner", "dataDownloader"]
+# Only loaded on first use, e.g. by plotting, statistical tests or the Alpaca client.
+HEAVY = ["pandas", "scipy", "hyppo", "matplotlib", "seaborn", "alpaca", "future"]
+BUDGET = 0.25  # Seconds per module, on top of numpy and polars.
+
+_PROBE = """
+import sys, time, json
+sys.path[:0] = {paths!r}
+import numpy, polars
+loaded = set(sys.modules)
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+third_party = sorted({{name.split(".")[0] for name, m in list(sys.modules.items()) if name not in loaded
+                      and name.split(".")[0] not in sys.stdlib_module_names and not name.startswith("_")
+                      and not (getattr(m, "__file__", None) or "").startswith({root!r})}})
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {heavy!r} if m in sys.modules],
+                  "third_party": third_party}}))
+"""
+
+
+def importTime(module: str) -> dict:
+    """Imports module in a new interpreter and returns the seconds it took, the heavy modules it loaded and the
+    third-party packages other than numpy and polars it loaded."""
+    code = _PROBE.format(paths=PATHS, module=module, heavy=HEAVY, root=ROOT)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if out.returncode != 0:
+        return {"module": module, "seconds": None, "heavy": [], "third_party": [],
+                "error": out.stderr.strip().splitlines()[-1]}
+    return {"module": module, **json.loads(out.stdout.strip().splitlines()[-1]), "error": None}
+
+
+def check(modules: list = MODULES, budget: float = BUDGET, repeat: int = 3) -> list:
+    """Best of repeat import times of each module. A module fails if it errors, loads a heavy dependency or a
+    third-party package other than numpy and polars, or takes longer than budget."""
+    results = []
+    for module in modules:
+        runs = [importTime(module) for _ in range(repeat)]
+        times = [run["seconds"] for run in runs if run["seconds"] is not None]
+        result = {**runs[0], "seconds": min(times) if times else None}
+        result["ok"] = (result["error"] is None and not result["heavy"] and not result["third_party"]
+                        and result["seconds"] <= budget)
+        results.append(result)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Import time budget of the package's modules.")
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--budget", type=float, default=BUDGET, help="Seconds allowed per module.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", help="Path to write the results to, as JSON.")
+    args = parser.parse_args(argv)
+
+    results = check(args.modules, args.budget, args.repeat)
+    for r in results:
+        seconds = "failed" if r["seconds"] is None else f"{r['seconds'] * 1000:8.1f} ms"
+        loaded = r["heavy"] + [m for m in r["third_party"] if m not in r["heavy"]]
+        problems = r["error"] or (f"imports {', '.join(loaded)}" if loaded else "")
+        print(f"{'ok  ' if r['ok'] else 'FAIL'} {r['module']:<16} {seconds:>11} {problems}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
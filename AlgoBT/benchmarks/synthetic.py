@@ -0,0 +1,52 @@
+import numpy as np
+import polars as pl
+from datetime import datetime
+from typing import Optional
+
+START = datetime(2020, 1, 1)
+EVERY = {"s": 1_000_000, "m": 60_000_000, "h": 3_600_000_000, "d": 86_400_000_000}
+
+
+def syntheticBars(n_bars: int, timeframe: str = "1m", seed: int = 0, start: datetime = START,
+                  outlier_rate: float = 0.0) -> pl.DataFrame:
+    """OHLCV bars of a geometric random walk, with no gaps. The same arguments always give the same bars.
+
+    :param n_bars: number of bars.
+    :param timeframe: bar length, a number followed by s, m, h or d, e.g. '1m'.
+    :param seed: seed of the random generator.
+    :param outlier_rate: fraction of bars given a bad print: a high or low 20 to 50 times further from the body
+                         than usual, for DataCleaner.cleanHighLows() to clip.
+    """
+    rng = np.random.default_rng(seed)
+    step = int(timeframe[:-1]) * EVERY[timeframe[-1]]
+    first = int((start - datetime(1970, 1, 1)).total_seconds()) * 1_000_000
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, n_bars)))
+    open = np.concatenate(([100.0], close[:-1]))
+    body_high, body_low = np.maximum(open, close), np.minimum(open, close)
+    high = body_high * (1 + rng.exponential(0.0005, n_bars))
+    low = body_low * (1 - rng.exponential(0.0005, n_bars))
+    if outlier_rate:
+        bad = rng.random(n_bars) < outlier_rate
+        spike = rng.uniform(20, 50, n_bars) * (high - body_high)
+        up = rng.random(n_bars) < 0.5
+        high = np.where(bad & up, body_high + spike, high)
+        low = np.where(bad & ~up, np.maximum(body_low - spike, body_low * 0.5), low)
+    return pl.DataFrame({
+        "timestamp": pl.Series(first + step * np.arange(n_bars, dtype=np.int64)).cast(pl.Datetime("us")),
+        "open": open,
+        "high": high,
+        "low": low,
+        "close": close,
+        "volume": rng.integers(100, 10_000, n_bars).astype(np.float64),
+    })
+
+
+def syntheticUniverse(n_symbols: int, n_bars: int, timeframe: str = "1m", seed: int = 0,
+                      outlier_rate: float = 0.0, names: Optional[list] = None) -> dict:
+    """syntheticBars() for several symbols sharing one time range, as a dict of name to DataFrame.
+
+    :param names: symbol names. Defaults to S0, S1, ...
+    """
+    names = names or [f"S{i}" for i in range(n_symbols)]
+    return {name: syntheticBars(n_bars, timeframe, seed + i, outlier_rate=outlier_rate)
+            for i, name in enumerate(names[:n_symbols])}
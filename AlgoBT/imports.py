@@ -1,10 +1,42 @@
-import pandas as pd
+import importlib
 import datetime
 from datetime import datetime as dt
-import seaborn as sns
-import matplotlib.pyplot as plt
 import numpy as np
 import polars as pl
-from backteseter import onRow
 
-# I am aware some of these imports may be unused.
+
+class LazyModule():
+    """Stands in for a module that is only imported when one of its attributes is first used.
+
+    Keeps heavy optional dependencies, such as plotting and statistics libraries, out of the import time of the
+    backtester and of every worker process that never uses them.
+    """
+
+    def __init__(self, name: str, package: str = None):
+        """:param name: module to import, e.g. 'matplotlib.pyplot'.
+        :param package: pip package providing it, named in the error if it isn't installed. Defaults to the top
+                        level module.
+        """
+        self.__dict__["_name"] = name
+        self.__dict__["_package"] = package or name.split(".")[0]
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            try:
+                module = importlib.import_module(self._name)
+            except ImportError as e:
+                raise ImportError(f"{self._name} is needed for this feature. Install it with "
+                                  f"'pip install {self._package}'.") from e
+            self.__dict__["_module"] = module
+        return getattr(module, attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+pd = LazyModule("pandas")
+sns = LazyModule("seaborn")
+plt = LazyModule("matplotlib.pyplot", "matplotlib")
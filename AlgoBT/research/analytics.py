@@ -0,0 +1,242 @@
+import polars as pl
+from typing import Optional
+
+BUY_SIDES = ("BUY", "COVER")
+
+
+def _grouped(expr: pl.Expr, over: Optional[list]) -> pl.Expr:
+    return expr.over(over) if over else expr
+
+
+def tradeIds(position: str = "position", over: Optional[list] = None) -> pl.Expr:
+    """Numbers the runs of bars in a trade. A trade starts when the position leaves zero or flips sign.
+
+    Bars without a position get a null ID.
+    :param position: column with the signed position of each bar, e.g. 1 long, -1 short, 0 flat.
+    :param over: key columns, e.g. ["symbol"]. IDs are numbered separately for each group.
+    """
+    pos = pl.col(position).fill_null(0)
+    prev = _grouped(pos.shift(1), over).fill_null(0)
+    starts = (pos != 0) & (pos.sign() != prev.sign())
+    ids = _grouped(starts.cast(pl.UInt32).cum_sum(), over)
+    return pl.when(pos != 0).then(ids).alias("trade_id")
+
+
+def drawdown(returns: str = "strategy_returns", over: Optional[list] = None) -> pl.Expr:
+    """Drawdown of the cumulative returns from their running peak, at every bar. Returns are summed, like
+    ResearchStrat.calcReturns."""
+    cum = pl.col(returns).fill_null(0).cum_sum()
+    return _grouped(cum - cum.cum_max(), over).alias("drawdown")
+
+
+def fromResearch(df):
+    """Adapts the output of ResearchStrat.runBacktest for analyze().
+
+    Adds 'position' (is_long - is_short) and recomputes 'strategy_returns' from it, so short trades earn the
+    negated returns, like calcReturns() and sweep().
+    """
+    columns = df.collect_schema().names() if isinstance(df, pl.LazyFrame) else df.columns
+    if missing := {"timestamp", "returns", "is_long", "is_short"} - set(columns):
+        raise ValueError(f"Missing columns: {missing}. Run runBacktest() first.")
+    return df.with_columns((pl.col("is_long") - pl.col("is_short")).cast(pl.Int8).alias("position")) \
+        .with_columns((pl.col("returns") * pl.col("position")).alias("strategy_returns"))
+
+
+def tradeTable(df, position: str = "position", returns: str = "strategy_returns", timestamp: str = "timestamp",
+               over: Optional[list] = None) -> pl.LazyFrame:
+    """One row per trade of a bar level frame, aggregated with a single group_by.
+
+    Columns: the over keys, trade_id, entry_time, exit_time (last bar held), bars, direction (1 long, -1 short),
+    pnl (summed returns), mfe and mae (best and worst cumulative return during the trade, 0 if never
+    positive or negative).
+    :param df: DataFrame or LazyFrame with timestamp, position and per bar strategy returns, e.g. from
+               fromResearch().
+    :param over: key columns separating independent series, e.g. ["symbol"] or ["symbol", "fast", "slow"].
+    """
+    over = list(over or [])
+    cum = pl.col(returns).fill_null(0).cum_sum()
+    return (
+        df.lazy()
+        .with_columns(tradeIds(position, over))
+        .filter(pl.col("trade_id").is_not_null())
+        .group_by(*over, "trade_id", maintain_order=True)
+        .agg(
+            pl.col(timestamp).first().alias("entry_time"),
+            pl.col(timestamp).last().alias("exit_time"),
+            pl.len().alias("bars"),
+            pl.col(position).first().sign().cast(pl.Int8).alias("direction"),
+            pl.col(returns).sum().alias("pnl"),
+            cum.max().clip(lower_bound=0).alias("mfe"),
+            cum.min().clip(upper_bound=0).alias("mae"),
+        )
+        .with_columns((pl.col("exit_time") - pl.col("entry_time")).alias("duration"))
+    )
+
+
+def barMetrics(returns: str = "strategy_returns", position: str = "position",
+               periods_per_year: float = 252) -> list:
+    """Aggregate expressions of the metrics computed from per bar returns and positions."""
+    r = pl.col(returns).fill_null(0)
+    pos = pl.col(position).fill_null(0)
+    cum = r.cum_sum()
+    annualize = periods_per_year ** 0.5
+    downside = (r.clip(upper_bound=0) ** 2).mean().sqrt()
+    return [
+        r.sum().alias("total_return"),
+        r.mean().alias("mean_return"),
+        r.std().alias("std_return"),
+        (r.mean() / r.std() * annualize).alias("sharpe"),
+        (r.mean() / downside * annualize).alias("sortino"),
+        (cum - cum.cum_max()).min().alias("max_drawdown"),
+        (pos != 0).mean().alias("exposure"),
+        # Mean absolute change in position per bar, per year. Entering counts from flat.
+        (pos.diff().fill_null(pos.first()).abs().mean() * periods_per_year).alias("turnover"),
+    ]
+
+
+def tradeMetrics() -> list:
+    """Aggregate expressions of the metrics computed from a trade table's pnl and bars columns."""
+    pnl = pl.col("pnl")
+    return [
+        pl.len().alias("n_trades"),
+        (pnl > 0).mean().alias("hit_rate"),
+        pnl.mean().alias("avg_trade"),
+        (pnl.filter(pnl > 0).sum() / -pnl.filter(pnl < 0).sum()).alias("profit_factor"),
+        pl.col("bars").mean().alias("avg_bars"),
+    ]
+
+
+def analyze(df, position: str = "position", returns: str = "strategy_returns", timestamp: str = "timestamp",
+            over: Optional[list] = None, periods_per_year: float = 252) -> tuple:
+    """Computes the trade table and the performance metrics of a bar level frame.
+
+    Both queries are collected together, so the input is scanned and its trades segmented once.
+    :param over: key columns separating independent series, e.g. ["symbol"]. Metrics are computed per group.
+    :param periods_per_year: bars per year, used to annualize sharpe, sortino and turnover.
+    :return: (trades, metrics) DataFrames. metrics has one row per group.
+    """
+    over = list(over or [])
+    lf = df.lazy()
+    trades = tradeTable(lf, position, returns, timestamp, over)
+    bar_metrics = barMetrics(returns, position, periods_per_year)
+    if over:
+        bars = lf.group_by(over, maintain_order=True).agg(bar_metrics)
+        per_trade = trades.group_by(over).agg(tradeMetrics())
+        metrics = bars.join(per_trade, on=over, how="left", nulls_equal=True, maintain_order="left")
+    else:
+        metrics = pl.concat([lf.select(bar_metrics), trades.select(tradeMetrics())], how="horizontal")
+    trades, metrics = pl.collect_all([trades, metrics])
+    return trades, metrics.with_columns(pl.col("n_trades").fill_null(0))
+
+
+def ledgerTrades(fills: pl.DataFrame, bars: Optional[dict] = None) -> pl.DataFrame:
+    """One row per round trip trade of a BTest fills ledger, from the fill that opens a position to the fill
+    that flattens it.
+
+    A fill that flips the position from long to short or back is split into a closing and an opening part,
+    with its commission split pro rata. Columns: equity, trade_id, entry_time, exit_time (null while open),
+    direction, max_qty, n_fills, entry_price (average opening price), commission, pnl (net cash flow of a
+    closed trade, null while open), return (pnl over the opening notional), closed and duration.
+    :param fills: BTest.fills.
+    :param bars: optional dict of equity name to its OHLC DataFrame. Adds mfe and mae: the best and worst
+                 price reached during the trade, as a return from entry_price. A fill happens at the close of
+                 its bar, so the bars after the entry bar up to and including the exit bar are used.
+    """
+    signed = pl.when(pl.col("side").is_in(BUY_SIDES)).then(pl.col("qty")).otherwise(-pl.col("qty"))
+    # Fills are replayed in the order they happened. Resting orders get their oid when placed, not when filled,
+    # so the oid isn't chronological, while the ledger records fills as they happen.
+    lf = (
+        fills.lazy().with_row_index("_row").sort("time", "_row")
+        .with_columns(signed.alias("signed_qty"))
+        .with_columns(pl.col("signed_qty").cum_sum().over("equity").alias("position"))
+        .with_columns(pl.col("position").shift(1, fill_value=0).over("equity").alias("prev_position"))
+    )
+    pos, prev = pl.col("position"), pl.col("prev_position")
+    flips = (prev != 0) & (pos != 0) & (prev.sign() != pos.sign())
+    commission_share = pl.col("commission") / pl.col("signed_qty").abs()
+    lf = pl.concat([
+        lf.filter(~flips).with_columns(pl.lit(0).alias("part")),
+        lf.filter(flips).with_columns((-prev).alias("signed_qty"), pl.lit(0.0).alias("position"),
+                                      (commission_share * prev.abs()).alias("commission"), pl.lit(0).alias("part")),
+        lf.filter(flips).with_columns(pos.alias("signed_qty"), pl.lit(0.0).alias("prev_position"),
+                                      (commission_share * pos.abs()).alias("commission"), pl.lit(1).alias("part")),
+    ]).sort("time", "_row", "part")
+    lf = lf.with_columns((pl.col("prev_position") == 0).cast(pl.UInt32).cum_sum().over("equity").alias("trade_id"))
+
+    opened = (pos.abs() - prev.abs()).clip(lower_bound=0)
+    closed = pos.last() == 0
+    trades = (
+        lf.group_by("equity", "trade_id", maintain_order=True)
+        .agg(
+            pl.col("time").first().alias("entry_time"),
+            pl.when(closed).then(pl.col("time").last()).alias("exit_time"),
+            pos.first().sign().cast(pl.Int8).alias("direction"),
+            pos.abs().max().alias("max_qty"),
+            pl.len().alias("n_fills"),
+            ((opened * pl.col("price")).sum() / opened.sum()).alias("entry_price"),
+            (opened * pl.col("price")).sum().alias("_notional"),
+            pl.col("commission").sum(),
+            pl.when(closed).then((-pl.col("signed_qty") * pl.col("price") - pl.col("commission")).sum())
+            .alias("pnl"),
+            closed.alias("closed"),
+        )
+        .with_columns((pl.col("pnl") / pl.col("_notional")).alias("return"),
+                      (pl.col("exit_time") - pl.col("entry_time")).alias("duration"))
+        .drop("_notional")
+    )
+    if bars:
+        trades = trades.join(_priceExcursions(lf, bars), on=["equity", "trade_id"], how="left") \
+            .with_columns(
+                (pl.col("direction") * (pl.when(pl.col("direction") > 0).then(pl.col("_high"))
+                                        .otherwise(pl.col("_low")) / pl.col("entry_price") - 1)).alias("mfe"),
+                (pl.col("direction") * (pl.when(pl.col("direction") > 0).then(pl.col("_low"))
+                                        .otherwise(pl.col("_high")) / pl.col("entry_price") - 1)).alias("mae"),
+            ).drop("_high", "_low")
+    return trades.collect()
+
+
+def _priceExcursions(fills: pl.LazyFrame, bars: dict) -> pl.LazyFrame:
+    """Highest high and lowest low of each trade's bars."""
+    states = fills.select("equity", "time", "trade_id", "position")
+    frames = []
+    for name, df in bars.items():
+        # The position held during a bar is the one left by the last fill before it.
+        held = df.lazy().select(pl.col("timestamp").alias("time"), "high", "low").sort("time").join_asof(
+            states.filter(pl.col("equity") == name).sort("time"), on="time", strategy="backward",
+            allow_exact_matches=False)
+        frames.append(held.filter(pl.col("position") != 0).group_by("trade_id").agg(
+            pl.lit(name).alias("equity"), pl.col("high").max().alias("_high"), pl.col("low").min().alias("_low")))
+    return pl.concat(frames).select("equity", "trade_id", "_high", "_low")
+
+
+def ledgerMetrics(fills: pl.DataFrame, equity_curve: pl.DataFrame, bars: Optional[dict] = None,
+                  periods_per_year: float = 252) -> tuple:
+    """Trade table and performance metrics of a BTest run, from its fills ledger and equity curve.
+
+    :param equity_curve: BTest.equity_curve.
+    :param periods_per_year: marks of the equity curve per year, used to annualize sharpe and sortino.
+    :return: (trades, metrics). metrics has one row. turnover is the traded notional over the average equity.
+    """
+    trades = ledgerTrades(fills, bars)
+    curve = equity_curve.lazy().select(pl.col("equity").pct_change().fill_null(0).alias("r"), "equity")
+    r = pl.col("r")
+    annualize = periods_per_year ** 0.5
+    curve_metrics = curve.select(
+        (pl.col("equity").last() / pl.col("equity").first() - 1).alias("total_return"),
+        (r.mean() / r.std() * annualize).alias("sharpe"),
+        (r.mean() / (r.clip(upper_bound=0) ** 2).mean().sqrt() * annualize).alias("sortino"),
+        (pl.col("equity") / pl.col("equity").cum_max() - 1).min().alias("max_drawdown"),
+        pl.col("equity").mean().alias("_avg_equity"),
+    )
+    closed = trades.lazy().filter(pl.col("closed"))
+    trade_metrics = closed.select(
+        pl.len().alias("n_trades"),
+        (pl.col("pnl") > 0).mean().alias("hit_rate"),
+        pl.col("pnl").mean().alias("avg_trade"),
+        pl.col("duration").mean().alias("avg_duration"),
+    )
+    traded = fills.lazy().select((pl.col("qty") * pl.col("price")).sum().alias("_traded"))
+    metrics = pl.concat([curve_metrics, trade_metrics, traded], how="horizontal") \
+        .with_columns((pl.col("_traded") / pl.col("_avg_equity")).alias("turnover")) \
+        .drop("_avg_equity", "_traded").collect()
+    return trades, metrics
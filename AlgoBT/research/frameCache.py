@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+from typing import Optional
+import polars as pl
+
+
+class FrameCache():
+    """Content addressed, size capped disk cache of derived columns.
+
+    An entry holds the columns computed by a list of expressions over a source. Its key is a hash of the source
+    fingerprint, the serialized expressions and any extra parameters, so an entry is reused only while all three
+    are unchanged, and editing the data file or an expression simply misses. Entries are uncompressed Arrow IPC
+    files, which are memory-mapped when read instead of being parsed and copied.
+
+    The modification time of an entry is bumped whenever it's read, and when the cache grows past max_bytes the
+    least recently used entries are deleted, except the one just written. Entries are read as soon as they're returned,
+    rather than scanned when the LazyFrame is collected, so deleting them never breaks a frame that was already
+    handed out.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 2 * 1024 ** 3):
+        """:param root: directory of the cache. Created if it doesn't exist.
+        :param max_bytes: size cap of the cache on disk. Defaults to 2 GiB.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, source, exprs: list, params: Optional[dict] = None) -> str:
+        """Key of the columns computed by exprs over source.
+
+        :param source: fingerprint of the input data, e.g. from fileFingerprint(). Must be JSON serializable.
+        :param exprs: Polars expressions of the derived columns.
+        :param params: anything else the result depends on, e.g. the date range the source was narrowed to.
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps([pl.__version__, source, params], sort_keys=True, default=str).encode())
+        for expr in exprs:
+            h.update(expr.meta.serialize(format="json").encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[pl.LazyFrame]:
+        """Returns the cached columns, or None if the key isn't cached."""
+        path = self._path(key)
+        try:
+            os.utime(path)  # Mark as recently used.
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._read(path)
+
+    def put(self, key: str, df: pl.DataFrame) -> None:
+        path = self._path(key)
+        df.write_ipc(path + ".tmp", compression="uncompressed")
+        os.replace(path + ".tmp", path)
+        self.evict(keep=path)
+
+    def columns(self, lf, source, exprs: list, params: Optional[dict] = None) -> pl.LazyFrame:
+        """Returns the columns computed by exprs over lf, from the cache if possible.
+
+        :param lf: DataFrame or LazyFrame the expressions are evaluated on.
+        :param source: fingerprint of the data lf was loaded from.
+        """
+        key = self.key(source, exprs, params)
+        cached = self.get(key)
+        if cached is None:
+            self.put(key, lf.lazy().select(exprs).collect())
+            cached = self._read(self._path(key))
+        return cached
+
+    def withColumns(self, lf, source, exprs: list, params: Optional[dict] = None):
+        """Same as lf.with_columns(exprs), with the new columns loaded from the cache if possible.
+
+        The columns are joined back horizontally, so exprs must keep the height of lf: no filters or aggregations.
+        """
+        cached = self.columns(lf, source, exprs, params)
+        names = cached.collect_schema().names()
+        base = lf.lazy().drop(names, strict=False)
+        out = pl.concat([base, cached], how="horizontal")
+        return out if isinstance(lf, pl.LazyFrame) else out.collect()
+
+    def size(self) -> int:
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Deletes the least recently used entries until the cache fits in max_bytes.
+
+        :param keep: path of an entry that is never deleted, e.g. the one just written, even if it alone is
+                     larger than max_bytes.
+        """
+        entries = sorted(((entry.stat(), entry.path) for entry in self._entries()), key=lambda e: e[0].st_mtime_ns)
+        total = sum(stat.st_size for stat, _ in entries)
+        for stat, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except PermissionError:  # Still mapped by a frame, on platforms that lock mapped files.
+                continue
+            total -= stat.st_size
+
+    def clear(self) -> None:
+        for entry in self._entries():
+            os.remove(entry.path)
+
+    @staticmethod
+    def _read(path: str) -> pl.LazyFrame:
+        # Read now, so the frame no longer needs the file if the entry is evicted before it's collected.
+        return pl.read_ipc(path).lazy()
+
+    def _entries(self) -> list:
+        return [entry for entry in os.scandir(self.root) if entry.name.endswith(".arrow")]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.arrow")
+
+
+def fileFingerprint(path: str) -> list:
+    """Identifies the current contents of a file by its path, size and modification time."""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
@@ -1,10 +1,112 @@
+import os
+import itertools
 import numpy as np
-import scipy as sp
 import polars as pl
-import hyppo as hp
-import future
-import matplotlib.pyplot as plt
-from typing import Literal
+from typing import Literal, Optional
+from imports import LazyModule
+from frameCache import fileFingerprint
+from analytics import fromResearch, analyze
+
+# Statistics and plotting libraries are imported on first use, so importing research stays fast.
+sp = LazyModule("scipy")
+hp = LazyModule("hyppo")
+plt = LazyModule("matplotlib.pyplot", "matplotlib")
+
+
+def grouped(expr: pl.Expr, over: Optional[list] = None) -> pl.Expr:
+    """Evaluates expr separately per group of the over columns, if any."""
+    return expr.over(over) if over else expr
+
+
+def positionState(entry_col: str, exit_col: str, over: Optional[list] = None) -> pl.Expr:
+    """Vectorized entry/exit state machine. Returns an Int8 expression that is 1 while in a trade.
+
+    :param entry_col: column that is 1 on rows with an entry signal.
+    :param exit_col: column that is 1 on rows with an exit signal.
+    :param over: optional key columns to track the state separately per group.
+    """
+    entry = pl.col(entry_col).cast(pl.Int8).fill_null(0) == 1
+    exit_ = pl.col(exit_col).cast(pl.Int8).fill_null(0) == 1
+
+    # Rows with a single signal set the state, so it can be forward filled from them.
+    event = pl.when(entry & ~exit_).then(1).when(exit_ & ~entry).then(0)
+    # Rows with both signals flip the state, so count them and flip once per row since the last event.
+    toggles = (entry & exit_).cast(pl.Int32).cum_sum()
+    last_event = grouped(event.forward_fill(), over).fill_null(0)
+    toggles_at_last_event = grouped(pl.when(event.is_not_null()).then(toggles).forward_fill(), over).fill_null(0)
+    flips = grouped(toggles, over) - toggles_at_last_event
+    return ((last_event + flips) % 2).cast(pl.Int8)
+
+
+def returnsColumn(over: Optional[list] = None) -> pl.Expr:
+    """Return of holding from each row's close to the next, within each group of over, e.g. ["symbol"]."""
+    return grouped((pl.col("close").shift(-1) - pl.col("close")) / pl.col("close"), over).alias("returns")
+
+
+def symbolKeys(lf) -> Optional[list]:
+    """["symbol"] for data holding several symbols in a 'symbol' column, else None."""
+    schema = lf.collect_schema() if isinstance(lf, pl.LazyFrame) else lf.schema
+    return ["symbol"] if "symbol" in schema else None
+
+
+def withReturns(lf, cache=None):
+    """Sorts lf by symbol and timestamp if it holds several symbols, and adds returnsColumn() per symbol.
+
+    Rows of multi-symbol files are usually interleaved by timestamp, so the next close is taken from the same
+    symbol rather than from the next row.
+    :param cache: function (lf, exprs) adding exprs to lf, e.g. through ResearchStrat.cachedColumns.
+    """
+    over = symbolKeys(lf)
+    if over is not None:
+        lf = lf.sort(*over, "timestamp")
+    exprs = [returnsColumn(over)]
+    return lf.with_columns(exprs) if cache is None else cache(lf, exprs)
+
+
+def crossRank(col: str, descending: bool = False, by: str = "timestamp") -> pl.Expr:
+    """Cross-sectional rank of col among the symbols sharing each timestamp, starting at 1.
+
+    :param descending: rank the largest value first.
+    :param by: column holding the cross-sections.
+    """
+    return pl.col(col).rank("ordinal", descending=descending).over(by)
+
+
+def topN(col: str, n: int, descending: bool = True, by: str = "timestamp") -> pl.Expr:
+    """Boolean expression that is True for the n symbols with the largest col at each timestamp.
+
+    :param descending: pick the largest values. Set to False to pick the n smallest.
+    """
+    return crossRank(col, descending=descending, by=by) <= n
+
+
+def paramGrid(param_grid: dict) -> list:
+    """Expands {"a": [1, 2], "b": [3]} into [{"a": 1, "b": 3}, {"a": 2, "b": 3}]."""
+    names = list(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*param_grid.values())]
+
+
+def sweepMetrics(strategy_returns: pl.Expr, is_long: pl.Expr, is_short: pl.Expr) -> list:
+    """Aggregate expressions with the metrics of one parameter set of a sweep.
+
+    Only rows with a return are scored, so a last bar without a next close counts the same whether it was dropped
+    or not.
+    """
+    scored = strategy_returns.is_not_null()
+    returns, is_long, is_short = strategy_returns.filter(scored), is_long.filter(scored), is_short.filter(scored)
+    cum_returns = returns.cum_sum()
+    n_trades = pl.sum_horizontal(
+        [(position.diff() == 1).sum() + position.first() for position in (is_long, is_short)])
+    return [
+        returns.sum().alias("total_returns"),
+        returns.mean().alias("mean_returns"),
+        returns.std().alias("std_returns"),
+        (returns.mean() / returns.std()).alias("sharpe"),
+        (cum_returns - cum_returns.cum_max()).min().alias("max_drawdown"),
+        n_trades.cast(pl.Int64).alias("n_trades"),
+        (is_long + is_short).mean().alias("exposure"),
+    ]
+
 
 class Research():
     def __init__(self) -> None:
@@ -19,7 +121,62 @@ class Research():
             return pl.read_json(path)
         else:
             raise ValueError("param: type must be a valid file type. Please use csv, parquet, or json.")
-        
+
+    def scanFileTypes(self, path: str, type: Literal["csv", "parquet", "json", "ndjson"],
+                      columns: Optional[list] = None, start=None, end=None,
+                      symbols: Optional[list] = None) -> pl.LazyFrame:
+        """Lazily scans a file. Column, date range and symbol selections are pushed down into the scan,
+        so only what is selected gets read.
+
+        :param path: path to the file.
+        :param type: file type. json files can't be scanned and are read eagerly, use ndjson for large files.
+        :param columns: columns to keep. 'timestamp' and 'symbol' are kept when present.
+        :param start: first timestamp to keep, inclusive.
+        :param end: last timestamp to keep, inclusive.
+        :param symbols: symbols to keep, for files with a 'symbol' column.
+        """
+        if type == "csv":
+            lf = pl.scan_csv(path, try_parse_dates=True)
+        elif type == "parquet":
+            lf = pl.scan_parquet(path)
+        elif type == "ndjson":
+            lf = pl.scan_ndjson(path)
+        elif type == "json":
+            lf = pl.read_json(path).lazy()
+        else:
+            raise ValueError("param: type must be a valid file type. Please use csv, parquet, json or ndjson.")
+        return selectData(lf, columns=columns, start=start, end=end, symbols=symbols)
+
+
+def fileType(path: str) -> str:
+    """Returns the file type of path from its suffix, e.g. 'parquet' for 'data/QQQ.parquet'."""
+    file_type = os.path.splitext(path)[1].lstrip(".").lower()
+    if file_type not in ("csv", "parquet", "json", "ndjson"):
+        raise ValueError(
+            f"ERROR: file type: {file_type} in file path: {path} is invalid. "
+            "Only files with the suffixes .csv, .parquet, .json and .ndjson."
+        )
+    return file_type
+
+
+def selectData(lf: pl.LazyFrame, columns: Optional[list] = None, start=None, end=None,
+               symbols: Optional[list] = None) -> pl.LazyFrame:
+    """Applies a column, date range and symbol selection to a LazyFrame. See Research.scanFileTypes."""
+    schema = lf.collect_schema()
+    if start is not None:
+        lf = lf.filter(pl.col("timestamp") >= start)
+    if end is not None:
+        lf = lf.filter(pl.col("timestamp") <= end)
+    if symbols is not None:
+        if "symbol" not in schema:
+            raise ValueError("Can't select symbols from data without a 'symbol' column.")
+        lf = lf.filter(pl.col("symbol").is_in(symbols))
+    if columns is not None:
+        keys = [key for key in ("timestamp", "symbol") if key in schema and key not in columns]
+        lf = lf.select(*keys, *columns)
+    return lf
+
+
 class ResearchStrat():
     """A simple, vectorized backtesting framework to quickly write out, test and evaluate new ideas."""
 
@@ -28,6 +185,7 @@ class ResearchStrat():
 
     def __postinit__(self):
         self.dfs = {}
+        self.sources = {}  # Fingerprint of the data each symbol was loaded from. Used as the FrameCache source.
         self._LoadData()
     
     def __init_subclass__(cls, **kwargs):
@@ -42,111 +200,176 @@ class ResearchStrat():
         # Replace the subclass's __init__ with the wrapped version
         cls.__init__ = wrapped_init
 
+    @classmethod
+    def fromFrames(cls, frames: dict, **attrs):
+        """Builds the strategy on in-memory frames instead of self.files, without calling the subclass's __init__.
+
+        Used by WalkForward to run a strategy on windows of a shared dataset.
+        :param frames: dict of symbol to DataFrame or LazyFrame. A list of frames is taken as segments with gaps
+                       between them, and returns are computed within each segment, so none spans a gap.
+        :param attrs: attributes the subclass's __init__ would set, e.g. universe_mode=True or lazy=False.
+        """
+        self = cls.__new__(cls)
+        for name, value in attrs.items():
+            setattr(self, name, value)
+        self.dfs = {}
+        self.sources = {}
+        for symbol, df in frames.items():
+            segments = df if isinstance(df, list) else [df]
+            self.dfs[symbol] = pl.concat([withReturns(segment.lazy()) for segment in segments])
+        self.universe = list(frames)
+        self._finishLoad()
+        return self
+
     def _LoadData(self):
+        """Loads self.files into self.dfs.
+
+        Files are scanned lazily. Optional attributes set in __init__ narrow what is read, and are pushed down
+        into the scan: self.columns (list of columns, 'close' is always kept), self.start and self.end (date
+        range) and self.symbols (for files holding several symbols). The frames stay lazy through initColumns()
+        and setSignals() until runBacktest() collects them, unless self.lazy is set to False.
+
+        Instead of self.files, a BarStore can be set as self.store, along with self.timeframe and optionally
+        self.store_symbols (defaults to every symbol in the store). Its memory-mapped parts are scanned in place.
+
+        If a FrameCache is set as self.cache, the returns column, and any columns added through cachedColumns(),
+        are loaded from the cache while the source data is unchanged.
+
+        If self.universe_mode is set to True, every symbol is stacked into one long frame, self.df, with a
+        'symbol' column, instead of self.dfs. initColumns() and setSignals() then write per symbol expressions
+        with .over("symbol"), and cross-sectional ones with crossRank() and topN(), so each step is a single
+        query plan that Polars parallelizes across symbols.
+        """
+        if hasattr(self, "store"):
+            self._LoadStore()
+            return
         # Check if 'self.files' is defined and is a dictionary.
         if not hasattr(self, "files") or not isinstance(self.files, dict):
             raise TypeError(
                 "Attribute 'self.files' must be a dictionary filled with the symbols and file paths.")
+        columns = getattr(self, "columns", None)
+        if columns is not None and "close" not in columns:
+            columns = [*columns, "close"]
+        selection = {"columns": columns, "start": getattr(self, "start", None), "end": getattr(self, "end", None),
+                     "symbols": getattr(self, "symbols", None)}
         for symbol, path in self.files.items():
-            path_list = list(path)
-            # Parses the path str to obtain the file type at the end of the file name.abs
-            try:
-                file_type = ''.join(path_list[len(path_list) - 1 - path_list[::-1].index('.') + 1:])
-            except Exception:
-                raise ValueError(
-                    f"ERROR: file type: {file_type} in file path: {path} is invalid. "
-                    "Only files with the suffixes .csv, .parquet, and .json."
-                )
-
+            file_type = fileType(path)
             try:
-                df = Research().loadFileTypes(path=path, type=file_type)  # Attempt to load the dataframe
-                df = df.with_columns(((pl.col("close").shift(-1) - pl.col("close")) / pl.col("close")).alias("returns"))
-                self.dfs[symbol] = df
+                lf = Research().scanFileTypes(path=path, type=file_type, **selection)
+                self.sources[symbol] = {"file": fileFingerprint(path), **selection}
+                self.dfs[symbol] = withReturns(lf, lambda lf, exprs: self.cachedColumns(symbol, lf, exprs))
             except Exception as e:
-                raise ValueError(f"Error loading parquet file for symbol '{symbol}' at path '{path}': {e}")
-        
+                raise ValueError(f"Error loading {file_type} file for symbol '{symbol}' at path '{path}': {e}")
+
         # Initialize the universe attr as a list of asset symbols.
         self.universe = list(self.files.keys())
+        self._finishLoad()
             
-    def trackIsInTrade(self, df: pl.DataFrame) -> pl.DataFrame:
+    def _LoadStore(self):
+        symbols = getattr(self, "store_symbols", None) or self.store.symbols()
+        columns = getattr(self, "columns", None)
+        if columns is not None:
+            columns = ["timestamp", *sorted({*columns, "close"} - {"timestamp"})]
+        start, end = getattr(self, "start", None), getattr(self, "end", None)
+        for symbol in symbols:
+            lf = self.store.scan(symbol, self.timeframe, start=start, end=end)
+            if columns is not None:
+                lf = lf.select(columns)
+            self.sources[symbol] = {"store": os.path.abspath(self.store.root), "symbol": symbol,
+                                    "timeframe": self.timeframe, "coverage": self.store.coverage(symbol, self.timeframe),
+                                    "columns": columns, "start": start, "end": end}
+            self.dfs[symbol] = withReturns(lf, lambda lf, exprs: self.cachedColumns(symbol, lf, exprs))
+        self.universe = list(symbols)
+        self._finishLoad()
+
+    def _finishLoad(self):
+        lazy = getattr(self, "lazy", True)
+        if getattr(self, "universe_mode", False):
+            frames = []
+            for symbol, lf in self.dfs.items():
+                if "symbol" not in lf.collect_schema():  # Files holding several symbols keep their own column.
+                    lf = lf.with_columns(pl.lit(symbol, pl.String).alias("symbol"))
+                frames.append(lf)
+            self.df = pl.concat(frames, how="diagonal_relaxed").select("symbol", pl.exclude("symbol"))
+            self.dfs = {}
+            if not lazy:
+                self.df = self.df.collect()
+        elif not lazy:
+            self.dfs = dict(zip(self.dfs, pl.collect_all(list(self.dfs.values()))))
+
+    def cachedColumns(self, symbol: str, df, exprs: list, params: Optional[dict] = None):
+        """Same as df.with_columns(exprs), but loads the columns from self.cache when a FrameCache is set.
+
+        Use it in initColumns() for columns that are expensive to compute, such as rolling indicators. The cache
+        key covers the symbol's source data, the expressions and params, so pass in params anything else the
+        columns depend on. exprs must keep the height of df: drop rows after adding the columns.
+        :param symbol: symbol of df, whose source fingerprint is used in the key. None for the universe mode frame.
+        """
+        if getattr(self, "cache", None) is None:
+            return df.with_columns(exprs)
+        source = self.sources if symbol is None else self.sources[symbol]
+        return self.cache.withColumns(df, source, exprs, params)
+
+    def trackIsInTrade(self, df: pl.DataFrame, over: Optional[list] = None) -> pl.DataFrame:
         """
         Track whether the strategy is currently in a trade (long or short).
 
+        Entries only open a position when flat and exits only close it when in a trade, so the state depends on
+        the previous row. It is computed without a Python loop: rows with only an entry or only an exit set the
+        state outright and are forward filled, and rows with both flip whatever state came before them.
+
         :param df: Polars DataFrame with required columns:
                 ['long_entry', 'long_exit', 'short_entry', 'short_exit'].
+        :param over: optional key columns. State is tracked separately for each group, e.g. ["symbol"].
         :return: DataFrame with 'is_long' and 'is_short' columns indicating active trades.
         """
         required_columns = {"long_entry", "long_exit", "short_entry", "short_exit"}
-        if missing := required_columns - set(df.columns):
+        columns = df.collect_schema().names() if isinstance(df, pl.LazyFrame) else df.columns
+        if missing := required_columns - set(columns):
             raise ValueError(f"Missing columns: {missing}")
 
-        for direction in ["long", "short"]:
-            entry_col = f"{direction}_entry"
-            exit_col = f"{direction}_exit"
-            position_col = f"is_{direction}"
-
-            # Initialize state column
-            df = df.with_columns(pl.lit(0).alias("_state"))
-
-            # Use a custom function to handle state transitions
-            def state_transition(entry, exit, state):
-                if entry == 1 and state == 0:  # Enter trade
-                    return 1
-                elif exit == 1 and state == 1:  # Exit trade
-                    return 0
-                else:  # Maintain current state
-                    return state
-
-            # Apply the state transition function using `map_elements`
-            df = df.with_columns(
-                pl.struct([entry_col, exit_col, "_state"])
-                .map_elements(
-                    lambda s: state_transition(s[entry_col], s[exit_col], s["_state"]),
-                    return_dtype=pl.Int8,
-                )
-                .alias("_state_new")
-            )
-
-            # Update the state column
-            df = df.with_columns(pl.col("_state_new").alias("_state"))
-
-            # Rename the state column to the final position column
-            df = df.with_columns(pl.col("_state").alias(position_col))
+        return df.with_columns(
+            positionState("long_entry", "long_exit", over).alias("is_long"),
+            positionState("short_entry", "short_exit", over).alias("is_short"),
+        )
 
-            # Drop intermediate columns
-            df = df.drop(["_state", "_state_new"])
+    def calcReturns(self, df, over: Optional[list] = None) -> pl.DataFrame:
+        """Adds the strategy's returns. Cumulative columns are computed per group of over, e.g. ["symbol"].
 
-        return df
-    
-    def calcReturns(self, df) -> pl.DataFrame:
+        Short trades earn the negated returns, so strategy_returns is returns * (is_long - is_short), as in sweep()
+        and analytics.fromResearch().
+        """
         df = df.with_columns(((pl.col("returns") * pl.col("is_long")).alias("long_returns")),
-                                ((pl.col("returns") * pl.col("is_short")).alias("short_returns")))
+                                ((-pl.col("returns") * pl.col("is_short")).alias("short_returns")))
         df = df.with_columns(
             (pl.col("long_returns") + pl.col("short_returns")).alias("strategy_returns")
         )
-        df = df.with_columns((pl.col("long_returns") * self.starting_cash).alias("cash_returns"))
-        df = df.with_columns(pl.col("cash_returns").cum_sum().alias("total_cash_returns"))
+        df = df.with_columns((pl.col("strategy_returns") * self.starting_cash).alias("cash_returns"))
+        df = df.with_columns(grouped(pl.col("cash_returns").cum_sum(), over).alias("total_cash_returns"))
         df = df.with_columns(
-            pl.col("strategy_returns").cum_sum().alias("cum_returns")
+            grouped(pl.col("strategy_returns").cum_sum(), over).alias("cum_returns")
         )
-        df = df.with_columns(pl.col("returns").cum_sum().alias("buy_and_hold"))
+        df = df.with_columns(grouped(pl.col("returns").cum_sum(), over).alias("buy_and_hold"))
         return df
 
-    def calcTradeStats(self, df) -> pl.DataFrame:
+    def calcTradeStats(self, df, over: Optional[list] = None) -> pl.DataFrame:
+        """Marks new entries and exits. Shifts look back within each group of over, e.g. ["symbol"]."""
         for direction in ("long", "short"):
+            was_in_trade = grouped(pl.col(f"is_{direction}").shift(), over)
             df = df.with_columns(
                 [
                     pl.when(pl.col(f"is_{direction}") == 1)
-                    .then(pl.col("returns") + pl.col(f"{direction}_returns").shift(1, fill_value=0))
+                    .then(pl.col(f"{direction}_returns")
+                          + grouped(pl.col(f"{direction}_returns").shift(1, fill_value=0), over))
                     .otherwise(0)
-                    .alias("cur_trade_teturns"),
+                    .alias("cur_trade_returns"),
                     
 
-                    pl.when((pl.col(f"is_{direction}").shift() == 0) & (pl.col(f"is_{direction}") == 1))
+                    pl.when((was_in_trade == 0) & (pl.col(f"is_{direction}") == 1))
                     .then(1)
                     .otherwise(0)
                     .alias(f"new_{direction}_entry"),
-                    pl.when((pl.col(f"is_{direction}").shift() == 1) & (pl.col(f"is_{direction}") == 0))
+                    pl.when((was_in_trade == 1) & (pl.col(f"is_{direction}") == 0))
                     .then(1)
                     .otherwise(0)
                     .alias(f"new_{direction}_exit"),
@@ -166,13 +389,135 @@ class ResearchStrat():
         return df
             
     def runBacktest(self):
-        for symbol, df in list(self.dfs.items()):
-            df = self.trackIsInTrade(df)
-            df = self.calcReturns(df)
-            df = self.calcTradeStats(df)
+        if getattr(self, "universe_mode", False):
+            over = ["symbol"]
+            df = self.calcTradeStats(self.calcReturns(self.trackIsInTrade(self.df.lazy(), over), over), over)
+            self.df = df.collect()
+            return
+        symbols = list(self.dfs)
+        lazy = []
+        for symbol in symbols:
+            df = self.dfs[symbol].lazy()
+            over = symbolKeys(df)  # Files holding several symbols are tracked per symbol.
+            lazy.append(self.calcTradeStats(self.calcReturns(self.trackIsInTrade(df, over), over), over))
+        # Collect every symbol in one call, so the query plans run in parallel.
+        for symbol, df in zip(symbols, pl.collect_all(lazy)):
             del self.dfs[symbol]  # Delete the old dictionary.
             self.dfs[symbol] = df  # Replace it.
 
+    def stats(self, periods_per_year: float = 252) -> tuple:
+        """Trade table and performance metrics per symbol of a finished backtest. See analytics.analyze().
+
+        :param periods_per_year: bars per year, used to annualize sharpe, sortino and turnover.
+        :return: (trades, metrics) DataFrames.
+        """
+        return analyze(fromResearch(self._stacked()), over=["symbol"], periods_per_year=periods_per_year)
+
+    def _stacked(self) -> pl.LazyFrame:
+        """Every symbol as one long frame with a 'symbol' column. Files holding several symbols keep their own."""
+        if getattr(self, "universe_mode", False):
+            return self.df.lazy()
+        return pl.concat([df.lazy() if symbolKeys(df) else df.lazy().with_columns(pl.lit(symbol).alias("symbol"))
+                          for symbol, df in self.dfs.items()], how="diagonal_relaxed")
+
+    def symbolStats(self) -> pl.DataFrame:
+        """Per symbol metrics of a finished backtest, in the same format as sweep(). Runs as one group_by."""
+        df = self._stacked()
+        metrics = sweepMetrics(pl.col("strategy_returns"), pl.col("is_long"), pl.col("is_short"))
+        return df.group_by("symbol", maintain_order=True).agg(metrics).collect()
+
+    def sweepColumns(self, param_grid: dict) -> list:
+        """Columns shared by every point of a sweep, computed once per symbol. Override in child class.
+
+        :param param_grid: the grid passed to sweep().
+        :return: list of polars expressions, e.g. one rolling mean per window used anywhere in the grid.
+        """
+        return []
+
+    def sweepSignals(self, **params) -> Optional[list]:
+        """Signal expressions for one point of a sweep. Must be overriden in child class to use sweep().
+
+        :param params: one combination of the grid passed to sweep().
+        :return: expressions producing 'long_entry', 'long_exit', 'short_entry' and 'short_exit',
+                 or None to skip this combination.
+        """
+        raise NotImplementedError("sweepSignals() must be overriden in child class to use sweep()")
+
+    def sweep(self, param_grid: dict, batch_size: int = 100) -> pl.DataFrame:
+        """Evaluates every combination of param_grid on every symbol as a batch.
+
+        Each symbol's data and sweepColumns() are computed once. The signals of up to batch_size parameter sets
+        are then laid out side by side in one wide frame, and positions and metrics for all of them are
+        computed in a single query, which Polars parallelizes across columns.
+
+        Rows where a sweepColumns() output is null, such as the warm-up of a rolling mean, are not scored, like
+        the rows a single run drops with drop_nulls() in initColumns().
+
+        :param param_grid: dict of parameter name to a list of values, e.g. {"fast": [5, 7], "slow": [21, 50]}.
+        :param batch_size: parameter sets per query. Bounds peak memory to about batch_size copies of the
+                           signal columns.
+        :return: one row per symbol and parameter set, with the parameters and their metrics.
+        """
+        points = []
+        signals = []
+        for params in paramGrid(param_grid):
+            exprs = self.sweepSignals(**params)
+            if exprs is not None:
+                points.append(params)
+                signals.append(exprs)
+        if not points:
+            raise ValueError("param_grid produced no parameter sets to evaluate.")
+
+        columns = self.sweepColumns(param_grid)
+        names = [expr.meta.output_name() for expr in columns]
+        rows = []
+        for symbol, df in self._symbolFrames().items():
+            base = df.lazy().with_columns(columns).drop_nulls(names).collect()
+            for start in range(0, len(signals), batch_size):
+                batch = range(start, min(start + batch_size, len(signals)))
+                wide = base.lazy().select(
+                    pl.col("returns"), *[expr.name.suffix(f"_{i}") for i in batch for expr in signals[i]])
+                wide = wide.with_columns(
+                    *[positionState(f"long_entry_{i}", f"long_exit_{i}").alias(f"is_long_{i}") for i in batch],
+                    *[positionState(f"short_entry_{i}", f"short_exit_{i}").alias(f"is_short_{i}") for i in batch],
+                )
+                metrics = []
+                for i in batch:
+                    is_long, is_short = pl.col(f"is_long_{i}"), pl.col(f"is_short_{i}")
+                    strategy_returns = pl.col("returns") * (is_long - is_short)
+                    metrics.extend(m.name.suffix(f"_{i}") for m in sweepMetrics(strategy_returns, is_long, is_short))
+                values = wide.select(metrics).collect().row(0, named=True)
+                for i in batch:
+                    suffix = f"_{i}"
+                    rows.append({"symbol": symbol, **points[i],
+                                 **{k[:-len(suffix)]: v for k, v in values.items() if k.endswith(suffix)}})
+        return pl.DataFrame(rows)
+
+    def evaluate(self, params: dict) -> pl.LazyFrame:
+        """Bar level results of one parameter set of a sweep, for every symbol.
+
+        :param params: one combination of a sweep grid, passed to sweepColumns() as a grid of single values.
+        :return: long frame with symbol, timestamp, returns, is_long, is_short, position and strategy_returns,
+                 ready for analytics.analyze().
+        """
+        signals = self.sweepSignals(**params)
+        if signals is None:
+            raise ValueError(f"sweepSignals() skips the parameter set {params}.")
+        columns = self.sweepColumns({name: [value] for name, value in params.items()})
+        frames = []
+        for symbol, df in self._symbolFrames().items():
+            lf = self.trackIsInTrade(df.lazy().with_columns(columns).with_columns(signals))
+            frames.append(lf.select(pl.lit(symbol, pl.String).alias("symbol"), "timestamp", "returns", "is_long",
+                                    "is_short"))
+        return fromResearch(pl.concat(frames))
+
+    def _symbolFrames(self) -> dict:
+        """Each symbol's frame, split out of self.df in universe mode."""
+        if not getattr(self, "universe_mode", False):
+            return self.dfs
+        frames = self.df.lazy().collect().partition_by("symbol", as_dict=True, include_key=False)
+        return {key[0]: df for key, df in frames.items()}
+
 
 
 class TestStrat(ResearchStrat):
@@ -181,8 +526,8 @@ class TestStrat(ResearchStrat):
 
     def initColumns(self):
         for symbol, df in list(self.dfs.items()):
-            df = df.with_columns(((pl.col("close")).rolling_mean(21)).alias("sma21"))  # SMA 21
-            df = df.with_columns(((pl.col("close")).rolling_mean(7)).alias("sma7"))  # SMA 7
+            df = self.cachedColumns(symbol, df, [pl.col("close").rolling_mean(21).alias("sma21"),  # SMA 21
+                                                 pl.col("close").rolling_mean(7).alias("sma7")])  # SMA 7
             df = df.drop_nulls()
             del self.dfs[symbol]  # Delete the old dictionary.
             self.dfs[symbol] = df  # Replace it.
@@ -199,31 +544,66 @@ class TestStrat(ResearchStrat):
             df = df.with_columns((pl.lit(0)).alias("short_exit"))
             del self.dfs[symbol]
             self.dfs[symbol] = df
-    
 
+    def sweepColumns(self, param_grid):
+        windows = set(param_grid["fast"]) | set(param_grid["slow"])
+        return [pl.col("close").rolling_mean(w).alias(f"sma{w}") for w in sorted(windows)]
+
+    def sweepSignals(self, fast, slow):
+        if fast >= slow:
+            return None
+        return [
+            (pl.col(f"sma{slow}") < pl.col(f"sma{fast}")).cast(pl.Int8).alias("long_entry"),
+            (pl.col(f"sma{slow}") > pl.col(f"sma{fast}")).cast(pl.Int8).alias("long_exit"),
+            pl.lit(0, pl.Int8).alias("short_entry"),
+            pl.lit(0, pl.Int8).alias("short_exit"),
+        ]
+
+
+class TestUniverseStrat(ResearchStrat):
+    """Holds the 10 symbols with the strongest 20 bar momentum, as one long frame query."""
+    def __init__(self, files: dict):
+        self.files = files
+        self.universe_mode = True
+
+    def initColumns(self):
+        self.df = self.df.with_columns(
+            (pl.col("close") / pl.col("close").shift(20) - 1).over("symbol").alias("momentum"))
+
+    def setSignals(self):
+        selected = topN("momentum", 10)
+        self.df = self.df.with_columns(
+            selected.cast(pl.Int8).alias("long_entry"),
+            (~selected).cast(pl.Int8).alias("long_exit"),
+            pl.lit(0, pl.Int8).alias("short_entry"),
+            pl.lit(0, pl.Int8).alias("short_exit"),
+        )
 
 
-test = TestStrat()
-test.starting_cash = 100_000
-test.initColumns()
-test.setSignals()
-test.runBacktest()
-pl.Config.set_tbl_cols(15)
-pl.Config.set_tbl_rows(30)
-df = test.dfs["QQQ"]
-print(df.columns)
-print(df.select(["new_long_entry", "new_long_exit"]))
-total_returns = sum(df["strategy_returns"].to_numpy())
-#print(total_returns)
-"""
-plt.figure(figsize=(10, 6))
-plt.plot(df["total_cash_returns"])
-#plt.plot(df["cum_returns"])
-#plt.plot(df["buy_and_hold"]
-plt.title("returns over time")
-plt.xlabel("time")
-plt.ylabel("returns")
-plt.grid(True)
-plt.show()
-"""
+if __name__ == "__main__":
+    test = TestStrat()
+    test.starting_cash = 100_000
+    test.initColumns()
+    test.setSignals()
+    test.runBacktest()
+    pl.Config.set_tbl_cols(15)
+    pl.Config.set_tbl_rows(30)
+    df = test.dfs["QQQ"]
+    print(df.columns)
+    print(df.select(["new_long_entry", "new_long_exit"]))
+    trades, metrics = test.stats()
+    print(metrics)
+    sweep = test.sweep({"fast": [3, 5, 7, 10], "slow": [14, 21, 30, 50]})
+    print(sweep.sort("sharpe", descending=True))
+    """
+    plt.figure(figsize=(10, 6))
+    plt.plot(df["total_cash_returns"])
+    #plt.plot(df["cum_returns"])
+    #plt.plot(df["buy_and_hold"]
+    plt.title("returns over time")
+    plt.xlabel("time")
+    plt.ylabel("returns")
+    plt.grid(True)
+    plt.show()
+    """
 
@@ -0,0 +1,232 @@
+import os
+import math
+import multiprocessing
+import numpy as np
+import polars as pl
+from dataclasses import dataclass
+from typing import Callable, Optional, Union
+from concurrent.futures import ProcessPoolExecutor
+from parallel import SharedFrames, windowFrames, workerFrames, _attachWorker
+from research import paramGrid, sweepMetrics
+from BT_engine import RESULT_KEYS
+from analytics import barMetrics
+
+
+@dataclass(slots=True)
+class Split:
+    """One walk-forward window, as half-open (start, stop) row ranges of the time index."""
+    train: list  # One range, or several when test bars are cut out of the middle, as in purgedKFold().
+    test: tuple
+
+
+def anchoredSplits(n: int, n_splits: int, test_size: Optional[int] = None) -> list:
+    """Expanding windows: every train window starts at the first bar and ends where its test window starts.
+
+    :param n: bars in the time index, e.g. WalkForward.n_bars.
+    :param n_splits: number of consecutive test windows, the last one ending at the last bar.
+    :param test_size: bars per test window. Defaults to n // (n_splits + 1), so the first train window is as long
+                      as a test window.
+    """
+    test_size = test_size or n // (n_splits + 1)
+    first = n - n_splits * test_size
+    if test_size < 1 or first < 1:
+        raise ValueError(f"{n} bars can't hold {n_splits} test windows of {test_size} bars and a train window.")
+    return [Split([(0, start)], (start, start + test_size)) for start in range(first, n, test_size)]
+
+
+def rollingSplits(n: int, train_size: int, test_size: int, step: Optional[int] = None) -> list:
+    """Fixed length train windows, each followed by its test window, moved forward by step bars.
+
+    :param n: bars in the time index.
+    :param step: bars between the starts of consecutive windows. Defaults to test_size, so test windows tile.
+    """
+    step = step or test_size
+    if min(train_size, test_size, step) < 1:
+        raise ValueError("train_size, test_size and step must be positive.")
+    return [Split([(start - train_size, start)], (start, start + test_size))
+            for start in range(train_size, n - test_size + 1, step)]
+
+
+def purgedKFold(n: int, n_splits: int, purge: int = 0, embargo: int = 0) -> list:
+    """K contiguous test folds, each trained on every other bar, minus the bars around the fold that leak into it.
+
+    Bars before a fold are purged when their outcome overlaps the fold, e.g. a signal scored on the next purge
+    bars of returns. Bars after a fold are embargoed, as they are correlated with the end of the fold.
+    :param n: bars in the time index.
+    :param purge: bars dropped from training before each test fold.
+    :param embargo: bars dropped from training after each test fold.
+    """
+    if n_splits < 2 or n_splits > n:
+        raise ValueError(f"n_splits must be between 2 and the number of bars, got {n_splits}.")
+    bounds = np.linspace(0, n, n_splits + 1).astype(int)
+    splits = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        train = [(0, max(start - purge, 0)), (min(stop + embargo, n), n)]
+        splits.append(Split([(int(a), int(b)) for a, b in train if b > a], (int(start), int(stop))))
+    return splits
+
+
+class WalkForward():
+    """Walk-forward optimization and cross-validation of a strategy over shared data.
+
+    For every split, the parameter grid is searched on the train window and the best parameter set is run on the
+    test window that follows it. Windows run in parallel on a process pool. The frames are published once into
+    shared memory, and every worker slices its windows out of them without copying.
+
+    The strategy can be a ResearchStrat subclass, searched with sweep() and run with evaluate(), or a BTest
+    subclass taking its frames as a `data` keyword, as for ParallelRunner, which runs once per parameter set.
+    Either must be importable by the workers, and scripts need an `if __name__ == "__main__":` guard.
+
+        wf = WalkForward(MyStrat, frames, {"fast": [5, 7], "slow": [21, 50]}, warmup=50)
+        table = wf.run(anchoredSplits(wf.n_bars, 5))
+    """
+
+    def __init__(self, strategy_cls, frames: dict, param_grid: dict, objective: Union[str, Callable] = "sharpe",
+                 warmup: int = 0, periods_per_year: float = 252, processes: Optional[int] = None, **attrs):
+        """:param strategy_cls: ResearchStrat or BTest subclass.
+        :param frames: dict of symbol to pl.DataFrame, each sorted by timestamp.
+        :param param_grid: dict of parameter name to a list of values, e.g. {"fast": [5, 7], "slow": [21, 50]}.
+        :param objective: metric to maximize on the train window: a column of sweep(), averaged over symbols, or a
+                          key of BTest.results(). Or a function of that row or dict returning a number.
+        :param warmup: bars before each test window that are run but not scored, so indicators are warmed up.
+        :param periods_per_year: bars per year, used to annualize the test window metrics.
+        :param processes: number of worker processes. Defaults to the number of cores.
+        :param attrs: attributes set on ResearchStrat instances, see ResearchStrat.fromFrames().
+        """
+        self.strategy_cls = strategy_cls
+        self.frames = frames
+        self.param_grid = param_grid
+        self.objective = objective
+        self.warmup = warmup
+        self.periods_per_year = periods_per_year
+        self.processes = processes or os.cpu_count()
+        self.attrs = attrs
+        self.research = hasattr(strategy_cls, "sweep")
+        if not callable(objective) and objective not in (choices := objectives(self.research)):
+            raise ValueError(f"Unknown objective {objective}. Use one of {choices}, or a function.")
+        # Every timestamp of any frame. Splits are row ranges of it, so windows cover the same time in each frame.
+        self.index = pl.concat([df["timestamp"] for df in frames.values()]).unique().sort()
+        self.n_bars = len(self.index)
+
+    def run(self, splits: list) -> pl.DataFrame:
+        """Runs every split and gathers them into one table.
+
+        :param splits: list of Split, e.g. from anchoredSplits(), rollingSplits() or purgedKFold().
+        :return: one row per split with its time bounds (ends are exclusive, and null at the end of the data), the
+                 chosen parameters, the train objective, the test metrics (see analytics.barMetrics()) and 'curve':
+                 the split's slice of the stitched out-of-sample curve. The portfolio return of a bar is the mean
+                 over symbols, and cum_returns are summed across every split. See stitchedCurve().
+        """
+        windows = [self._window(split) for split in splits]
+        worker = _researchWindow if self.research else _btestWindow
+        settings = (self.strategy_cls, self.param_grid, self.objective, self.attrs)
+        with SharedFrames(self.frames) as shared:
+            # Spawn rather than fork: forking a process that has started Polars' thread pool can deadlock.
+            with ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_attachWorker, initargs=(shared.spec,)) as pool:
+                results = list(pool.map(worker, [settings] * len(windows), windows))
+
+        rows = []
+        offset = 0.0
+        for window, (params, score, curve) in zip(windows, results):
+            metrics = curve.select(barMetrics("returns", "exposure", self.periods_per_year)).row(0, named=True)
+            curve = curve.with_columns((pl.col("returns").fill_null(0).cum_sum() + offset).alias("cum_returns"))
+            if not curve.is_empty():
+                offset = curve["cum_returns"][-1]
+            rows.append({"split": len(rows), "train_start": window["train"][0][0], "train_end": window["train"][-1][1],
+                         "test_start": window["test"][0], "test_end": window["test"][1], "params": params,
+                         "train_objective": score, **metrics, "curve": curve.to_dicts()})
+        return pl.DataFrame(rows).unnest("params")
+
+    def _window(self, split: Split) -> dict:
+        """Converts a Split's row ranges to (start, end) timestamps for windowFrames(). end is exclusive."""
+        index, n = self.index, self.n_bars
+        bound = lambda row: index[row] if row < n else None
+        test_start, test_stop = split.test
+        return {"train": [(bound(start), bound(stop)) for start, stop in split.train],
+                "test": (bound(test_start), bound(test_stop)),
+                "warmup_start": bound(max(test_start - self.warmup, 0))}
+
+
+def stitchedCurve(table: pl.DataFrame) -> pl.DataFrame:
+    """The out-of-sample curve of every split of a WalkForward.run() table, as rows of split, timestamp, returns,
+    exposure and cum_returns."""
+    return table.explode("curve").select("split", pl.col("curve").struct.unnest())
+
+
+def objectives(research: bool) -> list:
+    """Metrics a WalkForward objective can name: the columns of sweep() for a ResearchStrat, or the keys of
+    BTest.results() for a BTest.
+    """
+    if research:
+        return [expr.meta.output_name() for expr in sweepMetrics(pl.col("returns"), pl.col("long"), pl.col("short"))]
+    return list(RESULT_KEYS)
+
+
+def _score(objective, metrics: dict) -> float:
+    score = objective(metrics) if callable(objective) else metrics[objective]
+    return None if score is None or math.isnan(score) else score
+
+
+def _best(points: list, scores: list) -> tuple:
+    """Parameter set with the highest score. Falls back to the first one if none could be scored."""
+    scored = [(score, i) for i, score in enumerate(scores) if score is not None]
+    if not scored:
+        return points[0], None
+    score, i = max(scored, key=lambda item: (item[0], -item[1]))
+    return points[i], score
+
+
+def _researchWindow(settings: tuple, window: dict) -> tuple:
+    strategy_cls, param_grid, objective, attrs = settings
+    frames = workerFrames()
+    segments = [windowFrames(frames, start, end) for start, end in window["train"]]
+    train = strategy_cls.fromFrames({symbol: [segment[symbol] for segment in segments] for symbol in frames},
+                                    **attrs)
+    names = list(param_grid)
+    sweep = train.sweep(param_grid)
+    averaged = sweep.group_by(names, maintain_order=True).agg(pl.exclude("symbol", *names).mean())
+    rows = averaged.to_dicts()
+    params, score = _best([{name: row[name] for name in names} for row in rows],
+                          [_score(objective, row) for row in rows])
+
+    test_start, test_end = window["test"]
+    test = strategy_cls.fromFrames(windowFrames(frames, window["warmup_start"], test_end), **attrs)
+    curve = (
+        test.evaluate(params)
+        .filter(pl.col("timestamp") >= test_start)
+        .group_by("timestamp")
+        .agg(pl.col("strategy_returns").mean().alias("returns"), pl.col("position").abs().mean().alias("exposure"))
+        .sort("timestamp")
+        .collect()
+    )
+    return params, score, curve
+
+
+def _btestWindow(settings: tuple, window: dict) -> tuple:
+    strategy_cls, param_grid, objective, attrs = settings
+    frames = workerFrames()
+    points = paramGrid(param_grid)
+    scores = []
+    for params in points:
+        # Each train segment is run on its own, so no position is carried across a gap. Their scores are averaged.
+        segment_scores = []
+        for start, end in window["train"]:
+            bt = strategy_cls(data=windowFrames(frames, start, end), **params)
+            bt.run()
+            segment_scores.append(_score(objective, bt.results()))
+        valid = [score for score in segment_scores if score is not None]
+        scores.append(sum(valid) / len(valid) if valid else None)
+    params, score = _best(points, scores)
+
+    test_start, test_end = window["test"]
+    bt = strategy_cls(data=windowFrames(frames, window["warmup_start"], test_end), **params)
+    bt.run()
+    curve = (
+        bt.equity_curve
+        .with_columns(pl.col("equity").pct_change().alias("returns"),
+                      (pl.col("market_value") != 0).cast(pl.Float64).alias("exposure"))
+        .filter(pl.col("time") >= test_start)
+        .select(pl.col("time").alias("timestamp"), "returns", "exposure")
+    )
+    return params, score, curve
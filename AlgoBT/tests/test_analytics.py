@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import polars as pl
+
+from analytics import ledgerTrades
+from BT_engine import BTest
+from BT_utils import onrow
+
+
+def bars(n: int = 400, seed: int = 0) -> pl.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 0.3, n))
+    return pl.DataFrame({"timestamp": [datetime(2024, 1, 1) + timedelta(minutes=i) for i in range(n)],
+                         "open": close, "high": close + rng.random(n), "low": close - rng.random(n),
+                         "close": close, "volume": rng.integers(100, 1000, n).astype(float)})
+
+
+def test_resting_order_filled_after_a_later_market_order():
+    t1, t2 = datetime(2024, 1, 1, 9, 31), datetime(2024, 1, 1, 9, 32)
+    fills = pl.DataFrame({"oid": [2, 1], "time": [t1, t2], "equity": ["SPY", "SPY"], "side": ["BUY", "SELL"],
+                          "qty": [1.0, 1.0], "price": [100.0, 101.0], "commission": [0.0, 0.0]})
+    trades = ledgerTrades(fills)
+    assert trades.height == 1
+    trade = trades.row(0, named=True)
+    assert trade["direction"] == 1
+    assert (trade["entry_time"], trade["exit_time"]) == (t1, t2)
+    assert trade["duration"] == timedelta(minutes=1)
+    assert trade["pnl"] == 1.0
+
+
+class RestingStrat(BTest):
+    """Places limit and stop orders that rest for a few bars, between market orders."""
+    def __init__(self, df):
+        self.cash = 100_000
+        self.commision_per = 0.0005
+        self.spy = self.initEquity("SPY", df, timeframe="1m", name="SPY")
+        self.n = 0
+
+    def onRow(self, *args):
+        pass
+
+    @onrow(timeframe="1m")
+    def onMinute(self, d):
+        open_orders = self.orderBook.open_orders
+        if len(open_orders) == 1:  # One exit filled, cancel the other.
+            self.cancelOrder(next(iter(open_orders)))
+        self.n += 1
+        if self.n % 20 == 1 and self.ledger.positions[self.spy.eq_id] == 0:
+            # The exits are placed first, so they have lower oids than the entry they fill after.
+            self.limitOrder(d.SPY, 1, "SELL", d.SPY.close[0] + 1.5)
+            self.stopOrder(d.SPY, 1, "SELL", d.SPY.close[0] - 1.5)
+            self.marketOrder(d.SPY, 1, "BUY")
+
+
+def test_ledger_trades_of_a_run_with_resting_orders():
+    bt = RestingStrat(bars())
+    bt.run()
+    fills = bt.fills
+    assert (fills["oid"].diff().drop_nulls() < 0).any()  # Some resting orders fill after later orders.
+    trades = ledgerTrades(fills)
+    assert trades.height == fills.height // 2
+    assert (trades["direction"] == 1).all()
+    assert (trades["duration"].drop_nulls() >= timedelta(0)).all()
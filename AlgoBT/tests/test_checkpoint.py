@@ -0,0 +1,100 @@
+import polars as pl
+import pytest
+
+from BT_engine import BTest
+from BT_utils import onrow
+from checkpoint import Checkpointer, checkpoints, loadState, snapshot
+from indicators import RSI, SMA
+from synthetic import syntheticUniverse
+
+DATA = syntheticUniverse(2, 20_000)
+SLOW = DATA["S1"].select("timestamp", pl.col("close").rolling_mean(50).alias("slow")).gather_every(7)
+
+
+class CheckpointStrat(BTest):
+    """Trades market, limit and stop orders on two equities and a resampled timeframe, and keeps its own state."""
+
+    def __init__(self, crash_at: int = None):
+        self.cash = 1_000_000
+        self.commision_per = 0.0005
+        self.crash_at = crash_at
+        self.bars = 0
+        self.quarters = []
+        self.a = self.initEquity("A", DATA["S0"], "1m", "A")
+        self.b = self.initEquity("B", DATA["S1"], "1m", "B")
+        self.addStreamingIndicator(self.a, "sma", SMA(20))
+        self.addStreamingIndicator(self.b, "rsi", RSI(14))
+        self.addIndicator(SLOW, self.b, "slow", "slow")  # Own timestamps, so it has a cursor.
+        self.addTimeframe(self.a, "15m", "AH")
+
+    def onRow(self, d, timeframe):
+        pass
+
+    @onrow(timeframe="1m")
+    def onMinute(self, d):
+        self.bars += 1
+        if self.bars == self.crash_at:
+            raise RuntimeError("Preempted.")
+        if d.A.close[0] > d.A.sma[0]:
+            self.marketOrder(d.A, 1, "BUY")
+        else:
+            self.limitOrder(d.A, 1, "SELL", d.A.close[0] * 1.0005)
+        if d.B.rsi[0] < 30 and len(d.B.slow):
+            self.stopOrder(d.B, 2, "BUY", d.B.slow[0])
+
+    @onrow(timeframe="15m")
+    def onQuarter(self, d):
+        self.quarters.append(d.AH.close[0])
+        if len(self.quarters) % 3 == 0:
+            self.marketOrder(d.AH, 1, "SELL")
+
+
+def orders(bt) -> list:
+    return [(order.oid, order.status, order.price_filled) for order in bt.orderBook.all_orders]
+
+
+def assertSameRun(bt, reference) -> None:
+    assert bt.fills.equals(reference.fills)
+    assert bt.equity_curve.equals(reference.equity_curve)
+    assert bt.quarters == reference.quarters and bt.bars == reference.bars
+    assert orders(bt) == orders(reference)
+
+
+@pytest.fixture(scope="module")
+def reference():
+    bt = CheckpointStrat()
+    bt.run()
+    return bt
+
+
+def test_checkpointing_doesnt_change_the_run(reference, tmp_path):
+    bt = CheckpointStrat()
+    bt.run(checkpoint=Checkpointer(str(tmp_path), every=5_000, keep=0))
+    assert len(checkpoints(str(tmp_path))) > 2
+    assertSameRun(bt, reference)
+
+
+def test_resume_from_a_snapshot_is_bit_identical(reference, tmp_path):
+    CheckpointStrat().run(checkpoint=Checkpointer(str(tmp_path), every=5_000, keep=0))
+    for path in checkpoints(str(tmp_path)):
+        bt = CheckpointStrat()
+        bt.run(resume=path)
+        assertSameRun(bt, reference)
+
+
+def test_resume_after_a_crash(reference, tmp_path):
+    crashed = CheckpointStrat(crash_at=15_000)
+    with pytest.raises(RuntimeError):
+        crashed.run(checkpoint=Checkpointer(str(tmp_path), every=4_000))
+    bt = CheckpointStrat()
+    bt.run(resume=str(tmp_path), checkpoint=Checkpointer(str(tmp_path), every=4_000), overrides={"crash_at": None})
+    assertSameRun(bt, reference)
+
+
+def test_resume_from_bytes(reference, tmp_path):
+    CheckpointStrat().run(checkpoint=Checkpointer(str(tmp_path), every=5_000, keep=0))
+    restored = CheckpointStrat()
+    tick = loadState(restored, checkpoints(str(tmp_path))[1])
+    bt = CheckpointStrat()
+    bt.run(resume=snapshot(restored, tick))
+    assertSameRun(bt, reference)
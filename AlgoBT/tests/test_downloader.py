@@ -0,0 +1,97 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import polars as pl
+import pytest
+
+import dataDownloader
+from barStore import BarStore
+from dataDownloader import BarDownloader, FrameBarClient, RateLimiter
+
+START = datetime(2024, 1, 1)
+END = datetime(2024, 1, 11)
+
+
+def hourlyBars(start=START, end=END) -> pl.DataFrame:
+    timestamps = pl.datetime_range(start, end, "1h", closed="left", eager=True)
+    close = 100 + np.arange(len(timestamps), dtype=float)
+    return pl.DataFrame({"timestamp": timestamps, "open": close, "high": close, "low": close, "close": close,
+                         "volume": np.ones(len(timestamps))})
+
+
+class RecordingClient(FrameBarClient):
+    """FrameBarClient that records the requested ranges and fails on the chunks starting at a given time."""
+
+    def __init__(self, frames: dict, fail_at: tuple = (), failures: int = -1):
+        """:param fail_at: chunk starts whose requests raise.
+        :param failures: requests to fail per chunk before serving it, or -1 to always fail.
+        """
+        super().__init__(frames)
+        self.fail_at = set(fail_at)
+        self.failures = failures
+        self.failed = {}
+        self.fetched = []
+
+    def fetchBars(self, symbol, timeframe, start, end):
+        if start in self.fail_at and (self.failures < 0 or self.failed.get(start, 0) < self.failures):
+            self.failed[start] = self.failed.get(start, 0) + 1
+            raise ConnectionError(f"Request for {symbol} from {start} failed.")
+        self.fetched.append((symbol, start, end))
+        return super().fetchBars(symbol, timeframe, start, end)
+
+
+@pytest.fixture
+def noBackoff(monkeypatch):
+    monkeypatch.setattr(dataDownloader.time, "sleep", lambda seconds: None)
+
+
+def downloader(client, tmp_path, retries=1) -> BarDownloader:
+    return BarDownloader(client, BarStore(str(tmp_path / "store")), chunk=timedelta(days=2), max_workers=4,
+                         rate_limit=1000, retries=retries)
+
+
+def test_rerun_after_interruption_fetches_only_missing_chunks(tmp_path, noBackoff):
+    bars = hourlyBars()
+    failing = RecordingClient({"BTC/USD": bars}, fail_at=(datetime(2024, 1, 5),))
+    with pytest.raises(ConnectionError):
+        downloader(failing, tmp_path).download(["BTC/USD"], "1h", START, END)
+
+    client = RecordingClient({"BTC/USD": bars})
+    resumed = downloader(client, tmp_path)
+    missing = [(datetime(2024, 1, 5), datetime(2024, 1, 7))]
+    assert resumed.missingChunks("BTC/USD", "1h", START, END) == missing
+    written = resumed.download(["BTC/USD"], "1h", START, END)
+    assert client.fetched == [("BTC/USD", start, end) for start, end in missing]
+    assert written == {"BTC/USD": 48}
+    assert resumed.missingChunks("BTC/USD", "1h", START, END) == []
+    assert resumed.store.read("BTC/USD", "1h").equals(bars)
+
+
+def test_extending_the_range_fetches_only_the_new_chunks(tmp_path):
+    bars = hourlyBars(START, datetime(2024, 1, 15))
+    downloader(FrameBarClient({"BTC/USD": bars}), tmp_path).download(["BTC/USD"], "1h", START, END)
+    client = RecordingClient({"BTC/USD": bars})
+    downloader(client, tmp_path).download(["BTC/USD"], "1h", START, datetime(2024, 1, 15))
+    assert client.fetched == [("BTC/USD", datetime(2024, 1, 11), datetime(2024, 1, 13)),
+                              ("BTC/USD", datetime(2024, 1, 13), datetime(2024, 1, 15))]
+
+
+def test_failed_requests_are_retried(tmp_path, noBackoff):
+    client = RecordingClient({"BTC/USD": hourlyBars()}, fail_at=(datetime(2024, 1, 3),), failures=2)
+    written = downloader(client, tmp_path, retries=3).download(["BTC/USD"], "1h", START, END)
+    assert client.failed == {datetime(2024, 1, 3): 2}
+    assert written == {"BTC/USD": 240}
+
+
+def test_rate_limiter_spaces_requests_after_the_burst():
+    limiter = RateLimiter(rate=50, burst=2)
+    started = time.monotonic()
+    for _ in range(7):
+        limiter.acquire()
+    assert time.monotonic() - started >= (7 - 2) / 50 * 0.95
+
+
+def test_aware_timestamps_are_converted_to_utc():
+    aware = datetime(2024, 1, 1, 5, tzinfo=timezone(timedelta(hours=5)))
+    assert dataDownloader._toEpoch(aware) == dataDownloader._toEpoch(datetime(2024, 1, 1))
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import numpy as np
+import polars as pl
+import pytest
+
+from BT_engine import BTest
+from BT_utils import Indicator, Timeline
+from synthetic import syntheticBars
+
+
+class BarsStrat(BTest):
+    """Holds one equity built from the given bars, without trading."""
+
+    def __init__(self, df: pl.DataFrame):
+        self.cash = 100_000
+        self.commision_per = 0.0
+        self.eq = self.initEquity("AAA", df, timeframe="1m", name="AAA")
+
+    def onRow(self, d, timeframe):
+        pass
+
+
+def test_equity_keeps_non_numeric_columns():
+    bars = syntheticBars(50)
+    df = bars.select("timestamp", pl.lit("AAA").alias("symbol"), pl.exclude("timestamp"),
+                     (pl.col("timestamp") + pl.duration(minutes=1)).alias("close_time"))
+    eq = BarsStrat(df).eq
+    assert eq.df.columns == df.columns
+    assert eq.df.equals(df)
+
+    eq.addIndicator(bars.with_columns((pl.col("close") * 2).alias("double")), "double", "double")
+    assert eq.df.columns == [*df.columns, "double"]
+    assert eq.df.drop("double").equals(df)
+    assert np.array_equal(eq.df["double"].to_numpy(), 2 * bars["close"].to_numpy())
+
+
+def test_indicator_never_reads_ahead_of_the_timestamp():
+    rng = np.random.default_rng(1)
+    timestamps = np.sort(rng.choice(10_000, 500, replace=False)).astype(np.int64)
+    values = rng.normal(size=500)
+    forward = Indicator(timestamps, values, "1m", "ind")
+    seeking = Indicator(timestamps, values, "1m", "ind")
+    with pytest.raises(ValueError):
+        forward[0]
+    for now in np.sort(rng.integers(-10, 10_010, 2_000)):
+        forward.getKnownData(int(now))
+        seeking.seek(int(rng.integers(-10, 10_010)))  # Jump somewhere else first, then back.
+        seeking.seek(int(now))
+        known = values[timestamps <= now][::-1]  # Every value stamped at or before now, newest first.
+        for ind in (forward, seeking):
+            assert len(ind) == len(known)
+            assert np.array_equal(ind.known_data, known)
+            if not len(known):
+                with pytest.raises(ValueError):
+                    ind[0]
+                continue
+            assert ind[0] == known[0] and ind[len(known) - 1] == known[-1]
+            with pytest.raises(IndexError):
+                ind[len(known)]
+
+
+def test_timeline_matches_a_sorted_list_of_bars():
+    rng = np.random.default_rng(3)
+    equities = [SimpleNamespace(timeframe=timeframe, timestamps=np.sort(rng.choice(2_000, size, replace=False)))
+                for timeframe, size in [("1m", 800), ("5m", 150), ("1m", 600), ("1h", 30), ("5m", 150)]]
+    timeline = Timeline(equities)
+    codes = {timeframe: code for code, timeframe in enumerate(dict.fromkeys(eq.timeframe for eq in equities))}
+    assert timeline.timeframes == list(codes)
+
+    bars = sorted((ts, codes[eq.timeframe], eq_id, row) for eq_id, eq in enumerate(equities)
+                  for row, ts in enumerate(eq.timestamps))
+    ticks = sorted({(ts, code) for ts, code, _, _ in bars})
+    assert list(zip(timeline.timestamps, timeline.codes)) == ticks
+    # A bar is known from the first tick with its timestamp, whichever timeframe that tick is for.
+    first_tick = {}
+    for i, (ts, _) in enumerate(ticks):
+        first_tick.setdefault(ts, i)
+    for i in range(len(timeline)):
+        known = {(eq_id, row) for ts, _, eq_id, row in bars if first_tick[ts] == i}
+        entries = range(timeline.ptr[i], timeline.ptr[i + 1])
+        assert {(timeline.eq_ids[k], timeline.rows[k]) for k in entries} == known
@@ -0,0 +1,13 @@
+import pytest
+
+from importTime import BUDGET, MODULES, check
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_module_imports_within_budget_and_without_heavy_dependencies(module):
+    result, = check([module])
+    assert result["error"] is None, result["error"]
+    assert not result["heavy"], f"{module} imports {result['heavy']}, which should only load on first use"
+    assert not result["third_party"], f"{module} needs {result['third_party']} besides numpy and polars"
+    assert result["seconds"] <= BUDGET
+
@@ -0,0 +1,64 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from indicators import ATR, EMA, RSI, SMA, RollingStd
+from synthetic import syntheticBars
+
+PERIOD = 14
+
+
+@pytest.fixture(scope="module")
+def bars() -> pl.DataFrame:
+    return syntheticBars(5_000, seed=4)
+
+
+def stream(indicator, bars: pl.DataFrame) -> np.ndarray:
+    inputs = [bars[col].to_numpy() for col in indicator.inputs]
+    return np.array([indicator.update(*values) for values in zip(*inputs)])
+
+
+def seededEwm(values: pl.Series, period: int, alpha: float) -> np.ndarray:
+    """Exponential average of values seeded with the mean of the first period values, NaN before that."""
+    seeded = pl.concat([pl.Series([values[:period].mean()]), values[period:]])
+    return np.concatenate([np.full(period - 1, np.nan), seeded.ewm_mean(alpha=alpha, adjust=False).to_numpy()])
+
+
+def test_sma_matches_rolling_mean(bars):
+    expected = bars["close"].rolling_mean(PERIOD).to_numpy()
+    np.testing.assert_allclose(stream(SMA(PERIOD), bars), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize("ddof", [0, 1])
+def test_rolling_std_matches_polars(bars, ddof):
+    expected = bars["close"].rolling_std(PERIOD, ddof=ddof).to_numpy()
+    np.testing.assert_allclose(stream(RollingStd(PERIOD, ddof=ddof), bars), expected, rtol=1e-8)
+
+
+def test_ema_matches_seeded_ewm_mean(bars):
+    expected = seededEwm(bars["close"], PERIOD, 2 / (PERIOD + 1))
+    np.testing.assert_allclose(stream(EMA(PERIOD), bars), expected, rtol=1e-12)
+
+
+def test_rsi_matches_wilder_averages(bars):
+    change = bars["close"].diff()[1:]
+    gain = seededEwm(change.clip(lower_bound=0), PERIOD, 1 / PERIOD)
+    loss = seededEwm(-change.clip(upper_bound=0), PERIOD, 1 / PERIOD)
+    expected = np.concatenate([[np.nan], 100 - 100 / (1 + gain / loss)])
+    np.testing.assert_allclose(stream(RSI(PERIOD), bars), expected, rtol=1e-10)
+
+
+def test_atr_matches_wilder_average_of_true_range(bars):
+    prev_close = pl.col("close").shift(1)
+    true_range = bars.select(pl.max_horizontal(pl.col("high") - pl.col("low"), (pl.col("high") - prev_close).abs(),
+                                               (pl.col("low") - prev_close).abs()))[:, 0]
+    np.testing.assert_allclose(stream(ATR(PERIOD), bars), seededEwm(true_range, PERIOD, 1 / PERIOD), rtol=1e-10)
+
+
+def test_history_keeps_the_last_values(bars):
+    sma = SMA(PERIOD, history=50)
+    values = stream(sma, bars)
+    assert len(sma) == 50
+    assert [sma[offset] for offset in range(50)] == list(values[::-1][:50])
+    with pytest.raises(IndexError):
+        sma[50]
@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import numpy as np
+import polars as pl
+
+from ledger import SIDES, Ledger
+
+SIGNS = {"BUY": 1, "SELL": -1, "SHORT": -1, "COVER": 1}
+
+
+def fakeEquities(n: int) -> list:
+    """Stand-ins for Equity with a name, a timestamp schema and a settable close[0]."""
+    frame = pl.DataFrame({"timestamp": pl.Series([], dtype=pl.Datetime("us"))})
+    return [SimpleNamespace(name=f"EQ{i}", df=frame, close=[100.0]) for i in range(n)]
+
+
+def randomTicks(rng, n_ticks: int, n_equities: int) -> list:
+    """Ticks of (time, eq_id, fills, closes). Each tick fills 1 to 4 orders of one equity, as
+    (oid, side, qty, price, commission) tuples, then marks the equities at closes.
+    """
+    ticks, oid = [], 0
+    for tick in range(n_ticks):
+        fills = []
+        for _ in range(rng.integers(1, 5)):
+            fills.append((oid, SIDES[rng.integers(4)], float(rng.integers(1, 50)), float(rng.uniform(50, 150)),
+                          float(rng.uniform(0, 1))))
+            oid += 1
+        ticks.append((1_000 * tick, int(rng.integers(n_equities)), fills, rng.uniform(50, 150, n_equities)))
+    return ticks
+
+
+def replay(ledger: Ledger, ticks: list) -> None:
+    """Records each tick's fills, one at a time or as a batch, and marks the equity curve."""
+    for time, eq_id, fills, closes in ticks:
+        if len(fills) > 1:
+            oids, sides, qtys, prices, commissions = zip(*fills)
+            ledger.recordBatch(list(oids), eq_id, time, sides, qtys, prices, commissions)
+        else:
+            ledger.record(fills[0][0], eq_id, time, *fills[0][1:])
+        for eq, close in zip(ledger.equities, closes):
+            eq.close[0] = close
+        ledger.mark(time)
+
+
+def test_ledger_matches_a_running_total():
+    equities = fakeEquities(3)
+    ticks = randomTicks(np.random.default_rng(6), 300, len(equities))
+    ledger = Ledger(cash=100_000, capacity=4)  # Small, so the buffers grow several times.
+    ledger.start(equities, n_ticks=len(ticks))
+    replay(ledger, ticks)
+
+    cash, positions, curve, rows = 100_000.0, np.zeros(len(equities)), [], []
+    for time, eq_id, fills, closes in ticks:
+        for oid, side, qty, price, commission in fills:
+            cash -= SIGNS[side] * qty * price + commission
+            positions[eq_id] += SIGNS[side] * qty
+            rows.append((oid, f"EQ{eq_id}", side, qty, price))
+        curve.append((time, cash, float(positions @ closes)))
+
+    assert ledger.n_fills == len(rows)
+    assert np.isclose(ledger.cash, cash, rtol=1e-12)
+    assert np.allclose(ledger.positions, positions)
+    fills = ledger.fillsFrame()
+    assert fills.select("oid", "equity", "side", "qty", "price").rows() == rows
+    marks = ledger.curveFrame()
+    assert marks["time"].dt.epoch("us").to_list() == [time for time, _, _ in curve]
+    assert np.allclose(marks["cash"].to_numpy(), [mark[1] for mark in curve])
+    assert np.allclose(marks["market_value"].to_numpy(), [mark[2] for mark in curve])
+
+
+def test_fill_limit_keeps_the_latest_fills():
+    equities = fakeEquities(2)
+    ticks = randomTicks(np.random.default_rng(8), 200, len(equities))
+    full, limited = Ledger(cash=100_000, capacity=4), Ledger(cash=100_000, capacity=4)
+    full.start(equities, n_ticks=len(ticks))
+    limited.start(equities, n_ticks=len(ticks), history=False, fill_limit=25)
+    replay(full, ticks)
+    replay(limited, ticks)
+
+    assert limited.n_fills == full.n_fills
+    assert len(limited.fills["oid"]) <= 2 * 25
+    assert limited.fillsFrame().equals(full.fillsFrame().tail(25))
+    assert limited.cash == full.cash and np.array_equal(limited.positions, full.positions)
+    assert limited.curveFrame().equals(full.curveFrame().tail(1))
+    assert limited.lastMark() == full.lastMark()
@@ -0,0 +1,64 @@
+import numpy as np
+
+from orders import OrderBook, OrderSim
+
+
+def randomBook(rng, n: int = 300):
+    book, sim = OrderBook([]), OrderSim()
+    for _ in range(n):
+        type_ = rng.choice(["LIMIT", "STOP"])
+        side = rng.choice(["BUY", "SELL", "SHORT", "COVER"])
+        price = round(float(rng.uniform(90, 110)), 1)  # Rounded, so some orders share a price.
+        book.addOrder(sim.createRestingOrder(type_, price, 1.0, 0, side, int(rng.integers(0, 2))))
+    return book
+
+
+def triggers(order, high: float, low: float) -> bool:
+    """Reference rule: orders resting below the price trigger when it trades down to them, and the reverse."""
+    if order.book in ("BUY_LIMIT", "SELL_STOP"):
+        return order.price_placed >= low
+    return order.price_placed <= high
+
+
+def test_match_bar_matches_a_linear_scan():
+    rng = np.random.default_rng(0)
+    book = randomBook(rng)
+    for _ in range(50):
+        eq_id = int(rng.integers(0, 2))
+        low = float(rng.uniform(88, 108))
+        high = low + float(rng.uniform(0, 6))
+        expected = sorted(order.oid for order in book.open_orders.values()
+                          if order.eq_id == eq_id and triggers(order, high, low))
+        triggered = book.matchBar(eq_id, high, low)
+        assert [order.oid for order in triggered] == expected
+        assert not any(order.oid in book.open_orders for order in triggered)
+        for prices in book.books.values():
+            assert prices == sorted(prices)
+    assert sum(book.resting.values()) == len(book.open_orders)
+
+
+def test_canceled_orders_never_trigger():
+    rng = np.random.default_rng(1)
+    book = randomBook(rng)
+    canceled = list(book.open_orders.values())[::3]
+    for order in canceled:
+        book.removeOpenOrder(order)
+    book.removeOpenOrder(canceled[0])  # Removing twice is a no-op.
+    triggered = book.matchBar(0, 1e9, -1e9) + book.matchBar(1, 1e9, -1e9)
+    assert {order.oid for order in triggered}.isdisjoint(order.oid for order in canceled)
+    assert len(triggered) + len(canceled) == 300
+    assert not book.open_orders and not book.resting
+
+
+def test_resting_orders_fill_at_their_price_or_the_gapped_open():
+    sim = OrderSim()
+
+    class Model:
+        open, close, volume, slippage = np.array([100.0]), np.array([100.0]), np.array([1e6]), np.array([0.0])
+
+    limit = sim.createRestingOrder("LIMIT", 99.0, 1.0, 0, "BUY", 0)
+    assert sim.fillRestingOrder(limit, Model, 0)[0] == 99.0
+    gapped = sim.createRestingOrder("LIMIT", 101.0, 1.0, 0, "BUY", 0)  # The bar opened below the limit.
+    assert sim.fillRestingOrder(gapped, Model, 0)[0] == 100.0
+    stop = sim.createRestingOrder("STOP", 102.0, 1.0, 0, "SELL", 0)  # The bar opened below the stop.
+    assert sim.fillRestingOrder(stop, Model, 0)[0] == 100.0
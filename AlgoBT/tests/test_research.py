@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import polars as pl
+
+from research import ResearchStrat
+
+
+class ShortStrat(ResearchStrat):
+    """Shorts every 10 bars for 5 bars."""
+    def __init__(self):
+        pass
+
+    def initColumns(self):
+        pass
+
+    def setSignals(self):
+        for symbol, df in list(self.dfs.items()):
+            self.dfs[symbol] = df.with_columns(self.sweepSignals(period=10))
+
+    def sweepSignals(self, period):
+        bar = pl.int_range(pl.len())
+        return [
+            pl.lit(0, pl.Int8).alias("long_entry"),
+            pl.lit(0, pl.Int8).alias("long_exit"),
+            (bar % period == 0).cast(pl.Int8).alias("short_entry"),
+            (bar % period == period // 2).cast(pl.Int8).alias("short_exit"),
+        ]
+
+
+def risingBars(n: int = 200) -> pl.DataFrame:
+    close = 100 * np.cumprod(np.full(n, 1.001))
+    return pl.DataFrame({"timestamp": [datetime(2024, 1, 1) + timedelta(minutes=i) for i in range(n)],
+                         "open": close, "high": close, "low": close, "close": close, "volume": np.ones(n)})
+
+
+def test_short_side_returns_match_sweep():
+    strat = ShortStrat.fromFrames({"X": risingBars()}, lazy=False, starting_cash=100_000)
+    strat.initColumns()
+    strat.setSignals()
+    strat.runBacktest()
+
+    df = strat.dfs["X"]
+    short = df.filter(pl.col("is_short") == 1)
+    assert (short["strategy_returns"] < 0).all()  # Shorts lose while prices rise.
+    assert (short["strategy_returns"] == -short["returns"]).all()
+
+    by_symbol = strat.symbolStats()
+    swept = strat.sweep({"period": [10]})
+    assert by_symbol["total_returns"][0] < 0
+    for metric in ("total_returns", "sharpe", "max_drawdown", "n_trades", "exposure"):
+        assert np.isclose(by_symbol[metric][0], swept[metric][0])
+    _, metrics = strat.stats()
+    assert np.isclose(metrics["total_return"][0], by_symbol["total_returns"][0])
+
+
+class FileStrat(ResearchStrat):
+    """Loads self.files, without signals of its own."""
+    def __init__(self, files, **attrs):
+        self.files = files
+        for name, value in attrs.items():
+            setattr(self, name, value)
+
+
+def multiSymbolFile(path, n: int = 50) -> str:
+    """Two flat priced symbols, A at 1 and B at 100, interleaved by timestamp in one parquet file."""
+    timestamps = [datetime(2024, 1, 1) + timedelta(minutes=i) for i in range(n)]
+    frames = [pl.DataFrame({"timestamp": timestamps, "symbol": symbol, "open": price, "high": price,
+                            "low": price, "close": price, "volume": 1.0})
+              for symbol, price in (("A", 1.0), ("B", 100.0))]
+    file = str(path / "bars.parquet")
+    pl.concat(frames).sort("timestamp", "symbol").write_parquet(file)
+    return file
+
+
+def test_multi_symbol_file_returns_are_per_symbol(tmp_path):
+    strat = FileStrat({"AB": multiSymbolFile(tmp_path)}, lazy=False)
+    df = strat.dfs["AB"]
+    assert df["returns"].drop_nulls().abs().max() == 0  # Flat prices never return anything.
+    assert df.group_by("symbol").agg(pl.col("returns").null_count())["returns"].to_list() == [1, 1]
+
+
+class SmaStrat(ResearchStrat):
+    """Long above a 5 bar SMA, short below it, in either universe or per symbol mode."""
+    def __init__(self, files, universe_mode=False):
+        self.files = files
+        self.universe_mode = universe_mode
+        self.starting_cash = 100_000
+
+    def signals(self, df, over=None):
+        sma = pl.col("close").rolling_mean(5)
+        above = (pl.col("close") > (sma.over(over) if over else sma)).cast(pl.Int8)
+        return df.with_columns(above.alias("long_entry"), (1 - above).alias("long_exit"),
+                               (1 - above).alias("short_entry"), above.alias("short_exit"))
+
+    def initColumns(self):
+        pass
+
+    def setSignals(self):
+        if self.universe_mode:
+            self.df = self.signals(self.df, ["symbol"])
+        else:
+            self.dfs = {symbol: self.signals(df) for symbol, df in self.dfs.items()}
+
+
+def test_universe_mode_on_multi_symbol_file_matches_per_symbol_files(tmp_path):
+    rng = np.random.default_rng(0)
+    timestamps = [datetime(2024, 1, 1) + timedelta(minutes=i) for i in range(300)]
+    frames = {}
+    for symbol, start in (("A", 10.0), ("B", 500.0)):
+        close = start * np.cumprod(1 + rng.normal(0, 0.01, len(timestamps)))
+        frames[symbol] = pl.DataFrame({"timestamp": timestamps, "symbol": symbol, "open": close, "high": close,
+                                       "low": close, "close": close, "volume": 1.0})
+    files = {}
+    for symbol, df in frames.items():
+        files[symbol] = str(tmp_path / f"{symbol}.parquet")
+        df.drop("symbol").write_parquet(files[symbol])
+    combined = str(tmp_path / "AB.parquet")
+    pl.concat(frames.values()).sort("timestamp", "symbol").write_parquet(combined)
+
+    per_symbol = SmaStrat(files)
+    universe = SmaStrat({"AB": combined}, universe_mode=True)
+    for strat in (per_symbol, universe):
+        strat.initColumns()
+        strat.setSignals()
+        strat.runBacktest()
+    expected, result = per_symbol.symbolStats().sort("symbol"), universe.symbolStats().sort("symbol")
+    assert expected["total_returns"].abs().min() > 0
+    assert np.allclose(result.drop("symbol").to_numpy(), expected.drop("symbol").to_numpy(), equal_nan=True)
+
+
+def test_sweep_matches_a_single_run():
+    from research import TestStrat
+    rng = np.random.default_rng(2)
+    n = 20_000
+    close = 100 * np.cumprod(1 + rng.normal(0, 0.002, n))
+    df = pl.DataFrame({"timestamp": [datetime(2024, 1, 1) + timedelta(minutes=i) for i in range(n)],
+                       "open": close, "high": close, "low": close, "close": close, "volume": np.ones(n)})
+    single = TestStrat.fromFrames({"QQQ": df}, lazy=False, starting_cash=100_000)
+    single.initColumns()  # SMA 7 over SMA 21, dropping their warm-up rows.
+    single.setSignals()
+    single.runBacktest()
+    expected = single.symbolStats()
+    swept = TestStrat.fromFrames({"QQQ": df}, lazy=False, starting_cash=100_000)
+    swept = swept.sweep({"fast": [5, 7], "slow": [21]}).filter(pl.col("fast") == 7)
+    for metric in expected.columns[1:]:
+        assert np.isclose(swept[metric][0], expected[metric][0], rtol=1e-12), metric
+
+
+def loopState(entries, exits) -> list:
+    """Reference state machine: enter when flat, exit when in a trade. Missing signals count as 0."""
+    state, states = 0, []
+    for entry, exit_ in zip(entries, exits):
+        if state == 0 and entry == 1:
+            state = 1
+        elif state == 1 and exit_ == 1:
+            state = 0
+        states.append(state)
+    return states
+
+
+def test_track_is_in_trade_matches_a_python_loop():
+    rng = np.random.default_rng(5)
+    n = 5_000
+    signals = {col: pl.Series(col, rng.choice([0, 1, 2], n, p=[0.8, 0.15, 0.05])).replace(2, None).cast(pl.Int8)
+               for col in ("long_entry", "long_exit", "short_entry", "short_exit")}
+    df = pl.DataFrame({"symbol": rng.choice(["A", "B", "C"], n), **signals})
+    strat = ShortStrat.fromFrames({"X": risingBars()})
+    tracked = strat.trackIsInTrade(df)
+    grouped = strat.trackIsInTrade(df, over=["symbol"]).with_row_index("row")
+    for side in ("long", "short"):
+        expected = loopState(df[f"{side}_entry"], df[f"{side}_exit"])
+        assert tracked[f"is_{side}"].to_list() == expected
+        for (symbol,), group in grouped.group_by("symbol", maintain_order=True):
+            expected = loopState(group[f"{side}_entry"], group[f"{side}_exit"])
+            assert group.sort("row")[f"is_{side}"].to_list() == expected, symbol
@@ -0,0 +1,157 @@
+import os
+import json
+import threading
+from typing import Optional
+import numpy as np
+import polars as pl
+
+
+class BarStore():
+    """Local bar store partitioned by symbol, timeframe and date.
+
+    Layout on disk:
+        {root}/_index.json                                      symbol -> timeframe -> [start, end, rows]
+        {root}/{symbol}/{timeframe}/_manifest.json              parts of one symbol and timeframe
+        {root}/{symbol}/{timeframe}/{YYYY-MM-DD}/part-00000.arrow
+
+    Parts are uncompressed Arrow IPC files, so reads memory-map them instead of parsing and copying, and
+    repeated backtests share pages through the OS cache. Writes are append-only: new parts are added and
+    existing ones are never rewritten. Opening a store only reads the small top level index; a symbol's
+    manifest is read the first time it is accessed. Timestamps in the index and manifests are epoch
+    microseconds.
+    """
+
+    def __init__(self, root: str):
+        """:param root: directory of the store. Created if it doesn't exist."""
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()  # Guards the index and manifests when writing from several threads.
+        self._manifests = {}  # (symbol, timeframe) -> list of parts, loaded on first access.
+        index_path = os.path.join(root, "_index.json")
+        self.index = _readJson(index_path, {})
+
+    def symbols(self) -> list:
+        return list(self.index)
+
+    def timeframes(self, symbol: str) -> list:
+        return list(self.index.get(_fileSymbol(symbol), {}))
+
+    def coverage(self, symbol: str, timeframe: str) -> list:
+        """Time ranges covered by the stored parts, as sorted (start, end) epoch microsecond pairs."""
+        return sorted((part["start"], part["end"]) for part in self._manifest(symbol, timeframe))
+
+    def write(self, symbol: str, timeframe: str, df: pl.DataFrame) -> int:
+        """Appends bars to the store. Rows with timestamps inside an already stored part are skipped.
+
+        :param symbol: symbol of the bars. '/' is replaced with '_', e.g. 'BTC/USD' is stored as 'BTC_USD'.
+        :param timeframe: timeframe of the bars, e.g. '1m'.
+        :param df: bars with a Datetime 'timestamp' column.
+        :return: number of rows written.
+        """
+        if df.is_empty():
+            return 0
+        df = df.sort("timestamp").unique("timestamp", keep="first", maintain_order=True)
+        epochs = df["timestamp"].dt.epoch("us").to_numpy()
+        with self._lock:
+            parts = self._manifest(symbol, timeframe)
+            spans = sorted((part["start"], part["end"]) for part in parts)
+            starts = np.array([start for start, _ in spans], dtype=np.int64)
+            ends = np.array([end for _, end in spans], dtype=np.int64)
+            # Assign each row to the gap between stored parts that it falls in, dropping rows inside a part.
+            # Writing one part per gap and date keeps the parts disjoint, so reads can simply concatenate them.
+            gap = np.searchsorted(starts, epochs, side="right")
+            inside = (gap > 0) & (epochs <= ends[np.maximum(gap - 1, 0)]) if len(spans) else np.zeros(len(df), bool)
+            df = df.with_columns(pl.Series("_gap", gap), pl.col("timestamp").dt.date().alias("_date"))
+            df = df.filter(pl.Series(~inside))
+            written = 0
+            for (_, date), part_df in df.group_by("_gap", "_date", maintain_order=True):
+                part_df = part_df.drop("_gap", "_date")
+                path = self._partPath(symbol, timeframe, date, len(parts))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                part_df.write_ipc(path + ".tmp", compression="uncompressed")
+                os.replace(path + ".tmp", path)
+                part_epochs = part_df["timestamp"].dt.epoch("us")
+                parts.append({"file": os.path.relpath(path, self.root), "start": int(part_epochs[0]),
+                              "end": int(part_epochs[-1]), "rows": len(part_df)})
+                written += len(part_df)
+            if written:
+                self._saveManifest(symbol, timeframe, parts)
+        return written
+
+    def read(self, symbol: str, timeframe: str, start=None, end=None, columns: Optional[list] = None) -> pl.DataFrame:
+        """Reads bars as a DataFrame backed by the memory-mapped parts.
+
+        :param start: first timestamp to read, inclusive.
+        :param end: last timestamp to read, inclusive.
+        :param columns: columns to read. 'timestamp' is always included.
+        """
+        paths = self._partPaths(symbol, timeframe, start, end)
+        if columns is not None:
+            columns = ["timestamp", *[col for col in columns if col != "timestamp"]]
+        if not paths:
+            raise ValueError(f"No {timeframe} bars stored for {symbol} in the requested range.")
+        df = pl.concat([pl.read_ipc(path, columns=columns) for path in paths], rechunk=False)
+        return _filterRange(df, start, end)
+
+    def scan(self, symbol: str, timeframe: str, start=None, end=None) -> pl.LazyFrame:
+        """Lazily scans bars. Only parts overlapping [start, end] are opened."""
+        paths = self._partPaths(symbol, timeframe, start, end)
+        if not paths:
+            raise ValueError(f"No {timeframe} bars stored for {symbol} in the requested range.")
+        return _filterRange(pl.scan_ipc(paths), start, end)
+
+    def _partPaths(self, symbol, timeframe, start, end) -> list:
+        start_us = None if start is None else _toEpoch(start)
+        end_us = None if end is None else _toEpoch(end)
+        parts = sorted(self._manifest(symbol, timeframe), key=lambda part: part["start"])
+        return [os.path.join(self.root, part["file"]) for part in parts
+                if (start_us is None or part["end"] >= start_us) and (end_us is None or part["start"] <= end_us)]
+
+    def _partPath(self, symbol, timeframe, date, n) -> str:
+        return os.path.join(self.root, _fileSymbol(symbol), timeframe, date.isoformat(), f"part-{n:05d}.arrow")
+
+    def _manifestPath(self, symbol, timeframe) -> str:
+        return os.path.join(self.root, _fileSymbol(symbol), timeframe, "_manifest.json")
+
+    def _manifest(self, symbol, timeframe) -> list:
+        key = (_fileSymbol(symbol), timeframe)
+        if key not in self._manifests:
+            self._manifests[key] = _readJson(self._manifestPath(symbol, timeframe), [])
+        return self._manifests[key]
+
+    def _saveManifest(self, symbol, timeframe, parts) -> None:
+        _writeJson(self._manifestPath(symbol, timeframe), parts)
+        entry = [min(part["start"] for part in parts), max(part["end"] for part in parts),
+                 sum(part["rows"] for part in parts)]
+        self.index.setdefault(_fileSymbol(symbol), {})[timeframe] = entry
+        _writeJson(os.path.join(self.root, "_index.json"), self.index)
+
+
+def _fileSymbol(symbol: str) -> str:
+    return symbol.replace('/', '_')  # change '/' to '_' for file-naming.
+
+
+def _toEpoch(timestamp) -> int:
+    return pl.Series([timestamp]).dt.epoch("us")[0]
+
+
+def _filterRange(df, start, end):
+    if start is not None:
+        df = df.filter(pl.col("timestamp") >= start)
+    if end is not None:
+        df = df.filter(pl.col("timestamp") <= end)
+    return df
+
+
+def _readJson(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def _writeJson(path, obj) -> None:
+    # Write to a temporary file and rename, so readers never see a half written file.
+    with open(path + ".tmp", "w") as f:
+        json.dump(obj, f)
+    os.replace(path + ".tmp", path)
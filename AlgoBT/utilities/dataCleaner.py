@@ -1,84 +1,261 @@
+import os
 from typing import Optional
 import polars as pl
-from research import Research
+from research import Research, fileType
+from resample import Resampler
+from BT_utils import Duration
 import numpy as np
 
 
 class DataCleaner():
     def __init__(self, timeframe_to_agg, lowest_timeframe,
-                polars_df: Optional[pl.DataFrame] = None, file_path: Optional["str"] = None):
+                polars_df: Optional[pl.DataFrame] = None, file_path: Optional["str"] = None,
+                start=None, end=None, columns: Optional[list] = None):
         """initiatlize DataCleaner Class
         at least one polars_df or file_path must be provided.
 
-        :param timeframe_to_agg: timeframe to aggregate polars df to
-        :param lowest_timeframe: _description_
-        :param polars_df: pass a polars df to clean and aggregate. Do not pass a polars df and filepath
-        :param file_path: the file path to load the data, if polars_df is not passed
+        :param timeframe_to_agg: timeframe to aggregate polars df to, e.g. '1h'.
+        :param lowest_timeframe: timeframe of the bars in the polars df or file, e.g. '1m'.
+        :param polars_df: pass a polars df or LazyFrame to clean and aggregate. Do not pass a polars df and filepath
+        :param file_path: the file path to load the data, if polars_df is not passed. The file is scanned lazily.
+        :param start: first timestamp to load from file_path, inclusive.
+        :param end: last timestamp to load from file_path, inclusive.
+        :param columns: columns to load from file_path.
         """
         self.target_timeframe = timeframe_to_agg
+        self.lowest_timeframe = lowest_timeframe
         if polars_df is None and file_path is None:
             raise ValueError("At least one polars_df or file_path must be provided.")
         if polars_df is None:
-            self.df = self._loadData(file_path)
+            self.df = self._loadData(file_path, start=start, end=end, columns=columns)
         else:
             self.df = polars_df
 
-    def _loadData(self, path):
-        """loads data from a stored file based on file path.
-           Valid file types are csv, parquet, and json
+    def _loadData(self, path, start=None, end=None, columns=None) -> pl.LazyFrame:
+        """lazily loads data from a stored file based on file path.
+           Valid file types are csv, parquet, json and ndjson
 
         :param path: Path to file storage. Must be suffixed with apropriate suffix of file type.
-        :return: Returns loaded df
+        :return: Returns a LazyFrame of the file. Nothing is read until it is collected.
         """
-        path_list = list(path)
-        # Parses the path str to obtain the file type at the end of the file name.abs
+        file_type = fileType(path)
         try:
-            file_type = ''.join(path_list[len(path_list) - 1 - path_list[::-1].index('.') + 1:])
-        except Exception:
-            raise ValueError(
-                f"ERROR: file type: {file_type} in file path: {path} is invalid. "
-                "Only files with the suffixes .csv, .parquet, and .json."
-            )
-        try:
-            df = Research().loadFileTypes(path=path, type=file_type)  # Attempt to load the dataframe
+            df = Research().scanFileTypes(path=path, type=file_type, columns=columns, start=start, end=end)
         except Exception as e:
             raise ValueError(f"Error loading {file_type} file at path '{path}': {e}")
         return df
 
-    def cleanHighLows(self, stdvs: Optional[int] = 3) -> None:
-        """cleans dataframe highs and lows using standard deviation
+    def collect(self) -> pl.DataFrame:
+        """Runs the cleaning pipeline and returns the result as a DataFrame."""
+        if isinstance(self.df, pl.LazyFrame):
+            self.df = self.df.collect()
+        return self.df
 
-        :param stdvs: _description_, defaults to 3
-        :raises ValueError: _description_
+    def aggregate(self, available: str = "end") -> None:
+        """Aggregates the bars from lowest_timeframe to timeframe_to_agg. Stays lazy if the df is lazy.
+
+        :param available: "end" or "last". Sets the timestamp of each aggregated bar to when it becomes known,
+                          see Resampler. The start of each bar is kept in the 'bucket' column.
         """
+        self.df = Resampler(self.target_timeframe, self.lowest_timeframe, available).resample(self.df)
 
-        try:
-            df = self.df.with_columns(abs((pl.col("high") - (pl.col("close") + pl.col("open")) / 2)
-                                    / pl.col("high")).alias("high_dif")
-            )
-            df = self.df.with_columns(
-                abs((pl.col("low") - ((pl.col("close") + pl.col("open")) / 2)) / pl.col("high")).alias("low_dif")
-            )
+    def cleanHighLows(self, stdvs: Optional[int] = 3) -> None:
+        """cleans dataframe highs and lows using standard deviation
 
-        except Exception as e:
+        Wicks that stretch further from the middle of the bar's body than the mean plus stdvs standard deviations
+        are clipped to the body. The statistics are global, so a lazy df is read twice: once for the thresholds
+        and once when it's collected. For data that doesn't fit in memory, use StreamingCleaner.
+        :param stdvs: number of standard deviations above the mean a wick is considered an outlier, defaults to 3
+        :raises ValueError: if the df lacks open, high, low or close columns.
+        """
+        columns = self.df.collect_schema().names() if isinstance(self.df, pl.LazyFrame) else self.df.columns
+        if missing := {"open", "high", "low", "close"} - set(columns):
             raise ValueError(
                 "dataframe is invalid. check that provided df has an open, high, low, and close columns,"
-                "and that they are lower-case and coantain numerical values only."
-                f"Exception: {e}"
+                f"and that they are lower-case and coantain numerical values only. Missing: {missing}"
             )
+        df = self.df.with_columns(wickDeviations())
+
+        stats = df.select(
+            (pl.col("high_dif").mean() + pl.col("high_dif").std() * stdvs).alias("high_outlier"),
+            (pl.col("low_dif").mean() + pl.col("low_dif").std() * stdvs).alias("low_outlier"),
+        )
+        if isinstance(stats, pl.LazyFrame):
+            stats = stats.collect()  # Only the two thresholds are materialized. The frame itself stays lazy.
+        high_outlier, low_outlier = stats.row(0)
+
+        self.df = df.with_columns(clipWicks(high_outlier, low_outlier)).drop("high_dif", "low_dif")
+
+
+def wickDeviations() -> list:
+    """Distance of the high and low from the middle of the bar's body, relative to the high."""
+    mid = (pl.col("close") + pl.col("open")) / 2
+    return [
+        ((pl.col("high") - mid) / pl.col("high")).abs().alias("high_dif"),
+        ((pl.col("low") - mid) / pl.col("high")).abs().alias("low_dif"),
+    ]
+
+
+def clipWicks(high_outlier, low_outlier) -> list:
+    """Clips outlier highs and lows to the body of the bar. Thresholds can be numbers or per row expressions.
 
-        low_std = df["low_dif"].std()
-        high_std = df["high_dif"].std()
-        high_outlier = df["high_dif"].mean() + high_std * stdvs
-        low_outlier = df["low_dif"].mean() + low_std * stdvs
-
-        df = df.with_columns(pl.when(pl.col("high_dif") < high_outlier)
-                            .then(pl.col("high")
-                            .otherwise(max(pl.col("close"), pl.col("open")))
-                            .alias("high")))
-        df = df.with_columns(pl.when(pl.col("low_dif") < low_outlier)
-                            .then(pl.col("low")
-                            .otherwise(min(pl.col("close"), pl.col("open")))
-                            .alias("low")))
-        self.df = df
+    Rows with a missing threshold are left as they are.
+    """
+    high_outlier, low_outlier = pl.lit(high_outlier), pl.lit(low_outlier)
+    return [
+        pl.when(high_outlier.is_null() | (pl.col("high_dif") < high_outlier)).then(pl.col("high"))
+        .otherwise(pl.max_horizontal("close", "open")).alias("high"),
+        pl.when(low_outlier.is_null() | (pl.col("low_dif") < low_outlier)).then(pl.col("low"))
+        .otherwise(pl.min_horizontal("close", "open")).alias("low"),
+    ]
 
+
+class RunningStats():
+    """Count, mean and variance of a stream of values, updated batch by batch.
+
+    Batches are merged with the parallel variance formula of Chan et al., so the result equals the statistics of
+    all the values at once, without holding them.
+    """
+    __slots__ = ("n", "mean", "m2")
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared differences from the mean.
+
+    def update(self, values: np.ndarray) -> None:
+        values = values[np.isfinite(values)]
+        n = len(values)
+        if n == 0:
+            return
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.n * n / total
+        self.n = total
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation, like Polars' std()."""
+        return (self.m2 / (self.n - 1)) ** 0.5 if self.n > 1 else float("nan")
+
+
+class StreamingCleaner():
+    """Cleans bars that don't fit in memory, one batch at a time, and writes the cleaned batches as it goes.
+
+    Every batch goes through:
+        monotonic timestamps:  rows with a timestamp at or before the latest one already seen are dropped,
+                               counting duplicates and out of order rows separately.
+        gap detection:         with an interval, steps between consecutive timestamps longer than it are
+                               recorded as gaps.
+        wick clipping:         the same outlier clipping as DataCleaner.cleanHighLows.
+
+    Clipping thresholds are either "global", from the mean and std of every row, computed in a first pass over
+    the source with mergeable RunningStats, or "rolling", from the previous `window` rows, in a single pass.
+    Counts and gaps are kept in self.report.
+    """
+
+    def __init__(self, source, stdvs: float = 3, mode: str = "global", window: int = 10_000,
+                 batch_size: int = 1_000_000, interval: Optional[str] = None):
+        """:param source: file path, scanned lazily, or LazyFrame of bars with a timestamp column.
+        :param stdvs: number of standard deviations above the mean a wick is considered an outlier.
+        :param mode: "global" or "rolling" thresholds.
+        :param window: rows in the rolling thresholds.
+        :param batch_size: rows per batch. Bounds the memory used.
+        :param interval: expected step between bars, e.g. '1m'. Enables gap detection.
+        """
+        if mode not in ("global", "rolling"):
+            raise ValueError(f"Invalid mode {mode}. Use 'global' or 'rolling'.")
+        if isinstance(source, str):
+            source = Research().scanFileTypes(path=source, type=fileType(source))
+        self.source = source
+        self.stdvs = stdvs
+        self.mode = mode
+        self.window = window
+        self.batch_size = batch_size
+        self.interval = None if interval is None else Duration(interval).microseconds
+        self.report = {}
+
+    def run(self, out_dir: Optional[str] = None, store=None, symbol: Optional[str] = None,
+            timeframe: Optional[str] = None) -> dict:
+        """Cleans the source and writes each cleaned batch as it's produced.
+
+        :param out_dir: directory to write the batches to, as part-00000.parquet, part-00001.parquet, ...
+        :param store: BarStore to write the batches to, instead of out_dir. Needs symbol and timeframe.
+        :return: self.report, with rows_in, rows_out, duplicates, out_of_order, clipped_highs, clipped_lows and
+                 gaps (a DataFrame of gap_start, gap_end and missing_bars).
+        """
+        if store is not None and (symbol is None or timeframe is None):
+            raise ValueError("symbol and timeframe must be passed to write to a store.")
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+        thresholds = self._globalThresholds() if self.mode == "global" else None
+        self.report = {"rows_in": 0, "rows_out": 0, "duplicates": 0, "out_of_order": 0, "clipped_highs": 0,
+                       "clipped_lows": 0}
+        gaps = []
+        tail = pl.DataFrame(schema={"high_dif": pl.Float64, "low_dif": pl.Float64})  # Rolling window carry.
+        for n, batch in enumerate(self._batches(self.report)):
+            batch = batch.with_columns(wickDeviations())
+            if self.mode == "rolling":
+                high_outlier, low_outlier, tail = self._rollingThresholds(batch, tail)
+            else:
+                high_outlier, low_outlier = thresholds
+            cleaned = batch.with_columns(clipWicks(high_outlier, low_outlier))
+            self.report["clipped_highs"] += int((cleaned["high"] != batch["high"]).sum())
+            self.report["clipped_lows"] += int((cleaned["low"] != batch["low"]).sum())
+            cleaned = cleaned.drop("high_dif", "low_dif", "_step")
+            if self.interval is not None:
+                gaps.append(batch.filter(pl.col("_step") > self.interval).select(
+                    (pl.col("timestamp") - pl.duration(microseconds=pl.col("_step"))).alias("gap_start"),
+                    pl.col("timestamp").alias("gap_end"),
+                    (pl.col("_step") // self.interval - 1).alias("missing_bars"),
+                ))
+            self.report["rows_out"] += len(cleaned)
+            if store is not None:
+                store.write(symbol, timeframe, cleaned)
+            elif out_dir is not None:
+                cleaned.write_parquet(os.path.join(out_dir, f"part-{n:05d}.parquet"))
+        self.report["gaps"] = pl.concat(gaps) if gaps else None
+        return self.report
+
+    def _batches(self, report: Optional[dict] = None):
+        """Yields batches with non increasing timestamps dropped, and the step from the previous row in '_step'."""
+        last = None  # Latest timestamp kept, in epoch microseconds. Carried across batches.
+        for batch in self.source.collect_batches(chunk_size=self.batch_size):
+            epochs = batch["timestamp"].dt.epoch("us")
+            # Kept timestamps are increasing, so the max of every earlier row is the last kept timestamp.
+            previous_max = epochs.cum_max().shift(1, fill_value=last)
+            if last is not None:
+                previous_max = previous_max.clip(lower_bound=last)
+            keep = previous_max.is_null() | (epochs > previous_max)
+            if report is not None:
+                report["rows_in"] += len(batch)
+                report["duplicates"] += int((epochs == previous_max).sum())
+                report["out_of_order"] += int((epochs < previous_max).sum())
+            batch = batch.with_columns((epochs - previous_max).alias("_step")).filter(keep)
+            if len(batch):
+                last = batch["timestamp"].dt.epoch("us")[-1]
+                yield batch
+
+    def _globalThresholds(self) -> tuple:
+        high, low = RunningStats(), RunningStats()
+        for batch in self._batches():
+            difs = batch.select(wickDeviations())
+            high.update(difs["high_dif"].to_numpy())
+            low.update(difs["low_dif"].to_numpy())
+        return high.mean + high.std * self.stdvs, low.mean + low.std * self.stdvs
+
+    def _rollingThresholds(self, batch: pl.DataFrame, tail: pl.DataFrame) -> tuple:
+        """Thresholds over the previous window rows, including the tail of the previous batches.
+
+        The row being checked isn't part of its own window, so an outlier doesn't raise its own threshold.
+        """
+        difs = pl.concat([tail, batch.select("high_dif", "low_dif")])
+        thresholds = difs.select(
+            (pl.col(col).rolling_mean(self.window, min_samples=2)
+             + pl.col(col).rolling_std(self.window, min_samples=2) * self.stdvs).shift(1).alias(col)
+            for col in ("high_dif", "low_dif")
+        ).tail(len(batch))
+        return thresholds["high_dif"], thresholds["low_dif"], difs.tail(self.window)
@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+import polars as pl
+
+_MICROSECOND = timedelta(microseconds=1)
+_EPOCH = datetime(1970, 1, 1)
+
+
+class RateLimiter():
+    """Token bucket shared by the download threads. acquire() blocks until a request may be sent."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        """:param rate: requests per second.
+        :param burst: requests that may be sent back to back after an idle period.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AlpacaCryptoClient():
+    """Bar client for Alpaca's crypto historical data API. alpaca-py is imported on first use."""
+
+    def __init__(self, api_key: Optional[str] = None, secret_key: Optional[str] = None):
+        from alpaca.data import CryptoHistoricalDataClient
+        self.client = CryptoHistoricalDataClient(api_key=api_key, secret_key=secret_key)
+
+    def fetchBars(self, symbol: str, timeframe: str, start: datetime, end: datetime) -> pl.DataFrame:
+        """Returns the bars of symbol with start <= timestamp < end. Timestamps are naive UTC.
+
+        :param symbol: currency pair supported by alpaca, e.g. 'BTC/USD'.
+        :param timeframe: e.g. '1m', '1h' or '1d'.
+        """
+        from alpaca.data.requests import CryptoBarsRequest
+        from alpaca.data.timeframe import TimeFrame, TimeFrameUnit
+        amount, unit = parseTimeframe(timeframe)
+        units = {"m": TimeFrameUnit.Minute, "h": TimeFrameUnit.Hour, "d": TimeFrameUnit.Day}
+        request_params = CryptoBarsRequest(symbol_or_symbols=[symbol], timeframe=TimeFrame(amount, units[unit]),
+                                           start=start, end=end)
+        bars = self.client.get_crypto_bars(request_params).data.get(symbol, [])
+        df = pl.DataFrame({
+            "timestamp": [bar.timestamp for bar in bars],
+            "open": [bar.open for bar in bars],
+            "high": [bar.high for bar in bars],
+            "low": [bar.low for bar in bars],
+            "close": [bar.close for bar in bars],
+            "volume": [bar.volume for bar in bars],
+        }, schema_overrides={"timestamp": pl.Datetime("us", "UTC")})
+        df = df.with_columns(pl.col("timestamp").dt.replace_time_zone(None))
+        return df.filter((pl.col("timestamp") >= start) & (pl.col("timestamp") < end))
+
+
+class FrameBarClient():
+    """Serves bars from local DataFrames, standing in for a remote API in offline runs and tests."""
+
+    def __init__(self, frames: dict, latency: float = 0.0):
+        """:param frames: dict of symbol to DataFrame of bars.
+        :param latency: seconds to sleep per request, to mimic a network round trip.
+        """
+        self.frames = frames
+        self.latency = latency
+        self.requests = 0
+
+    def fetchBars(self, symbol: str, timeframe: str, start: datetime, end: datetime) -> pl.DataFrame:
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        df = self.frames[symbol]
+        return df.filter((pl.col("timestamp") >= start) & (pl.col("timestamp") < end))
+
+
+class BarDownloader():
+    """Concurrent, resumable downloader writing chunked requests into a BarStore.
+
+    The requested range is split into time chunks, which are fetched across symbols on a thread pool under a
+    shared rate limit. Each chunk is written to the store as soon as it arrives, then marked done in a progress
+    file in the store. An interrupted job re-run with the same arguments only fetches the ranges not yet done.
+    """
+
+    def __init__(self, client, store, chunk: timedelta = timedelta(days=30), max_workers: int = 8,
+                 rate_limit: float = 3.0, retries: int = 3):
+        """:param client: object with fetchBars(symbol, timeframe, start, end) returning bars with
+                       start <= timestamp < end, such as AlpacaCryptoClient or FrameBarClient.
+        :param store: BarStore to write to.
+        :param chunk: time span of one request.
+        :param max_workers: requests in flight at once.
+        :param rate_limit: requests per second across all workers.
+        :param retries: attempts per chunk before the error is raised.
+        """
+        self.client = client
+        self.store = store
+        self.chunk = chunk
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(rate_limit, burst=max_workers)
+        self.retries = retries
+        self._lock = threading.Lock()
+
+    def download(self, symbols: list, timeframe: str, start: datetime, end: datetime) -> dict:
+        """Downloads [start, end) of every symbol into the store.
+
+        :return: dict of symbol to rows written by this call.
+        """
+        jobs = [(symbol, chunk_start, chunk_end) for symbol in symbols
+                for chunk_start, chunk_end in self.missingChunks(symbol, timeframe, start, end)]
+        written = {symbol: 0 for symbol in symbols}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._fetchChunk, symbol, timeframe, chunk_start, chunk_end): symbol
+                       for symbol, chunk_start, chunk_end in jobs}
+            for future in as_completed(futures):
+                written[futures[future]] += future.result()
+        return written
+
+    def missingChunks(self, symbol: str, timeframe: str, start: datetime, end: datetime) -> list:
+        """Chunks of [start, end) not yet marked done for symbol, as (start, end) datetime pairs."""
+        done = sorted(self._loadProgress(symbol, timeframe))
+        missing = []
+        cursor = _toEpoch(start)
+        end_us = _toEpoch(end)
+        for done_start, done_end in done:
+            if done_end <= cursor:
+                continue
+            if done_start >= end_us:
+                break
+            if done_start > cursor:
+                missing.append((cursor, done_start))
+            cursor = max(cursor, done_end)
+        if cursor < end_us:
+            missing.append((cursor, end_us))
+
+        chunk_us = self.chunk // _MICROSECOND
+        chunks = []
+        for gap_start, gap_end in missing:
+            for chunk_start in range(gap_start, gap_end, chunk_us):
+                chunks.append((_fromEpoch(chunk_start), _fromEpoch(min(chunk_start + chunk_us, gap_end))))
+        return chunks
+
+    def _fetchChunk(self, symbol, timeframe, start, end) -> int:
+        for attempt in range(self.retries):
+            self.limiter.acquire()
+            try:
+                df = self.client.fetchBars(symbol, timeframe, start, end)
+                break
+            except Exception:
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(2 ** attempt)  # Back off before retrying.
+        written = self.store.write(symbol, timeframe, df)
+        self._markDone(symbol, timeframe, start, end)  # Only after the bars are safely in the store.
+        return written
+
+    def _progressPath(self, symbol, timeframe) -> str:
+        return os.path.join(self.store.root, "_downloads", f"{symbol.replace('/', '_')}_{timeframe}.json")
+
+    def _loadProgress(self, symbol, timeframe) -> list:
+        path = self._progressPath(symbol, timeframe)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [tuple(span) for span in json.load(f)]
+
+    def _markDone(self, symbol, timeframe, start, end) -> None:
+        with self._lock:
+            done = self._loadProgress(symbol, timeframe)
+            done.append((_toEpoch(start), _toEpoch(end)))
+            path = self._progressPath(symbol, timeframe)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump(_mergeSpans(done), f)
+            os.replace(path + ".tmp", path)
+
+
+def parseTimeframe(timeframe: str) -> tuple:
+    """Splits a timeframe string such as '15m' into (15, 'm'). Units are s, m, h and d."""
+    match = re.fullmatch(r"(\d+)([smhd])", timeframe)
+    if match is None:
+        raise ValueError(f"Invalid timeframe {timeframe}. Use a number followed by s, m, h or d, e.g. '5m'.")
+    return int(match.group(1)), match.group(2)
+
+
+def _mergeSpans(spans: list) -> list:
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _toEpoch(timestamp: datetime) -> int:
+    """Epoch microseconds of timestamp. Naive timestamps are taken as UTC, aware ones are converted to UTC."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return (timestamp - _EPOCH) // _MICROSECOND
+
+
+def _fromEpoch(epoch: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=epoch)